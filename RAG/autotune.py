@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+"""
+Per-host tuning of llama.cpp runtime parameters for the local GGUF models
+
+Run once per machine (and again after adding models):
+
+    python -m RAG.autotune --models-dir ./models
+
+Each model is benchmarked with different thread counts, batch sizes,
+mmap/mlock and context sizes. The fastest settings are written to a profile
+named after the host, which LocalLLMEngine.load_model picks up.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+PROFILE_VERSION = 1
+
+# A typical RAG request: a few retrieved chunks in, a short answer out
+PROMPT_TOKENS = 512
+GENERATED_TOKENS = 64
+# Settings within this fraction of the best are treated as equally fast
+TOLERANCE = 0.05
+
+BENCH_TEXT = (
+    "The quarterly report lists network outages, the affected routers and the "
+    "time needed to restore service. Each incident has an error code, a short "
+    "description and the name of the engineer who closed it. "
+)
+
+
+def host_id():
+    """Name of this machine's profile; the CPU count is part of it so a resized VM is re-tuned"""
+    return f"{socket.gethostname()}-{platform.machine()}-{os.cpu_count()}cpu"
+
+
+def profile_path(folder):
+    return os.path.join(folder, f"{host_id()}.json")
+
+
+def load_profile(folder):
+    """Return {model file name: settings} for this host, or {} if it was never tuned"""
+    path = profile_path(folder)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        profile = json.load(f)
+    if profile.get("version") != PROFILE_VERSION:
+        logger.warning("Ignoring autotune profile %s written by another version", path)
+        return {}
+    return profile.get("models", {})
+
+
+def model_profile(folder, model_name, model_path):
+    """Tuning results for one model, or {} if it was not tuned or its file has changed since"""
+    entry = load_profile(folder).get(model_name)
+    if not entry or entry.get("size") != os.path.getsize(model_path):
+        return {}
+    return entry
+
+
+def model_settings(folder, model_name, model_path):
+    """Tuned llama.cpp keyword arguments for one model"""
+    return model_profile(folder, model_name, model_path).get("params", {})
+
+
+def save_profile(folder, models):
+    os.makedirs(folder, exist_ok=True)
+    path = profile_path(folder)
+    profile = {"version": PROFILE_VERSION, "host": host_id(), "models": {}}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            previous = json.load(f)
+        if previous.get("version") == PROFILE_VERSION:
+            profile["models"].update(previous.get("models", {}))
+    profile["models"].update(models)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def benchmark(model_path, params, prompt_tokens=PROMPT_TOKENS, generated_tokens=GENERATED_TOKENS):
+    """Load the model with params and measure prompt-eval and generation tokens/sec"""
+    from llama_cpp import Llama
+
+    start = time.perf_counter()
+    llm = Llama(model_path=model_path, verbose=False, **params)
+    load_seconds = time.perf_counter() - start
+    try:
+        text = BENCH_TEXT * (prompt_tokens // 30 + 1)
+        tokens = llm.tokenize(text.encode("utf-8"))[:min(prompt_tokens, llm.n_ctx() - generated_tokens - 1)]
+
+        # The first token costs the prompt evaluation, the rest are generation
+        start = time.perf_counter()
+        generator = llm.generate(tokens, temp=0.0)
+        next(generator)
+        prompt_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        generated = 0
+        for _ in range(generated_tokens - 1):
+            next(generator)
+            generated += 1
+        generate_seconds = time.perf_counter() - start
+        generator.close()
+    finally:
+        del llm
+
+    prompt_tps = len(tokens) / prompt_seconds if prompt_seconds else 0.0
+    generate_tps = generated / generate_seconds if generate_seconds else 0.0
+    return {
+        "params": dict(params),
+        "load_seconds": load_seconds,
+        "prompt_tokens_per_sec": prompt_tps,
+        "generate_tokens_per_sec": generate_tps,
+        # Seconds for the typical request above, lower is better
+        "request_seconds": (PROMPT_TOKENS / prompt_tps if prompt_tps else float("inf"))
+                           + (GENERATED_TOKENS / generate_tps if generate_tps else float("inf")),
+    }
+
+
+def thread_candidates(cpus):
+    """Powers of two up to the CPU count, plus the count itself and half of it (physical cores)"""
+    counts = {cpus, max(1, cpus // 2)}
+    n = 1
+    while n < cpus:
+        counts.add(n)
+        n *= 2
+    return sorted(counts)
+
+
+def context_candidates(model_path):
+    """Context sizes to try, capped at the size the model was trained with"""
+    from llama_cpp import Llama
+
+    llm = Llama(model_path=model_path, n_ctx=256, vocab_only=True, verbose=False)
+    arch = llm.metadata.get("general.architecture")
+    trained = int(llm.metadata.get(f"{arch}.context_length", 4096))
+    del llm
+    return [n for n in (2048, 4096, 8192) if n <= trained] or [trained]
+
+
+def tune_model(model_path, quick=False):
+    """Coordinate search over the llama.cpp settings; returns (best params, all results)"""
+    results = []
+
+    def run(params):
+        result = benchmark(model_path, params)
+        results.append(result)
+        logger.info("%s: prompt %.1f tok/s, generation %.1f tok/s, load %.2fs",
+                    params, result["prompt_tokens_per_sec"], result["generate_tokens_per_sec"],
+                    result["load_seconds"])
+        return result
+
+    best = {"n_ctx": 2048, "n_batch": 512, "n_threads": max(1, (os.cpu_count() or 4) // 2),
+            "use_mmap": True, "use_mlock": False}
+
+    # Generation is memory-bound and prompt evaluation compute-bound, so each
+    # gets its own thread count
+    threads = thread_candidates(os.cpu_count() or 4)
+    if quick:
+        threads = [n for n in threads if n >= max(threads) // 4]
+    by_threads = [run(dict(best, n_threads=n, n_threads_batch=n)) for n in threads]
+    best["n_threads"] = max(by_threads, key=lambda r: r["generate_tokens_per_sec"])["params"]["n_threads"]
+    best["n_threads_batch"] = max(by_threads, key=lambda r: r["prompt_tokens_per_sec"])["params"]["n_threads"]
+
+    for batch in ([256, 512] if quick else [128, 256, 512, 1024]):
+        run(dict(best, n_batch=batch))
+    best["n_batch"] = max((r for r in results if r["params"].get("n_threads_batch") == best["n_threads_batch"]
+                           and r["params"]["n_threads"] == best["n_threads"]),
+                          key=lambda r: r["prompt_tokens_per_sec"])["params"]["n_batch"]
+
+    memory = [run(dict(best, use_mmap=mmap, use_mlock=mlock))
+              for mmap, mlock in ((True, False), (False, False), (True, True))]
+    fastest = min(memory, key=lambda r: r["request_seconds"])
+    best["use_mmap"], best["use_mlock"] = fastest["params"]["use_mmap"], fastest["params"]["use_mlock"]
+    reference = fastest["request_seconds"]
+
+    # The largest context that costs no more than the tolerance
+    for n_ctx in context_candidates(model_path):
+        if n_ctx == best["n_ctx"]:
+            continue
+        result = run(dict(best, n_ctx=n_ctx))
+        if result["request_seconds"] <= reference * (1 + TOLERANCE) and n_ctx > best["n_ctx"]:
+            best["n_ctx"] = n_ctx
+
+    return best, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark llama.cpp settings and write this host's profile")
+    parser.add_argument("--models-dir", default="./models", help="Folder with the GGUF models")
+    parser.add_argument("--model", action="append", help="Model file to tune (default: all)")
+    parser.add_argument("--profile-dir", default=None, help="Where to write profiles (default: <models-dir>/.autotune)")
+    parser.add_argument("--quick", action="store_true", help="Try fewer settings")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    models = args.model or sorted(f for f in os.listdir(args.models_dir) if f.endswith('.gguf'))
+    profile_dir = args.profile_dir or os.path.join(args.models_dir, ".autotune")
+    tuned = {}
+    for model_name in models:
+        model_path = os.path.join(args.models_dir, model_name)
+        logger.info("Tuning %s", model_name)
+        params, results = tune_model(model_path, quick=args.quick)
+        final = next((r for r in reversed(results) if r["params"] == params), None) or benchmark(model_path, params)
+        tuned[model_name] = {
+            "size": os.path.getsize(model_path),
+            "params": params,
+            "prompt_tokens_per_sec": final["prompt_tokens_per_sec"],
+            "generate_tokens_per_sec": final["generate_tokens_per_sec"],
+            "tuned_at": time.time(),
+            "results": results,
+        }
+        print(f"{model_name}: {params}")
+        print(f"  prompt eval {final['prompt_tokens_per_sec']:.1f} tok/s, "
+              f"generation {final['generate_tokens_per_sec']:.1f} tok/s")
+    path = save_profile(profile_dir, tuned)
+    print(f"Profile written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Persistent BM25 inverted index over the indexed chunks
+"""
+
+import heapq
+import json
+import math
+import queue
+import re
+import sqlite3
+import threading
+from collections import Counter
+from itertools import islice
+
+SCHEMA_VERSION = 2  # chunk ids are the vector index's; postings clustered by term
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    chunk_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, chunk_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Identifiers, error codes and dotted / dashed names are kept whole
+TERM_PATTERN = re.compile(r"\w+(?:[.:\-]+\w+)*")
+PART_PATTERN = re.compile(r"[.:\-]+")
+
+
+def tokenize(text):
+    """Lower-cased terms; compound names also yield their parts, so 'os.path' matches 'path'"""
+    terms = []
+    for term in TERM_PATTERN.findall(text.lower()):
+        terms.append(term)
+        if PART_PATTERN.search(term):
+            terms.extend(part for part in PART_PATTERN.split(term) if part)
+    return terms
+
+
+class BM25Index:
+    """Okapi BM25 over chunk text, stored in SQLite under the vector index's chunk ids
+
+    Writes go through one connection and are serialised. Searches use
+    connections of their own and read a committed snapshot (SQLite WAL
+    mode), so they neither wait for a write nor see half of one. Rows may
+    be added before the vector index publishes them and removed after it
+    stops showing them; a search's accept callback keeps only the chunks
+    of the generation it reads.
+    """
+
+    def __init__(self, path, k1=1.2, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # A commit lost to a power cut only leaves the version behind, and that triggers a rebuild
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self._db.executescript("DROP TABLE IF EXISTS postings; DROP TABLE IF EXISTS chunks; "
+                                   "DROP TABLE IF EXISTS meta;")
+            self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._db.executescript(SCHEMA)
+        self._readers = queue.SimpleQueue()  # idle read connections
+        self._db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('chunks', 0), ('total_length', 0)")
+
+    def _add_stats(self, chunks, length):
+        # Kept in the meta table so every search reads the statistics of its own snapshot
+        self._db.executemany("UPDATE meta SET value = value + ? WHERE key = ?",
+                             [(chunks, "chunks"), (length, "total_length")])
+
+    def _read_stats(self, db):
+        """Return (chunk count, average chunk length)"""
+        stats = dict(db.execute("SELECT key, value FROM meta WHERE key IN ('chunks', 'total_length')").fetchall())
+        count = int(stats.get("chunks", 0))
+        return count, int(stats.get("total_length", 0)) / count if count else 0.0
+
+    def _reader(self):
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            return sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+
+    @property
+    def version(self):
+        """Vector index version this inverted index was last synchronised with"""
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return int(row[0]) if row else None
+
+    def _insert(self, chunks, batch_size=1000):
+        # In batches, so adding a large file or rebuilding from the docstore never holds every row at once
+        chunks = iter(chunks)
+        while True:
+            rows, postings = [], []
+            for chunk_id, source, text, metadata in islice(chunks, batch_size):
+                terms = tokenize(text)
+                rows.append((chunk_id, source, len(terms), text, json.dumps(metadata, default=str)))
+                postings.extend((term, chunk_id, tf) for term, tf in Counter(terms).items())
+            if not rows:
+                return
+            self._db.executemany("INSERT INTO chunks (id, source, length, text, metadata) VALUES (?, ?, ?, ?, ?)",
+                                 rows)
+            self._db.executemany("INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)", postings)
+            self._add_stats(len(rows), sum(row[2] for row in rows))
+
+    def _delete(self, chunk_ids, batch_size=500):
+        for start in range(0, len(chunk_ids), batch_size):
+            batch = [int(chunk_id) for chunk_id in chunk_ids[start:start + batch_size]]
+            marks = ",".join("?" * len(batch))
+            rows = self._db.execute(f"SELECT id, length, text FROM chunks WHERE id IN ({marks})", batch).fetchall()
+            if not rows:
+                continue
+            # The terms come from the text again, so postings need no index by chunk
+            self._db.executemany("DELETE FROM postings WHERE term = ? AND chunk_id = ?",
+                                 [(term, chunk_id) for chunk_id, _, text in rows for term in set(tokenize(text))])
+            self._db.execute(f"DELETE FROM chunks WHERE id IN ({marks})", batch)
+            self._add_stats(-len(rows), -sum(length for _, length, _ in rows))
+
+    def _write(self, version, action):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                action()
+                if version is not None:
+                    self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)",
+                                     (str(version),))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def add(self, chunks, version):
+        """Add chunks, an iterable of (chunk id, source, text, metadata), and record the index version"""
+        self._write(version, lambda: self._insert(chunks))
+
+    def remove(self, chunk_ids):
+        """Drop the chunks with these ids"""
+        self._write(None, lambda: self._delete(chunk_ids))
+
+    def rebuild(self, chunks, version):
+        """Re-create the whole index from (chunk id, source, text, metadata) tuples"""
+        def action():
+            self._db.execute("DELETE FROM postings")
+            self._db.execute("DELETE FROM chunks")
+            self._db.execute("UPDATE meta SET value = 0 WHERE key IN ('chunks', 'total_length')")
+            self._insert(chunks)
+        self._write(version, action)
+
+    def search(self, query_text, k=4, accept=None):
+        """Return the k best (score, text, metadata) matches for the query terms
+
+        accept, if given, is called with an array of chunk ids and returns a
+        boolean mask of those that may be ranked.
+        """
+        terms = set(tokenize(query_text))
+        if not terms:
+            return []
+        db = self._reader()
+        # One read transaction, so every statement sees the same committed snapshot
+        db.execute("BEGIN")
+        try:
+            return self._search(db, terms, k, accept)
+        finally:
+            db.execute("COMMIT")
+            self._readers.put(db)
+
+    def _search(self, db, terms, k, accept=None):
+        count, average_length = self._read_stats(db)
+        if not count:
+            return []
+        scores = Counter()
+        for term in terms:
+            postings = db.execute(
+                "SELECT p.chunk_id, p.tf, c.length FROM postings p JOIN chunks c ON c.id = p.chunk_id "
+                "WHERE p.term = ?", (term,)
+            ).fetchall()
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            for chunk_id, tf, length in postings:
+                norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        if accept is None:
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        else:
+            # Nearly every candidate is accepted, so a few more than k usually suffice
+            for limit in (k * 4, len(scores)):
+                ranked = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+                accepted = accept([chunk_id for chunk_id, _ in ranked])
+                best = [item for item, ok in zip(ranked, accepted) if ok][:k]
+                if len(best) == k or limit >= len(scores):
+                    break
+        results = []
+        for chunk_id, score in best:
+            text, metadata = db.execute("SELECT text, metadata FROM chunks WHERE id = ?", (chunk_id,)).fetchone()
+            results.append((score, text, json.loads(metadata)))
+        return results
+
+    def stats(self):
+        with self._lock:
+            terms = self._db.execute("SELECT COUNT(DISTINCT term) FROM postings").fetchone()[0]
+            count, _ = self._read_stats(self._db)
+        return {"chunks": count, "terms": terms}
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=60):
+    """Merge ranked key lists, scoring each key by the sum of 1 / (rrf_k + rank)"""
+    scores = Counter()
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] += 1.0 / (rrf_k + rank)
+    return [key for key, _ in scores.most_common()]
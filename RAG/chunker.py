@@ -0,0 +1,185 @@
+"""
+Token-aware document chunking with per-file-type separator rules
+"""
+
+import os
+import re
+from bisect import bisect_right
+
+from langchain_core.documents import Document
+
+from config import ALLOWED_EXTENSIONS
+
+# Where a chunk may be cut between words: the start of each word or punctuation mark
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Characters per token assumed when the model's tokenizer is not at hand: llama-family BPE
+# vocabularies average about 4 on English prose and fewer on code, numbers and markup
+CHARS_PER_TOKEN = 3
+
+PROSE_SEPARATORS = ["\n\n", "\n", ". ", " "]
+
+# Separators tried in order, coarsest first, where prose rules do not fit
+STRUCTURED_SEPARATORS = {
+    'md': ["\n# ", "\n## ", "\n### ", "\n\n", "\n", ". ", " "],
+    'csv': ["\n", ",", " "],
+    'xlsx': ["\n\n", "\n", "\t", " "],
+    'xls': ["\n\n", "\n", "\t", " "],
+    'json': ["}\n", "\n", ",", " "],
+    'xml': ["\n<", "\n", ">", " "],
+}
+
+SEPARATORS = {ext: STRUCTURED_SEPARATORS.get(ext, PROSE_SEPARATORS) for ext in ALLOWED_EXTENSIONS}
+
+
+def char_token_counter(chars_per_token=CHARS_PER_TOKEN):
+    """Return a token counter that allows one token per chars_per_token characters
+
+    Characters are counted as UTF-8 bytes, so CJK and other scripts that take
+    a token or more per character are not undercounted either.
+    """
+    def count(text):
+        return -(-len(text.encode("utf-8")) // chars_per_token)
+    return count
+
+
+class Chunker:
+    """Split documents into overlapping chunks of at most chunk_size tokens
+
+    token_counter counts the tokens of a text, ideally with the model's own
+    tokenizer; tokenizer names it, so an index knows to re-chunk when it changes.
+    Without one, tokens are bounded by CHARS_PER_TOKEN (see char_token_counter).
+    """
+
+    def __init__(self, chunk_size=256, chunk_overlap=32, token_counter=None, rules=None, tokenizer=None):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        if token_counter is None:
+            token_counter, tokenizer = char_token_counter(), f"chars/{CHARS_PER_TOKEN}"
+        self.token_counter = token_counter
+        self.tokenizer = tokenizer
+        self.rules = rules or {}  # extension -> {"chunk_size", "chunk_overlap", "separators"}
+
+    def _rule(self, source):
+        ext = os.path.splitext(source)[1].lstrip('.').lower()
+        rule = self.rules.get(ext, {})
+        return (
+            rule.get("chunk_size", self.chunk_size),
+            rule.get("chunk_overlap", self.chunk_overlap),
+            rule.get("separators", SEPARATORS.get(ext, PROSE_SEPARATORS)),
+        )
+
+    def _split(self, text, start, end, separators, size):
+        """Break text[start:end] into spans of at most size tokens"""
+        if self.token_counter(text[start:end]) <= size:
+            return [(start, end)]
+
+        for i, separator in enumerate(separators):
+            # Cut after the separator's leading whitespace, so markup such as "# " or "<"
+            # starts the next piece; separators without it stay with the previous piece
+            lead = len(separator) - len(separator.lstrip()) or len(separator)
+            cuts = [m.start() + lead for m in re.finditer(re.escape(separator), text[start:end])]
+            cuts = [start + cut for cut in cuts if 0 < cut < end - start]
+            if not cuts:
+                continue
+            spans = []
+            bounds = [start] + cuts + [end]
+            for piece_start, piece_end in zip(bounds, bounds[1:]):
+                spans.extend(self._split(text, piece_start, piece_end, separators[i + 1:], size))
+            return spans
+
+        # No separator left: cut between words, or inside a word too long on its own
+        words = [m.start() for m in TOKEN_PATTERN.finditer(text, start, end)][1:] + [end]
+        spans = []
+        first = 0  # first of words past start
+        while start < end:
+            cut = self._fit(text, start, words, first, size)
+            if cut is None:
+                cut = self._fit(text, start, range(start + 1, end + 1), 0, size) or start + 1
+            spans.append((start, cut))
+            start = cut
+            first = bisect_right(words, start, first)
+        return spans
+
+    def _fit(self, text, start, cuts, first, size):
+        """The furthest of the ascending cuts[first:] with at most size tokens from start, or None"""
+        low, high = first, len(cuts)
+        while low < high:
+            middle = (low + high) // 2
+            if self.token_counter(text[start:cuts[middle]]) <= size:
+                low = middle + 1
+            else:
+                high = middle
+        return cuts[low - 1] if low > first else None
+
+    def fit_header(self, header, source=""):
+        """The header as repeated above each chunk of source, or None
+
+        A header may take at most half of the chunk size, so wide tables still
+        leave room for their rows: longer ones are cut after their last whole word.
+        """
+        if header is None:
+            return None
+        budget = self._rule(source)[0] // 2
+        if self.token_counter(header) <= budget:
+            return header
+        words = [m.start() for m in TOKEN_PATTERN.finditer(header)][1:]
+        cut = self._fit(header, 0, words, 0, budget)
+        return header[:cut].rstrip() if cut else None
+
+    def split_text(self, text, source="", header=None):
+        """Yield (start, end) character spans of the chunks of text
+
+        Rows from the structured loaders come with a header: chunks then
+        leave room for it (see fit_header) and do not overlap, so each row
+        that fits is in one chunk.
+        """
+        size, overlap, separators = self._rule(source)
+        header = self.fit_header(header, source)
+        if header is not None:
+            size -= self.token_counter(header)
+            overlap = 0
+        window = []  # (start, end, tokens) of the spans in the current chunk
+        tokens = 0
+        for start, end in self._split(text, 0, len(text), separators, size):
+            span_tokens = self.token_counter(text[start:end])
+            if window and tokens + span_tokens > size:
+                yield window[0][0], window[-1][1]
+                # Carry trailing spans over as overlap into the next chunk
+                while window and (tokens > overlap or tokens + span_tokens > size):
+                    tokens -= window.pop(0)[2]
+            window.append((start, end, span_tokens))
+            tokens += span_tokens
+        if window:
+            yield window[0][0], window[-1][1]
+
+    def split_documents(self, documents, source=None):
+        """Lazily yield chunk documents carrying source, start_index and chunk_index
+
+        Chunks of row documents start with the document's header and record
+        the rows they hold in row_start and row_end.
+        """
+        chunk_index = 0
+        for doc in documents:
+            doc_source = source or doc.metadata.get("source", "")
+            doc_metadata = dict(doc.metadata)
+            header = self.fit_header(doc_metadata.pop("header", None), doc_source)
+            row_start = doc_metadata.get("row_start")
+            for start, end in self.split_text(doc.page_content, doc_source, header):
+                text = doc.page_content[start:end]
+                if not text.strip():
+                    continue
+                metadata = dict(doc_metadata, source=doc_source, start_index=start, chunk_index=chunk_index)
+                if row_start is not None:
+                    # Blank rows kept for numbering do not start a chunk
+                    lead = len(text) - len(text.lstrip("\n"))
+                    start, text = start + lead, text[lead:]
+                    metadata["start_index"] = start
+                    metadata["row_start"] = row_start + doc.page_content.count("\n", 0, start)
+                    metadata["row_end"] = metadata["row_start"] + text.rstrip("\n").count("\n")
+                if header is not None:
+                    text = f"{header}\n{text}"
+                chunk_index += 1
+                yield Document(page_content=text, metadata=metadata)
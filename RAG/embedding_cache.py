@@ -0,0 +1,229 @@
+"""
+On-disk embedding cache shared by the SDR and local LLM engines
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    model TEXT PRIMARY KEY,
+    dim INTEGER NOT NULL,
+    next_slot INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS entries (
+    model TEXT NOT NULL,
+    key TEXT NOT NULL,
+    slot INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (model, key)
+);
+CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_used);
+CREATE TABLE IF NOT EXISTS free_slots (
+    model TEXT NOT NULL,
+    slot INTEGER NOT NULL
+);
+"""
+
+MIN_SLOTS = 1024
+
+
+def content_key(text, kind="document"):
+    """Hash a text, keeping query and document embeddings of the same text apart"""
+    return hashlib.sha256(f"{kind}\0{text}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """Embeddings keyed by (model, content hash) with a size budget and LRU eviction
+
+    Vectors live in one memory-mapped float32 file per model; a small SQLite
+    database maps keys to rows and tracks last use. Evicted rows are reused
+    by later inserts, so the files stop growing once the budget is reached.
+    The size is kept in the database with the entries, so caches opened on
+    the same folder, by both engines or by several processes, share one budget.
+    """
+
+    def __init__(self, folder, max_bytes=512 * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._arrays = {}  # model -> (dim, np.memmap)
+        self._lock = threading.Lock()
+
+        os.makedirs(folder, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(folder, "keys.sqlite"), check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def _size(self):
+        return self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM models").fetchone()[0]
+
+    def _array(self, model, dim, min_slots=0):
+        """Return the memmap holding a model's vectors, growing the file when needed"""
+        cached = self._arrays.get(model)
+        if cached is not None and cached[1].shape[0] >= min_slots:
+            return cached[1]
+
+        path = os.path.join(self.folder, re.sub(r"[^\w.-]", "_", model) + ".f32")
+        row_bytes = dim * 4
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        capacity = size // row_bytes
+        if capacity < max(min_slots, 1):
+            capacity = max(min_slots, capacity * 2, MIN_SLOTS)
+            with open(path, 'ab') as f:
+                f.truncate(capacity * row_bytes)
+        array = np.memmap(path, dtype='float32', mode='r+', shape=(capacity, dim))
+        self._arrays[model] = (dim, array)
+        return array
+
+    def get_many(self, model, keys):
+        """Return {key: vector} for the keys present in the cache"""
+        if not keys:
+            return {}
+        with self._lock:
+            row = self._db.execute("SELECT dim FROM models WHERE model = ?", (model,)).fetchone()
+            if row is None:
+                self.misses += len(keys)
+                return {}
+            dim = row[0]
+
+            found = {}
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                found.update(self._db.execute(
+                    f"SELECT key, slot FROM entries WHERE model = ? AND key IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall())
+
+            if found:
+                array = self._array(model, dim, max(found.values()) + 1)
+                now = time.time()
+                self._db.executemany("UPDATE entries SET last_used = ? WHERE model = ? AND key = ?",
+                                     [(now, model, key) for key in found])
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+            return {key: np.array(array[slot]) for key, slot in found.items()}
+
+    def put_many(self, model, items):
+        """Store (key, vector) pairs, evicting least recently used entries over budget"""
+        if not items:
+            return
+        dim = len(items[0][1])
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT dim FROM models WHERE model = ?", (model,)).fetchone()
+                if row is None:
+                    self._db.execute("INSERT INTO models (model, dim) VALUES (?, ?)", (model, dim))
+                elif row[0] != dim:
+                    raise ValueError(f"Cached dimension {row[0]} for '{model}' does not match {dim}")
+
+                now = time.time()
+                added = 0
+                for key, vector in items:
+                    if self._db.execute("SELECT 1 FROM entries WHERE model = ? AND key = ?",
+                                        (model, key)).fetchone():
+                        continue
+                    slot = self._allocate_slot(model)
+                    self._array(model, dim, slot + 1)[slot] = np.asarray(vector, dtype='float32')
+                    self._db.execute("INSERT INTO entries (model, key, slot, last_used) VALUES (?, ?, ?, ?)",
+                                     (model, key, slot, now))
+                    added += dim * 4
+                self._db.execute("UPDATE models SET bytes = bytes + ? WHERE model = ?", (added, model))
+
+                self._evict()
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            if model in self._arrays:
+                self._arrays[model][1].flush()
+
+    def _allocate_slot(self, model):
+        row = self._db.execute("SELECT rowid, slot FROM free_slots WHERE model = ? LIMIT 1", (model,)).fetchone()
+        if row is not None:
+            self._db.execute("DELETE FROM free_slots WHERE rowid = ?", (row[0],))
+            return row[1]
+        slot = self._db.execute("SELECT next_slot FROM models WHERE model = ?", (model,)).fetchone()[0]
+        self._db.execute("UPDATE models SET next_slot = next_slot + 1 WHERE model = ?", (model,))
+        return slot
+
+    def _evict(self):
+        size = self._size()
+        while size > self.max_bytes:
+            victims = self._db.execute(
+                "SELECT e.model, e.key, e.slot, m.dim FROM entries e JOIN models m USING (model) "
+                "ORDER BY e.last_used LIMIT 256"
+            ).fetchall()
+            if not victims:
+                break
+            for model, key, slot, dim in victims:
+                self._db.execute("DELETE FROM entries WHERE model = ? AND key = ?", (model, key))
+                self._db.execute("INSERT INTO free_slots (model, slot) VALUES (?, ?)", (model, slot))
+                self._db.execute("UPDATE models SET bytes = bytes - ? WHERE model = ?", (dim * 4, model))
+                size -= dim * 4
+                self.evictions += 1
+                if size <= self.max_bytes:
+                    break
+
+    def stats(self):
+        """Return hit/miss/eviction counters and current size"""
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            size = self._size()
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only calls the model for texts not in the cache"""
+
+    def __init__(self, embeddings, model_name, cache):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        keys = [content_key(text) for text in texts]
+        cached = self.cache.get_many(self.model_name, keys)
+
+        # Embed each distinct missing text once, even if it repeats in the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model_name, new_items)
+            cached.update((key, np.asarray(vector, dtype='float32')) for key, vector in new_items)
+
+        return [cached[key].tolist() for key in keys]
+
+    def embed_query(self, text):
+        key = content_key(text, kind="query")
+        cached = self.cache.get_many(self.model_name, [key])
+        if key in cached:
+            return cached[key].tolist()
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many(self.model_name, [(key, vector)])
+        return vector
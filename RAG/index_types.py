@@ -0,0 +1,168 @@
+"""
+Choice, construction and evaluation of approximate FAISS search indexes
+"""
+
+import math
+import time
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("auto", "flat", "ivf", "hnsw")
+COMPRESSIONS = (None, "sq8", "pq", "opq")
+
+# PQ needs 39 training points for each of its 256 centroids per sub-quantizer
+PQ_MIN_TRAIN = 39 * 256
+TRAIN_SAMPLE_MAX = 65536
+
+
+class IndexPolicy:
+    """Settings that decide which search index sits in front of the exact vectors
+
+    With index_type "auto" the exact flat index is kept while it is small
+    or fast enough for the latency target; beyond that HNSW is used, and IVF
+    once the corpus is too large for HNSW's memory and build cost.
+
+    compression stores the search index codes as 8-bit scalars ("sq8") or
+    product-quantized ("pq", "opq" with a learned rotation). Compressed
+    searches fetch rerank_factor * k candidates and re-rank them on the
+    exact vectors, which stay memory-mapped on disk.
+    """
+
+    def __init__(self, index_type="auto", latency_target_ms=10.0, flat_max_vectors=50000,
+                 hnsw_max_vectors=1000000, nprobe=16, ef_search=64, hnsw_m=32,
+                 rebuild_delay=5.0, eval_queries=100, eval_k=10,
+                 compression=None, pq_m=None, rerank_factor=4):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression '{compression}', expected one of {COMPRESSIONS}")
+        self.index_type = index_type
+        self.latency_target_ms = latency_target_ms
+        self.flat_max_vectors = flat_max_vectors
+        self.hnsw_max_vectors = hnsw_max_vectors
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.hnsw_m = hnsw_m
+        self.rebuild_delay = rebuild_delay
+        self.eval_queries = eval_queries
+        self.eval_k = eval_k
+        self.compression = compression
+        self.pq_m = pq_m
+        self.rerank_factor = rerank_factor
+
+    def choose(self, n_vectors, flat_latency_ms):
+        """Return the index type to use for a corpus of n_vectors"""
+        if self.index_type != "auto":
+            return self.index_type
+        if n_vectors <= self.flat_max_vectors or flat_latency_ms <= self.latency_target_ms:
+            return "flat"
+        if n_vectors <= self.hnsw_max_vectors:
+            return "hnsw"
+        return "ivf"
+
+    def apply(self, index):
+        """Set the query-time knobs of an approximate index"""
+        space = faiss.ParameterSpace()
+        for name, value in (("nprobe", self.nprobe), ("efSearch", self.ef_search)):
+            try:
+                space.set_index_parameter(index, name, value)
+            except RuntimeError:
+                pass  # the index has no such knob
+
+    def params(self, index_type):
+        params = {}
+        if index_type == "hnsw":
+            params.update(ef_search=self.ef_search, m=self.hnsw_m)
+        if index_type == "ivf":
+            params.update(nprobe=self.nprobe)
+        if self.compression:
+            params.update(rerank_factor=self.rerank_factor)
+        return params
+
+
+def ivf_nlist(n_vectors):
+    """Number of IVF lists: about 4 * sqrt(n), keeping at least 39 training points per list"""
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+
+
+def pq_subquantizers(dim):
+    """Largest divisor of dim that gives one byte per four dimensions or less (16x smaller)"""
+    for m in range(max(1, dim // 4), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def factory_key(index_type, n_vectors, dim, policy):
+    """Return the faiss.index_factory description and effective compression"""
+    compression = policy.compression
+    if compression in ("pq", "opq") and n_vectors < PQ_MIN_TRAIN:
+        compression = "sq8"  # too few vectors to train PQ codebooks
+    m = policy.pq_m or pq_subquantizers(dim)
+    storage = {None: "Flat", "sq8": "SQ8", "pq": f"PQ{m}", "opq": f"PQ{m}"}[compression]
+
+    if index_type == "flat":
+        key = storage
+    elif index_type == "ivf":
+        key = f"IVF{ivf_nlist(n_vectors)},{storage}"
+    elif index_type == "hnsw":
+        key = f"HNSW{policy.hnsw_m},{storage}"
+    else:
+        raise ValueError(f"Unknown index type '{index_type}'")
+    if compression == "opq":
+        key = f"OPQ{m},{key}"
+    return key, compression
+
+
+def build_index(index_type, vectors, policy):
+    """Build an index of the given type over vectors, training it when needed
+
+    Returns (index, factory key, effective compression).
+    """
+    n_vectors, dim = vectors.shape
+    key, compression = factory_key(index_type, n_vectors, dim, policy)
+    index = faiss.index_factory(dim, key)
+    if not index.is_trained:
+        # Training on a sample is as good as on everything and much faster
+        sample = vectors
+        if n_vectors > TRAIN_SAMPLE_MAX:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(n_vectors, TRAIN_SAMPLE_MAX, replace=False)]
+        index.train(sample)
+    index.add(vectors)
+    policy.apply(index)
+    return index, key, compression
+
+
+def bytes_per_vector(index):
+    """Serialized size of an index divided by its vector count, overheads included"""
+    return len(faiss.serialize_index(index)) / max(index.ntotal, 1)
+
+
+def sample_ids(ids, count):
+    """Pick stored chunk ids whose vectors serve as evaluation queries"""
+    rng = np.random.default_rng(0)
+    return np.sort(rng.choice(ids, min(count, len(ids)), replace=False))
+
+
+def timed_search(search, queries, k):
+    """Run search(query, k) for each query row, returning (positions, mean latency in ms)
+
+    search is an index's search method or any callable returning positions
+    in the same shape; rows shorter than k are padded with -1.
+    """
+    start = time.perf_counter()
+    rows = []
+    for i in range(len(queries)):
+        row = np.asarray(search(queries[i:i + 1], k)).reshape(-1)[:k]
+        rows.append(np.pad(row, (0, k - len(row)), constant_values=-1))
+    return np.vstack(rows), (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+
+
+def recall_at_k(exact_positions, positions):
+    """Fraction of the exact top-k neighbours that the approximate search also found"""
+    hits = sum(len(set(exact[exact != -1]) & set(found[found != -1]))
+               for exact, found in zip(exact_positions, positions))
+    total = sum(int((exact != -1).sum()) for exact in exact_positions)
+    return hits / total if total else 1.0
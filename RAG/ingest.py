@@ -0,0 +1,161 @@
+"""
+Background ingestion of uploaded files into the vector index
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+
+from RAG.parsing import ParseError
+
+logger = logging.getLogger(__name__)
+
+# Coarse progress reported for each state of a job
+STATE_PROGRESS = {
+    "queued": 0.0,
+    "parsing": 0.1,
+    "embedding": 0.3,
+    "indexing": 0.9,
+    "done": 1.0,
+    "unchanged": 1.0,
+    "removed": 1.0,
+    "failed": 1.0,
+}
+
+FINAL_STATES = {"done", "unchanged", "removed", "failed"}
+
+
+class IngestionQueue:
+    """Queue of files to index, drained by a pool of worker threads"""
+
+    def __init__(self, vector_index, workers=2):
+        self.vector_index = vector_index
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._jobs = {}  # relative path -> latest job for that file
+        self._jobs_lock = threading.Lock()
+        self._file_locks = {}
+        self._threads = []
+
+    def start(self, scan=True, rescan_interval=None):
+        """Start the worker threads, optionally queueing files changed while offline
+
+        With rescan_interval, the uploads folder is scanned again every that
+        many seconds, for files that reach it other than through submit().
+        """
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"ingest-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if scan or rescan_interval:
+            threading.Thread(target=self._scan, args=(scan, rescan_interval), name="ingest-scan",
+                             daemon=True).start()
+        return self
+
+    def _scan(self, now, interval):
+        if now:
+            self.submit_pending()
+        while interval:
+            time.sleep(interval)
+            self.submit_pending()
+
+    def submit(self, rel_path, sha256=None):
+        """Queue a file for indexing and return a snapshot of its job
+
+        sha256 is the content hash when the caller already knows it, so the
+        file is not read an extra time just to hash it.
+        """
+        with self._jobs_lock:
+            job = self._jobs.get(rel_path)
+            if job and job["state"] == "queued":
+                # Not started yet, so it will read the latest content anyway
+                job["sha256"] = sha256
+                return dict(job)
+            job = {
+                "file": rel_path, "state": "queued", "progress": 0.0, "chunks": 0, "error": None,
+                "queued_at": time.time(), "started_at": None, "finished_at": None, "sha256": sha256,
+            }
+            self._jobs[rel_path] = job
+        self._queue.put(job)
+        return dict(job)
+
+    def submit_pending(self):
+        """Queue every file the index does not reflect yet and no job is under way for"""
+        try:
+            changed, removed = self.vector_index.scan()
+        except Exception as e:
+            logger.error("Scanning %s failed: %s", self.vector_index.upload_folder, e)
+            return 0
+        with self._jobs_lock:
+            pending = [rel_path for rel_path in changed + removed
+                       if rel_path not in self._jobs or self._jobs[rel_path]["state"] in FINAL_STATES]
+        for rel_path in pending:
+            self.submit(rel_path)
+        return len(pending)
+
+    def status(self, rel_path=None):
+        """Return job snapshots, for one file or keyed by file"""
+        with self._jobs_lock:
+            if rel_path is not None:
+                job = self._jobs.get(rel_path)
+                return dict(job) if job else None
+            return {path: dict(job) for path, job in self._jobs.items()}
+
+    def pending(self):
+        """Number of jobs queued or in progress"""
+        with self._jobs_lock:
+            return sum(1 for job in self._jobs.values() if job["state"] not in FINAL_STATES)
+
+    def _update(self, job, state, **fields):
+        with self._jobs_lock:
+            job.update(state=state, progress=STATE_PROGRESS[state], **fields)
+
+    def _file_lock(self, rel_path):
+        with self._jobs_lock:
+            return self._file_locks.setdefault(rel_path, threading.Lock())
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                # Two jobs for the same file must not interleave their index updates
+                with self._file_lock(job["file"]):
+                    self._ingest(job)
+            except Exception as e:
+                logger.error("Ingestion of %s failed: %s", job["file"], e)
+                self._update(job, "failed", error=str(e), finished_at=time.time())
+            finally:
+                self._queue.task_done()
+
+    def _ingest(self, job):
+        rel_path = job["file"]
+        index = self.vector_index
+        self._update(job, "parsing", started_at=time.time())
+
+        if not os.path.exists(os.path.join(index.upload_folder, rel_path)):
+            index.remove_file(rel_path)
+            self._update(job, "removed", finished_at=time.time())
+            return
+
+        entry = index.file_entry(rel_path, job["sha256"])
+        if not index.needs_indexing(rel_path, entry):
+            index.touch_file(rel_path, entry)
+            self._update(job, "unchanged", finished_at=time.time())
+            return
+
+        # Parsing, chunking and embedding run as one stream, a batch at a time; report how many chunks are done
+        try:
+            staged = index.embed_documents(
+                index.chunk_documents(rel_path, index.parse_file(rel_path, entry)),
+                on_batch=lambda done: self._update(job, "embedding", chunks=done)
+            )
+        except ParseError as e:
+            # Record the failure so the startup scan does not retry an unchanged file
+            index.replace_file(rel_path, dict(entry, error=str(e)))
+            raise
+
+        self._update(job, "indexing", chunks=staged.count)
+        index.replace_file(rel_path, entry, staged)
+        self._update(job, "done", finished_at=time.time())
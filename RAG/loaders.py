@@ -0,0 +1,36 @@
+"""
+Document loading helpers for the uploads folder
+"""
+
+import os
+
+from langchain_community.document_loaders import UnstructuredFileLoader
+
+from RAG.structured_loaders import streaming_loader
+
+# Changes whenever load_file's output does, so cached parses and indexes made with older loaders are redone
+LOADER_VERSION = 4
+
+
+def list_upload_files(folder):
+    """Return relative paths of all non-hidden files under folder"""
+    files = []
+    for root, dirs, names in os.walk(folder):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in names:
+            if name.startswith('.'):
+                continue
+            files.append(os.path.relpath(os.path.join(root, name), folder))
+    return sorted(files)
+
+
+def load_file(path):
+    """Lazily parse a single file into LangChain documents
+
+    CSV, JSON, XML and XLSX files are streamed a row or record at a time
+    into blocks of rows; everything else goes through Unstructured.
+    """
+    loader = streaming_loader(path)
+    if loader is not None:
+        return loader(path)
+    return UnstructuredFileLoader(path).lazy_load()
@@ -0,0 +1,206 @@
+"""
+Pool of loaded GGUF models kept within a memory budget
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# KV cache bytes per context token before a model's metadata is known (its
+# first load); typical of 2-3B models, a 7B llama with an f16 cache uses 512 KiB
+DEFAULT_KV_BYTES_PER_TOKEN = 128 * 1024
+
+
+def kv_cache_bytes(metadata, n_ctx, default_per_token=DEFAULT_KV_BYTES_PER_TOKEN):
+    """Estimate the f16 KV cache size from GGUF metadata (layers, embedding width, KV heads)"""
+    arch = metadata.get("general.architecture")
+    try:
+        layers = int(metadata[f"{arch}.block_count"])
+        width = int(metadata[f"{arch}.embedding_length"])
+        heads = int(metadata[f"{arch}.attention.head_count"])
+        kv_heads = int(metadata.get(f"{arch}.attention.head_count_kv", heads))
+    except (KeyError, TypeError, ValueError):
+        return n_ctx * default_per_token
+    # K and V, 2 bytes each, for every layer; grouped-query attention shrinks the width
+    return n_ctx * layers * 2 * 2 * width * kv_heads // heads
+
+
+class ModelPool:
+    """Loaded models by name, evicting the least recently used beyond budget_bytes
+
+    A model's cost is its file size plus its KV cache for the context size,
+    plus extra_bytes for anything held alongside it (e.g. saved prompt states),
+    plus extra_for(name, model) for what depends on the model (e.g. its draft
+    model; model is None before it is loaded),
+    plus whatever is reported through hold() while it is loaded (e.g. the
+    states of generation requests parked by its scheduler).
+    Models idle for idle_ttl seconds are unloaded by a background sweep.
+    Models in use (see use()) are never evicted; if they alone exceed the
+    budget the new model is loaded anyway and a warning is logged.
+    """
+
+    def __init__(self, load, path_for, budget_bytes, n_ctx=2048, idle_ttl=600.0,
+                 kv_bytes_per_token=DEFAULT_KV_BYTES_PER_TOKEN, extra_bytes=0, extra_for=None):
+        self.load = load
+        self.path_for = path_for
+        self.budget_bytes = budget_bytes
+        self.n_ctx = n_ctx
+        self.idle_ttl = idle_ttl
+        self.kv_bytes_per_token = kv_bytes_per_token
+        self.extra_bytes = extra_bytes
+        self.extra_for = extra_for
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+        self.idle_unloads = 0
+        self.load_seconds = 0.0
+        self.last_load_seconds = {}
+        self._models = OrderedDict()  # name -> {"model", "bytes", "last_used", "in_use"}
+        self._lock = threading.Lock()
+        self._loading = {}  # name -> Event set when that load finishes
+        self._sizes = {}  # name -> size measured at its last load
+        if idle_ttl:
+            threading.Thread(target=self._sweep, name="model-pool-sweep", daemon=True).start()
+
+    def estimate_bytes(self, name, model=None):
+        """File size plus KV cache, refined from the model metadata once loaded"""
+        if model is None and name in self._sizes:
+            return self._sizes[name]
+        size = os.path.getsize(self.path_for(name))
+        metadata = getattr(model, "metadata", None) or {}
+        # A loaded model knows its own context size, which may be tuned per model
+        n_ctx = model.n_ctx() if hasattr(model, "n_ctx") else self.n_ctx
+        extra = self.extra_bytes + (self.extra_for(name, model) if self.extra_for else 0)
+        return size + kv_cache_bytes(metadata, n_ctx, self.kv_bytes_per_token) + extra
+
+    def _resident_bytes(self):
+        return sum(entry["bytes"] for entry in self._models.values())
+
+    def _evict_for(self, needed, action="loading anyway"):
+        """Drop least recently used idle models until needed bytes fit"""
+        for name in list(self._models):
+            if self._resident_bytes() + needed <= self.budget_bytes:
+                return
+            if self._models[name]["in_use"]:
+                continue
+            del self._models[name]
+            self.evictions += 1
+            logger.info("Evicted model %s to fit the %d MB budget", name, self.budget_bytes // (1024 * 1024))
+        if self._resident_bytes() + needed > self.budget_bytes:
+            logger.warning("%d MB needed with %d MB in use exceeds the %d MB budget; %s",
+                           needed // (1024 * 1024), self._resident_bytes() // (1024 * 1024),
+                           self.budget_bytes // (1024 * 1024), action)
+
+    def _acquire(self, name):
+        while True:
+            with self._lock:
+                entry = self._models.get(name)
+                if entry is not None:
+                    self._models.move_to_end(name)
+                    entry["last_used"] = time.time()
+                    entry["in_use"] += 1
+                    self.hits += 1
+                    return entry["model"]
+                pending = self._loading.get(name)
+                if pending is None:
+                    pending = self._loading[name] = threading.Event()
+                    break
+            # Another thread is loading this model; wait and take it from the pool
+            pending.wait()
+
+        # From here on _loading[name] must be cleared whatever fails, or every later caller waits forever
+        try:
+            needed = self.estimate_bytes(name)
+            with self._lock:
+                self._evict_for(needed)
+            start = time.perf_counter()
+            model = self.load(name)
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                size = self._sizes[name] = self.estimate_bytes(name, model)
+                self._evict_for(size)
+                self._models[name] = {"model": model, "bytes": size, "last_used": time.time(), "in_use": 1}
+                self.loads += 1
+                self.load_seconds += elapsed
+                self.last_load_seconds[name] = elapsed
+            logger.info("Loaded model %s in %.2fs (%d MB)", name, elapsed, size // (1024 * 1024))
+            return model
+        finally:
+            with self._lock:
+                del self._loading[name]
+            pending.set()
+
+    def hold(self, name, delta):
+        """Count delta more (or, if negative, fewer) bytes held alongside a loaded model
+
+        Idle models are evicted when the addition takes the pool over budget.
+        """
+        with self._lock:
+            entry = self._models.get(name)
+            if entry is None:
+                return
+            entry["bytes"] += delta
+            if delta > 0:
+                self._evict_for(0, "keeping them")
+
+    def _release(self, name):
+        with self._lock:
+            entry = self._models.get(name)
+            if entry is not None:
+                entry["in_use"] -= 1
+                entry["last_used"] = time.time()
+
+    def loaded(self, name):
+        """The model if it is resident, else None; neither loads it nor counts as a use"""
+        with self._lock:
+            entry = self._models.get(name)
+            return entry["model"] if entry is not None else None
+
+    @contextmanager
+    def use(self, name):
+        """Yield the loaded model, keeping it resident until the block exits"""
+        model = self._acquire(name)
+        try:
+            yield model
+        finally:
+            self._release(name)
+
+    def evict_idle(self):
+        """Unload models unused for idle_ttl seconds; return their names"""
+        now = time.time()
+        with self._lock:
+            idle = [name for name, entry in self._models.items()
+                    if not entry["in_use"] and now - entry["last_used"] > self.idle_ttl]
+            for name in idle:
+                del self._models[name]
+                self.idle_unloads += 1
+        for name in idle:
+            logger.info("Unloaded model %s after %.0fs idle", name, self.idle_ttl)
+        return idle
+
+    def _sweep(self):
+        while True:
+            time.sleep(max(self.idle_ttl / 4, 1.0))
+            self.evict_idle()
+
+    def stats(self):
+        """Return residency, counters and load latency"""
+        with self._lock:
+            return {
+                "budget_bytes": self.budget_bytes,
+                "resident_bytes": self._resident_bytes(),
+                "resident": {name: {"bytes": entry["bytes"], "in_use": entry["in_use"],
+                                    "idle_seconds": time.time() - entry["last_used"]}
+                             for name, entry in self._models.items()},
+                "loads": self.loads,
+                "hits": self.hits,
+                "evictions": self.evictions,
+                "idle_unloads": self.idle_unloads,
+                "mean_load_seconds": self.load_seconds / self.loads if self.loads else 0.0,
+                "last_load_seconds": dict(self.last_load_seconds),
+            }
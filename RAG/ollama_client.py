@@ -0,0 +1,196 @@
+"""
+Ollama client helpers: a shared pooled client, and batched, concurrent embedding calls
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import ollama
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+class OllamaService:
+    """One pooled HTTP client for every generate and embed call to an Ollama server
+
+    Connections are kept open and reused instead of reconnecting per request.
+    Every request carries a keep_alive (per model, else the default) so Ollama
+    keeps the model loaded through quiet periods rather than unloading it
+    after its own 5 minute default and paying the reload on the next query.
+    """
+
+    def __init__(self, host=None, keep_alive="30m", model_keep_alive=None, timeout=300.0,
+                 max_connections=16, client=None):
+        self.host = host
+        self.keep_alive = keep_alive
+        self.model_keep_alive = dict(model_keep_alive or {})
+        self.client = client or ollama.Client(
+            host=host,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.model_loads = 0  # responses where Ollama had to load the model first
+        self.load_seconds = 0.0
+        self.warmup = {}  # model -> {"status", "seconds", "error"}
+
+    def keep_alive_for(self, model):
+        return self.model_keep_alive.get(model, self.keep_alive)
+
+    def _record(self, response=None, error=False):
+        # Ollama reports load_duration in nanoseconds; a few ms is just the lookup of a loaded model
+        load_seconds = (response.get("load_duration") or 0) / 1e9 if response is not None else 0.0
+        with self._stats_lock:
+            self.requests += 1
+            self.errors += int(error)
+            if load_seconds > 0.1:
+                self.model_loads += 1
+                self.load_seconds += load_seconds
+
+    def generate(self, model, prompt, stream=False, **kwargs):
+        """Ollama's generate with this model's keep_alive; stream=True yields the response chunks"""
+        if stream:
+            return self._generate_stream(model, prompt, **kwargs)
+        try:
+            response = self.client.generate(model=model, prompt=prompt, keep_alive=self.keep_alive_for(model),
+                                            **kwargs)
+        except Exception:
+            self._record(error=True)
+            raise
+        self._record(response)
+        return response
+
+    def _generate_stream(self, model, prompt, **kwargs):
+        try:
+            for chunk in self.client.generate(model=model, prompt=prompt, stream=True,
+                                              keep_alive=self.keep_alive_for(model), **kwargs):
+                if chunk.get("done"):
+                    self._record(chunk)
+                yield chunk
+        except Exception:
+            self._record(error=True)
+            raise
+
+    def embed(self, model, input, **kwargs):
+        try:
+            response = self.client.embed(model=model, input=input, keep_alive=self.keep_alive_for(model), **kwargs)
+        except Exception:
+            self._record(error=True)
+            raise
+        self._record(response)
+        return response
+
+    def warm_up(self, models, embedding_models=(), background=True):
+        """Load models into Ollama ahead of the first query
+
+        An empty prompt (or empty input for embedding models) makes Ollama
+        load the model and return without generating. Failures, e.g. a model
+        that was never pulled, are logged and do not stop the others.
+        """
+        jobs = [(model, False) for model in models] + [(model, True) for model in embedding_models]
+        with self._stats_lock:
+            for model, _ in jobs:
+                self.warmup[model] = {"status": "pending", "seconds": None, "error": None}
+
+        def run():
+            for model, embedding in jobs:
+                start = time.perf_counter()
+                try:
+                    if embedding:
+                        self.embed(model, [])
+                    else:
+                        self.generate(model, "")
+                except Exception as e:
+                    logger.warning("Could not warm up model %s: %s", model, e)
+                    result = {"status": "failed", "seconds": None, "error": str(e)}
+                else:
+                    elapsed = time.perf_counter() - start
+                    logger.info("Warmed up model %s in %.2fs (keep_alive=%s)", model, elapsed,
+                                self.keep_alive_for(model))
+                    result = {"status": "ready", "seconds": elapsed, "error": None}
+                with self._stats_lock:
+                    self.warmup[model] = result
+
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, name="ollama-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        """Return request counters, model (re)loads seen by Ollama and warm-up results"""
+        with self._stats_lock:
+            return {
+                "host": self.host,
+                "keep_alive": self.keep_alive,
+                "model_keep_alive": dict(self.model_keep_alive),
+                "requests": self.requests,
+                "errors": self.errors,
+                "model_loads": self.model_loads,
+                "load_seconds": self.load_seconds,
+                "warmup": {model: dict(result) for model, result in self.warmup.items()},
+            }
+
+
+class OllamaBatchEmbeddings(Embeddings):
+    """Embeddings sent to Ollama's /api/embed in batches, with bounded in-flight requests"""
+
+    def __init__(self, model="llama2", host=None, batch_size=32, max_concurrency=4, client=None):
+        """client is an OllamaService or ollama.Client to share; by default a client of its own"""
+        self.model = model
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.client = client or ollama.Client(host=host)
+        # Shared by every caller, so the number of in-flight requests stays bounded
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="ollama-embed")
+        self._stats_lock = threading.Lock()
+        self.texts_embedded = 0
+        self.requests = 0
+        self.busy_seconds = 0.0
+        self.last_texts_per_sec = 0.0
+
+    def _embed_batch(self, batch):
+        response = self.client.embed(model=self.model, input=batch)
+        with self._stats_lock:
+            self.requests += 1
+        return response["embeddings"]
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        start = time.perf_counter()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = list(self._executor.map(self._embed_batch, batches))
+        elapsed = time.perf_counter() - start
+
+        with self._stats_lock:
+            self.texts_embedded += len(texts)
+            self.busy_seconds += elapsed
+            self.last_texts_per_sec = len(texts) / elapsed if elapsed else 0.0
+        logger.info("Embedded %d texts in %d requests in %.2fs (%.1f texts/s, batch_size=%d, concurrency=%d)",
+                    len(texts), len(batches), elapsed, self.last_texts_per_sec,
+                    self.batch_size, self.max_concurrency)
+        return [vector for batch in results for vector in batch]
+
+    def embed_query(self, text):
+        return self._embed_batch([text])[0]
+
+    def stats(self):
+        """Return throughput counters for tuning batch size and concurrency"""
+        with self._stats_lock:
+            return {
+                "model": self.model,
+                "batch_size": self.batch_size,
+                "max_concurrency": self.max_concurrency,
+                "texts": self.texts_embedded,
+                "requests": self.requests,
+                "texts_per_sec": self.texts_embedded / self.busy_seconds if self.busy_seconds else 0.0,
+                "last_texts_per_sec": self.last_texts_per_sec,
+            }
@@ -0,0 +1,241 @@
+"""
+Routing of Ollama requests across several hosts on the LAN
+"""
+
+import logging
+import threading
+import time
+
+import ollama
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest request in a host's latency average
+LATENCY_SMOOTHING = 0.2
+
+
+def model_key(name):
+    """Ollama reports "llama2:latest" for a model requested as "llama2" """
+    return name if ":" in name else f"{name}:latest"
+
+
+class OllamaBackend:
+    """One Ollama host: its OllamaService plus health, load and latency bookkeeping"""
+
+    def __init__(self, service, health_timeout=2.0):
+        self.service = service
+        self.host = service.host
+        self.health_client = ollama.Client(host=service.host, timeout=health_timeout)
+        self.healthy = True
+        self.loaded = set()  # model keys Ollama reported loaded, or that we just used
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.failovers = 0  # requests that failed here and were retried elsewhere
+        self.latency_seconds = None  # smoothed
+        self.last_error = None
+        self.last_check = None
+
+    def check(self):
+        """Ask the host which models it has loaded; mark it unhealthy if it does not answer"""
+        try:
+            response = self.health_client.ps()
+        except Exception as e:
+            if self.healthy:
+                logger.warning("Ollama host %s is unhealthy: %s", self.host, e)
+            self.healthy = False
+            self.last_error = str(e)
+        else:
+            if not self.healthy:
+                logger.info("Ollama host %s is healthy again", self.host)
+            self.healthy = True
+            self.loaded = {model_key(model.model or model.name) for model in response.models}
+        self.last_check = time.time()
+
+    def stats(self):
+        return {
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "failovers": self.failovers,
+            "latency_ms": self.latency_seconds * 1000 if self.latency_seconds is not None else None,
+            "loaded_models": sorted(self.loaded),
+            "last_error": self.last_error,
+            "last_check": self.last_check,
+        }
+
+
+class OllamaRouter:
+    """Spreads generate and embed calls over several Ollama hosts
+
+    Each request goes to the healthy host with the fewest requests in
+    flight, counting affinity_slack fewer for hosts that already have the
+    model loaded: a loaded host is preferred until it is that much busier
+    than the others, which avoids a model load per request without piling
+    everything onto one host. Ties go to the lowest latency. A request
+    that fails is retried on the next host, and a host that cannot be
+    reached is skipped until a health check finds it up again. Streams only
+    fail over before their first chunk, so an answer is never spliced from
+    two hosts.
+
+    Has the same generate/embed/warm_up/stats interface as OllamaService.
+    Every host should serve the same embedding model, or vectors from
+    different hosts will not be comparable.
+    """
+
+    def __init__(self, services, health_interval=10.0, health_timeout=2.0, affinity_slack=2):
+        self.backends = [OllamaBackend(service, health_timeout) for service in services]
+        self.health_interval = health_interval
+        self.affinity_slack = affinity_slack
+        self._lock = threading.Lock()
+        self.warmup = {}
+        for backend in self.backends:
+            backend.check()
+        if health_interval:
+            threading.Thread(target=self._health_loop, name="ollama-health", daemon=True).start()
+
+    def _health_loop(self):
+        while True:
+            time.sleep(self.health_interval)
+            for backend in self.backends:
+                backend.check()
+
+    def _pick(self, model, tried):
+        """Take the best host for model not yet in tried, counting the request against it
+
+        Choosing and counting happen under one lock, so requests arriving
+        together spread over the hosts instead of all picking the same one.
+        """
+        key = model_key(model)
+        with self._lock:
+            untried = [b for b in self.backends if b not in tried]
+            # With every remaining host down, trying them is better than failing outright
+            pool = [b for b in untried if b.healthy] or untried
+            backend = min(pool, key=lambda b: (b.in_flight - (self.affinity_slack if key in b.loaded else 0),
+                                               key not in b.loaded, len(b.loaded),
+                                               b.latency_seconds if b.latency_seconds is not None else 0.0))
+            backend.in_flight += 1
+            backend.requests += 1
+            tried.append(backend)
+        return backend, time.perf_counter()
+
+    def _succeeded(self, backend, model, start):
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            backend.in_flight -= 1
+            backend.loaded.add(model_key(model))
+            if backend.latency_seconds is None:
+                backend.latency_seconds = elapsed
+            else:
+                backend.latency_seconds += LATENCY_SMOOTHING * (elapsed - backend.latency_seconds)
+
+    def _failed(self, backend, model, error, retrying):
+        with self._lock:
+            backend.in_flight -= 1
+            backend.errors += 1
+            backend.failovers += int(retrying)
+            backend.last_error = str(error)
+            backend.loaded.discard(model_key(model))
+            # An HTTP error below 500 (e.g. model not pulled there) says nothing about the host's health
+            if not (isinstance(error, ollama.ResponseError) and error.status_code < 500):
+                backend.healthy = False
+        logger.warning("Ollama host %s failed for %s%s: %s", backend.host, model,
+                       ", trying the next host" if retrying else "", error)
+
+    def _call(self, model, fn):
+        """Run fn(service) on the best host, failing over to the others in turn"""
+        tried = []
+        while True:
+            backend, start = self._pick(model, tried)
+            try:
+                result = fn(backend.service)
+            except Exception as e:
+                retrying = len(tried) < len(self.backends)
+                self._failed(backend, model, e, retrying)
+                if not retrying:
+                    raise
+                continue
+            self._succeeded(backend, model, start)
+            return result
+
+    def generate(self, model, prompt, stream=False, **kwargs):
+        """Generate on the best host; stream=True yields the response chunks"""
+        if stream:
+            return self._generate_stream(model, prompt, **kwargs)
+        return self._call(model, lambda service: service.generate(model, prompt, **kwargs))
+
+    def _generate_stream(self, model, prompt, **kwargs):
+        tried = []
+        while True:
+            backend, start = self._pick(model, tried)
+            started = False
+            try:
+                for chunk in backend.service.generate(model, prompt, stream=True, **kwargs):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                retrying = not started and len(tried) < len(self.backends)
+                self._failed(backend, model, e, retrying)
+                if not retrying:
+                    raise
+                continue
+            except BaseException:
+                # The consumer stopped reading (GeneratorExit); the host itself is fine
+                with self._lock:
+                    backend.in_flight -= 1
+                raise
+            self._succeeded(backend, model, start)
+            return
+
+    def embed(self, model, input, **kwargs):
+        return self._call(model, lambda service: service.embed(model, input, **kwargs))
+
+    def warm_up(self, models, embedding_models=(), background=True):
+        """Load each model on one host, spreading models over the hosts
+
+        Models already loaded somewhere stay there; the others go to the
+        host with the fewest loaded models.
+        """
+        jobs = [(model, False) for model in models] + [(model, True) for model in embedding_models]
+        with self._lock:
+            for model, _ in jobs:
+                self.warmup[model] = {"status": "pending", "host": None, "seconds": None, "error": None}
+
+        def run():
+            for model, embedding in jobs:
+                host = None
+                start = time.perf_counter()
+
+                def load(service):
+                    nonlocal host
+                    host = service.host
+                    return service.embed(model, []) if embedding else service.generate(model, "")
+
+                try:
+                    self._call(model, load)
+                except Exception as e:
+                    logger.warning("Could not warm up model %s on any host: %s", model, e)
+                    result = {"status": "failed", "host": None, "seconds": None, "error": str(e)}
+                else:
+                    elapsed = time.perf_counter() - start
+                    logger.info("Warmed up model %s on %s in %.2fs", model, host, elapsed)
+                    result = {"status": "ready", "host": host, "seconds": elapsed, "error": None}
+                with self._lock:
+                    self.warmup[model] = result
+
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, name="ollama-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        """Return per-host health, in-flight requests, latency and loaded models"""
+        with self._lock:
+            return {
+                "hosts": {backend.host: dict(backend.stats(), **{"client": backend.service.stats()})
+                          for backend in self.backends},
+                "warmup": {model: dict(result) for model, result in self.warmup.items()},
+            }
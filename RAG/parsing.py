@@ -0,0 +1,232 @@
+"""
+Parsing of uploaded files in a pool of worker processes
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from RAG.loaders import load_file
+
+logger = logging.getLogger(__name__)
+
+
+class ParseError(Exception):
+    """A file could not be parsed"""
+
+
+class ParseTimeout(ParseError):
+    """Parsing a file took longer than the pool's timeout"""
+
+
+def _context():
+    # Workers are started, and replaced mid-run, by a process already running ingestion, server and
+    # Ollama client threads, and a fork would copy locks those threads hold. The fork server is
+    # started once, single-threaded, with only the loaders imported, so it stays small and never
+    # imports whatever script hosts the engine; spawn is the fallback where there is none
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["RAG.loaders"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+# Documents go from a worker to the pool in messages of about this many characters
+MESSAGE_CHARS = 256 * 1024
+
+
+def _serve(conn, loader):
+    """Worker process loop: parse each path received and stream its documents back
+
+    Sends ("documents", batch) messages as the loader yields, then ("done", batch)
+    or ("error", message). A send blocks while the pool's reader is behind, so
+    the loader only runs a batch or so ahead of it.
+    """
+    while True:
+        try:
+            path = conn.recv()
+        except EOFError:
+            return
+        if path is None:
+            return
+        try:
+            batch, size = [], 0
+            for document in loader(path):
+                batch.append(document)
+                size += len(document.page_content)
+                if size >= MESSAGE_CHARS:
+                    conn.send(("documents", batch))
+                    batch, size = [], 0
+            conn.send(("done", batch))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, context, loader):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child_conn, loader), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def stop(self, kill=False):
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class ParserPool:
+    """Worker processes that parse one file each at a time
+
+    Parsing PDFs and Office files is CPU-bound, so threads would share one
+    core through the GIL; processes use them all. A file that does not
+    finish within timeout seconds has its worker killed and replaced, so a
+    pathological document fails on its own instead of stalling the others.
+    parse() streams each file's documents to the calling thread as they
+    are parsed, so callers such as the ingestion threads keep their own
+    control flow and never hold a whole file. Workers are started as
+    files arrive, so an engine that never parses never starts any.
+    """
+
+    def __init__(self, workers=None, timeout=120.0, loader=load_file):
+        self.workers = workers or os.cpu_count() or 2
+        self.timeout = timeout
+        self.loader = loader
+        self._context = _context()
+        self._idle = queue.Queue()
+        self._started = 0
+        self._lock = threading.Lock()
+        self.files = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.bytes = 0
+        self.parse_seconds = 0.0  # summed over files
+        self._active = 0
+        self._active_since = None
+        self.active_seconds = 0.0  # wall time with at least one file being parsed
+
+    def _begin(self):
+        with self._lock:
+            if self._active == 0:
+                self._active_since = time.perf_counter()
+            self._active += 1
+
+    def _end(self, size, elapsed, failed=False, timed_out=False):
+        with self._lock:
+            self._active -= 1
+            if self._active == 0:
+                self.active_seconds += time.perf_counter() - self._active_since
+            self.files += 1
+            self.bytes += size
+            self.parse_seconds += elapsed
+            self.failures += int(failed)
+            self.timeouts += int(timed_out)
+
+    def _take(self):
+        """An idle worker, starting another while fewer than workers are running"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            start = self._started < self.workers
+            self._started += int(start)
+        if start:
+            try:
+                return _Worker(self._context, self.loader)
+            except BaseException:
+                with self._lock:
+                    self._started -= 1
+                raise
+        return self._idle.get()
+
+    def parse(self, path):
+        """Yield the documents of one file as a worker process parses them; raises ParseError
+
+        The worker is held until its documents are all read, and at most a
+        message or two of them is in flight, so memory does not grow with
+        the file. Only time spent waiting for the worker counts towards the
+        timeout, not time the caller spends on the documents. A worker left
+        mid-file (timed out, crashed or the caller stopped reading) is
+        killed and replaced.
+        """
+        size = os.path.getsize(path)
+        worker = self._take()
+        self._begin()
+        waited = 0.0
+        finished = failed = timed_out = False
+        try:
+            worker.conn.send(path)
+            while not finished:
+                start = time.perf_counter()
+                ready = worker.conn.poll(max(self.timeout - waited, 0))
+                waited += time.perf_counter() - start
+                if not ready:
+                    failed = timed_out = True
+                    logger.warning("Parsing %s timed out after %.0fs; worker restarted", path, self.timeout)
+                    raise ParseTimeout(f"Parsing timed out after {self.timeout:.0f}s")
+                try:
+                    status, result = worker.conn.recv()
+                except (EOFError, OSError):
+                    # The worker died, e.g. a parser crashed the process
+                    failed = True
+                    raise ParseError("Parser process exited unexpectedly")
+                finished = status != "documents"
+                if status == "error":
+                    failed = True
+                    raise ParseError(result)
+                yield from result
+        finally:
+            if not finished:
+                worker.stop(kill=True)
+                worker = _Worker(self._context, self.loader)
+            self._end(size, waited, failed=failed, timed_out=timed_out)
+            self._idle.put(worker)
+
+    def parse_many(self, paths):
+        """Parse files concurrently, yielding (path, documents, error) as each finishes"""
+        def run(path):
+            try:
+                return path, list(self.parse(path)), None
+            except ParseError as e:
+                return path, None, e
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="parse") as executor:
+            for future in as_completed([executor.submit(run, path) for path in paths]):
+                yield future.result()
+
+    def close(self):
+        """Stop the worker processes"""
+        with self._lock:
+            started = self._started
+        for _ in range(started):
+            self._idle.get().stop()
+
+    def stats(self):
+        """Return files parsed, failures and throughput while parsing was under way"""
+        with self._lock:
+            active_seconds = self.active_seconds
+            if self._active:
+                active_seconds += time.perf_counter() - self._active_since
+            return {
+                "workers": self.workers,
+                "started": self._started,
+                "timeout_s": self.timeout,
+                "files": self.files,
+                "failures": self.failures,
+                "timeouts": self.timeouts,
+                "mb": self.bytes / (1024 * 1024),
+                "files_per_sec": self.files / active_seconds if active_seconds else 0.0,
+                "mb_per_sec": self.bytes / (1024 * 1024) / active_seconds if active_seconds else 0.0,
+                "mean_parse_s": self.parse_seconds / self.files if self.files else 0.0,
+            }
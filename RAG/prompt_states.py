@@ -0,0 +1,119 @@
+"""
+Evaluated llama.cpp prompt states saved to disk, for warm restarts
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+
+import numpy as np
+
+from RAG.vector_index import file_sha256
+
+logger = logging.getLogger(__name__)
+
+
+class PromptStateStore:
+    """Snapshots of named prompt prefixes, one folder per model fingerprint
+
+    A fingerprint hashes the model file together with the context parameters
+    that shape the state (n_ctx, llama.cpp version), so a snapshot is only
+    ever restored into a model it was taken from. Snapshots of the same model
+    name under any other fingerprint are stale and deleted on load.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self._hashes_path = os.path.join(folder, "model_hashes.json")
+
+    def _read_json(self, path, default):
+        if not os.path.exists(path):
+            return default
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_json(self, path, data):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _model_hash(self, model_path):
+        """SHA-256 of a model file, remembered by path, size and mtime (GGUF files are large)"""
+        stat = os.stat(model_path)
+        hashes = self._read_json(self._hashes_path, {})
+        known = hashes.get(model_path)
+        if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+            return known["sha256"]
+        sha256 = file_sha256(model_path)
+        hashes[model_path] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256}
+        self._write_json(self._hashes_path, hashes)
+        return sha256
+
+    def fingerprint(self, model_path, params):
+        """Return the key snapshots of this model with these context parameters are stored under"""
+        key = json.dumps({"model_sha256": self._model_hash(model_path), **params}, sort_keys=True)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+    def _path(self, fingerprint, name=None):
+        folder = os.path.join(self.folder, fingerprint)
+        if name is None:
+            return folder
+        return os.path.join(folder, re.sub(r"[^\w.-]", "_", name) + ".npz")
+
+    def save(self, fingerprint, model_name, params, name, tokens, state):
+        """Write one snapshot; state is a llama_cpp LlamaState"""
+        folder = self._path(fingerprint)
+        os.makedirs(folder, exist_ok=True)
+        self._write_json(os.path.join(folder, "meta.json"), {"model": model_name, "params": params})
+        path = self._path(fingerprint, name)
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            name=np.array(name),
+            tokens=np.asarray(tokens, dtype=np.intc),
+            input_ids=state.input_ids,
+            scores=state.scores,
+            n_tokens=np.array(state.n_tokens),
+            llama_state=np.frombuffer(state.llama_state, dtype=np.uint8),
+        )
+        os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    def load(self, fingerprint, model_name, state_class):
+        """Yield (name, tokens, state) for every snapshot of this fingerprint, dropping stale ones"""
+        for entry in os.listdir(self.folder):
+            meta_path = os.path.join(self.folder, entry, "meta.json")
+            if entry != fingerprint and self._read_json(meta_path, {}).get("model") == model_name:
+                logger.info("Removing stale prompt states of %s (model file or context parameters changed)",
+                            model_name)
+                shutil.rmtree(os.path.join(self.folder, entry), ignore_errors=True)
+
+        folder = self._path(fingerprint)
+        if not os.path.isdir(folder):
+            return
+        for filename in sorted(os.listdir(folder)):
+            if not filename.endswith(".npz") or ".tmp" in filename:
+                continue
+            try:
+                with np.load(os.path.join(folder, filename)) as data:
+                    llama_state = data["llama_state"].tobytes()
+                    state = state_class(
+                        input_ids=data["input_ids"],
+                        scores=data["scores"],
+                        n_tokens=int(data["n_tokens"]),
+                        llama_state=llama_state,
+                        llama_state_size=len(llama_state),
+                    )
+                    yield str(data["name"]), data["tokens"].tolist(), state
+            except Exception as e:
+                logger.warning("Skipping unreadable prompt state %s: %s", filename, e)
+
+    def remove(self, fingerprint, name):
+        path = self._path(fingerprint, name)
+        if os.path.exists(path):
+            os.remove(path)
@@ -2,52 +2,192 @@
 SDR (System Discovery and Researching) engine
 """
 
-import ollama
-from langchain_community.document_loaders import DirectoryLoader
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings.ollama import OllamaEmbeddings
+import os
+import time
+
 from langchain_community.llms.ollama import Ollama
 from langchain.chains import RetrievalQA
 
+from RAG.chunker import CHARS_PER_TOKEN, Chunker, char_token_counter
+from RAG.embedding_cache import CachedEmbeddings, EmbeddingCache
+from RAG.ingest import IngestionQueue
+from RAG.ollama_client import OllamaBatchEmbeddings, OllamaService
+from RAG.parsing import ParserPool
+from RAG.response_cache import ResponseCache
+from RAG.streaming import timed_stream
+from RAG.text_cache import ParsedTextCache
+from RAG.uploads import UploadSessions
+from RAG.vector_index import VectorIndex, default_index_folder
+
 class SDREngine:
     """Handles SDR functionality"""
 
-    def __init__(self, upload_folder="./uploads", available_models=None):
+    def __init__(self, upload_folder="./uploads", available_models=None, index_folder=None,
+                 embedding_model="llama2", top_k=4, ingest_workers=2, chunk_size=256, chunk_overlap=32,
+                 embedding_cache=None, ollama_host=None, embed_batch_size=32, embed_concurrency=4,
+                 index_mmap=True, index_policy=None, search_mode="hybrid", response_cache=None,
+                 ollama_client=None, shards=None, parse_workers=None, parse_timeout=120.0,
+                 text_cache=None, uploads=None, chars_per_token=CHARS_PER_TOKEN):
         self.upload_folder = upload_folder
         self.available_models = available_models or ["llama2", "gemma3"]
+        self.index_folder = index_folder or default_index_folder(upload_folder)
+        self.embedding_model = embedding_model
+        self.top_k = top_k
+        self.search_mode = search_mode
+        self.response_cache = response_cache or ResponseCache()
+        self.embedding_cache = embedding_cache or EmbeddingCache(os.path.join(self.index_folder, "embedding_cache"))
+        self.text_cache = text_cache or ParsedTextCache(os.path.join(self.index_folder, "text_cache"))
+        # One pooled client for generation and embeddings, so connections are reused
+        self.ollama = ollama_client or OllamaService(ollama_host)
+        self.embeddings = OllamaBatchEmbeddings(
+            embedding_model, batch_size=embed_batch_size, max_concurrency=embed_concurrency, client=self.ollama
+        )
+        # Uploads are parsed in worker processes, one per core unless parse_workers says otherwise
+        self.parser = ParserPool(parse_workers, parse_timeout)
+        self.vector_index = VectorIndex(
+            upload_folder, self.index_folder,
+            CachedEmbeddings(self.embeddings, embedding_model, self.embedding_cache),
+            embedding_model,
+            # The Ollama models' tokenizers are not at hand, so chunk sizes use a bound on characters per token
+            chunker=Chunker(chunk_size, chunk_overlap, token_counter=char_token_counter(chars_per_token),
+                            tokenizer=f"chars/{chars_per_token}"),
+            # Hand the client enough texts per call to keep every request slot busy
+            embed_batch_size=embed_batch_size * embed_concurrency,
+            mmap=index_mmap,
+            policy=index_policy,
+            parser=self.parser.parse,
+            text_cache=self.text_cache
+        )
+        self.ingestion = IngestionQueue(self.vector_index, ingest_workers).start()
+        # Chunked uploads in progress, streamed into the uploads folder
+        self.uploads = uploads or UploadSessions(upload_folder)
+        # A ShardCoordinator when the uploads are spread over other SDRServer instances
+        self.shards = shards
 
-    def query(self, query_text, selected_model="llama2"):
-        """Process a query using SDR"""
+    def _prepare(self, query_text, selected_model, search_mode):
+        """Return (cached answer, prompt, store) where store(answer) fills the response cache"""
         if selected_model not in self.available_models:
             raise ValueError(f"Model '{selected_model}' not available")
 
-        # Load documents from folder
-        loader = DirectoryLoader(self.upload_folder)
-        documents = loader.load()
+        search_mode = search_mode or self.search_mode
+        # Read the version first, so an answer never outlives the index it came from
+        version = self.shards.version() if self.shards else self.vector_index.version
+        # Keyword searches never embed; their answers are cached by exact question text
+        question = None if search_mode == "keyword" else self.vector_index.embeddings.embed_query(query_text)
+        cache_key = (selected_model, search_mode)
 
-        if not documents:
+        def store(answer):
+            self.response_cache.put(cache_key, version, query_text, question, answer)
+
+        cached = self.response_cache.get(cache_key, version, query_text, question)
+        if cached is not None:
+            return cached, None, store
+
+        # Get relevant documents; only fully indexed files are visible
+        if self.shards:
+            relevant_docs = self.shards.search(query_text, self.top_k, search_mode, vector=question)
+        else:
+            relevant_docs = self.vector_index.search(query_text, self.top_k, search_mode, vector=question)
+
+        if not relevant_docs:
             # No documents, respond directly
             prompt = f"Query: {query_text}\n\nAnswer:"
         else:
-            # Create retriever with FAISS
-            embeddings = OllamaEmbeddings()
-            vectorstore = FAISS.from_documents(documents, embeddings)
-            retriever = vectorstore.as_retriever()
-
-            # Get relevant documents
-            relevant_docs = retriever.get_relevant_documents(query_text)
             context = "\n".join([doc.page_content for doc in relevant_docs])
 
             # Create prompt with context
             prompt = f"Context: {context}\n\nQuery: {query_text}\n\nAnswer:"
+        return None, prompt, store
+
+    def query(self, query_text, selected_model="llama2", search_mode=None):
+        """Process a query using SDR"""
+        cached, prompt, store = self._prepare(query_text, selected_model, search_mode)
+        if cached is not None:
+            return cached
 
         # Generate response using Ollama
         try:
-            response = ollama.generate(model=selected_model, prompt=prompt)
+            response = self.ollama.generate(selected_model, prompt)
+            store(response['response'])
             return response['response']
         except Exception as e:
             return f"Error generating response: {str(e)}. Please ensure Ollama is running and the model is loaded."
 
+    def query_stream(self, query_text, selected_model="llama2", search_mode=None):
+        """Process a query using SDR, returning an iterator of answer pieces
+
+        Retrieval happens before this returns, so bad requests raise here
+        rather than in the middle of a stream.
+        """
+        start = time.perf_counter()
+        cached, prompt, store = self._prepare(query_text, selected_model, search_mode)
+        if cached is not None:
+            return timed_stream([cached], start, selected_model)
+        pieces = (chunk['response'] for chunk in self.ollama.generate(selected_model, prompt, stream=True))
+        return timed_stream(pieces, start, selected_model, on_complete=store)
+
+    def warm_up(self, background=True):
+        """Load the available models and the embedding model into Ollama before the first query"""
+        return self.ollama.warm_up(self.available_models, [self.embedding_model], background=background)
+
+    def ingest(self, filename, sha256=None):
+        """Queue an uploaded file for background indexing"""
+        return self.ingestion.submit(filename, sha256)
+
+    def holds_content(self, filename, sha256):
+        """Return True when the uploads folder already has filename with exactly this content"""
+        try:
+            # Reuses the indexed hash while mtime and size are unchanged, so this rarely reads the file
+            return self.vector_index.file_entry(filename)["sha256"] == sha256
+        except FileNotFoundError:
+            return False
+
+    def start_upload(self, filename, size):
+        """Start a chunked upload and return its status"""
+        status = self.uploads.create(filename, size)
+        if status["complete"]:
+            # Nothing to send for an empty file
+            return self.complete_upload(status["upload_id"])
+        return status
+
+    def complete_upload(self, upload_id):
+        """Store a fully received chunked upload and queue it for indexing
+
+        Only the hash computed here while receiving is trusted. An upload is
+        dropped only when its file name already holds that content; anything
+        else is stored under the name it was sent with, even if another file
+        has the same bytes. Parsing and embedding are not repeated for such
+        a copy, since both caches are keyed by content, and the index does
+        not hash the new file again.
+        """
+        status = self.uploads.status(upload_id)
+        if status["finished"]:
+            # A retried last chunk: the upload was already stored or found unchanged
+            return dict(status, ingest=self.ingest_status(status["filename"]))
+        if self.holds_content(status["filename"], status["sha256"]):
+            self.uploads.discard(upload_id, unchanged=True)
+            return dict(status, finished=True, unchanged=True, ingest=self.ingest_status(status["filename"]))
+        filename = self.uploads.finish(upload_id)
+        return dict(status, finished=True, unchanged=False, ingest=self.ingest(filename, status["sha256"]))
+
+    def ingest_status(self, filename=None):
+        """Return ingestion progress for one file or all files"""
+        return self.ingestion.status(filename)
+
+    def stats(self):
+        """Return embedding throughput and cache counters"""
+        return {
+            "index": self.vector_index.stats(),
+            "ollama": self.ollama.stats(),
+            "embeddings": self.embeddings.stats(),
+            "parsing": self.parser.stats(),
+            "embedding_cache": self.embedding_cache.stats(),
+            "text_cache": self.text_cache.stats(),
+            "uploads": self.uploads.stats(),
+            "response_cache": self.response_cache.stats(),
+            "shards": self.shards.stats() if self.shards else None,
+        }
+
     def get_available_models(self):
         """Return list of available models"""
         return self.available_models
\ No newline at end of file
@@ -0,0 +1,114 @@
+"""
+Semantic cache of generated answers, so repeated questions skip the LLM
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize(text):
+    """Question text as compared for exact hits: case and runs of whitespace do not matter"""
+    return " ".join(text.lower().split())
+
+
+class ResponseCache:
+    """Answers keyed by model, index version and question
+
+    A question hits when an earlier one for the same model and search mode
+    has the same normalized text or, when the caller passes the question
+    embedding, cosine similarity >= threshold. Exact hits need no
+    embedding, so keyword searches never call the embedding model. Entries
+    expire after ttl seconds, the least recently used are evicted beyond
+    max_entries, and everything is dropped as soon as the index version
+    moves on.
+    """
+
+    def __init__(self, max_entries=1000, ttl=3600.0, threshold=0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._version = None
+        self._entries = OrderedDict()  # id -> (model, unit vector or None, answer, created, normalized text)
+        self._texts = {}  # (model, normalized text) -> id
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype='float32')
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self, version):
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._texts.clear()
+            self._version = version
+
+    def _remove(self, entry_id):
+        model, _, _, _, text = self._entries.pop(entry_id)
+        if self._texts.get((model, text)) == entry_id:
+            del self._texts[(model, text)]
+
+    def _expire(self, now):
+        for entry_id in [entry_id for entry_id, entry in self._entries.items() if now - entry[3] > self.ttl]:
+            self._remove(entry_id)
+
+    def get(self, model, version, text, vector=None):
+        """Return the cached answer for the same question or, given its embedding, a similar one; else None"""
+        query = None if vector is None else self._unit(vector)
+        with self._lock:
+            self._check_version(version)
+            self._expire(time.time())
+            best_id = self._texts.get((model, normalize(text)))
+            if best_id is None and query is not None:
+                best_score = self.threshold
+                for entry_id, (entry_model, entry_vector, _, _, _) in self._entries.items():
+                    if entry_model != model or entry_vector is None or entry_vector.shape != query.shape:
+                        continue
+                    score = float(entry_vector @ query)
+                    if score >= best_score:
+                        best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id][2]
+
+    def put(self, model, version, text, vector, answer):
+        """Store an answer generated against the given index version; vector may be None"""
+        unit = None if vector is None else self._unit(vector)
+        with self._lock:
+            self._check_version(version)
+            text = normalize(text)
+            if (model, text) in self._texts:
+                self._remove(self._texts[(model, text)])
+            self._entries[self._next_id] = (model, unit, answer, time.time(), text)
+            self._texts[(model, text)] = self._next_id
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self):
+        """Return hit/miss/eviction counters and current size"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "index_version": self._version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
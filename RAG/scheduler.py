@@ -0,0 +1,336 @@
+"""
+Fair time-sliced scheduling of concurrent generation requests on one llama.cpp model
+"""
+
+import codecs
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+
+from llama_cpp import Llama
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+def state_bytes(state):
+    """Memory held by a saved llama.cpp state: the KV cache copy plus the tokens and logits kept with it"""
+    return state.llama_state_size + state.input_ids.nbytes + state.scores.nbytes
+
+
+class GenerationRequest:
+    """One queued generation; read it with stream() or result()"""
+
+    def __init__(self, prompt, max_tokens, priority, client, seq):
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.priority = priority
+        self.client = client
+        self.seq = seq
+        self.prompt_tokens = None
+        self.generated = []
+        self.text = ""
+        # Turns the bytes of each new token into text; a character may span tokens
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self.state = None  # saved context while another request is decoding
+        self.state_bytes = 0
+        self.reused_tokens = 0
+        # Filled in when the model decodes speculatively
+        self.drafted_tokens = 0
+        self.accepted_tokens = 0
+        self.verify_passes = 0
+        # Generation time and tokens after each turn's first token, prompt evaluation excluded
+        self.decode_seconds = 0.0
+        self.decode_tokens = 0
+        self.error = None
+        self.submitted_at = time.perf_counter()
+        self.started_at = None
+        self.finished_at = None
+        self._pieces = queue.Queue()
+
+    def stream(self):
+        """Yield text pieces as they are decoded"""
+        while True:
+            piece = self._pieces.get()
+            if piece is _DONE:
+                break
+            yield piece
+        if self.error is not None:
+            raise self.error
+
+    def result(self):
+        """Wait for the whole answer"""
+        return "".join(self.stream())
+
+
+class FairShareScheduler:
+    """Fairness scheduler for the generation requests of one model, decoded on a single thread
+
+    This is time-slicing, not continuous batching: one request decodes at a
+    time, and the others wait their turn with their context saved aside.
+
+    llama.cpp contexts are not thread-safe, so all decoding for a model runs
+    here. Up to max_active requests are in flight at once. Each decodes
+    quantum tokens per turn, after which pending calls and new arrivals are
+    looked at. The context changes hands only when the request holding it
+    finishes, a request of higher priority is waiting, or it has decoded
+    slice_tokens since it got the context. Switching saves the outgoing
+    request's state and restores the next one, so nothing is evaluated
+    twice; a saved state copies the KV cache and logits, which is why it
+    happens once per slice rather than once per quantum. The next request
+    is the highest priority, then the client served the fewest tokens,
+    then the request with the fewest tokens decoded, then the oldest. A
+    long answer therefore cannot hold up short ones for more than a slice,
+    and a busy client cannot starve the others.
+
+    Parked states are reported through hold_bytes(model_name, delta), so
+    the model pool counts them against its memory budget.
+
+    The high-level llama.cpp API decodes one sequence per context, so turns
+    interleave sequences rather than decoding them in one batched forward
+    pass: aggregate throughput is that of a single request, and what the
+    scheduler buys is bounded waiting and a fair share for each client.
+    """
+
+    def __init__(self, use_model, model_name, quantum=16, max_active=4, slice_tokens=256, hold_bytes=None):
+        self.use_model = use_model
+        self.model_name = model_name
+        self.quantum = quantum
+        self.max_active = max_active
+        self.slice_tokens = slice_tokens
+        self.hold_bytes = hold_bytes
+        self._waiting = []
+        self._active = []
+        self._calls = []  # (fn, reply queue) to run on the model between turns
+        self._served = Counter()  # client -> tokens decoded for it
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._resident = None  # request whose tokens are in the live context
+        self._slice_used = 0  # tokens the resident request decoded since it got the context
+        self.completed = 0
+        self.failed = 0
+        self.tokens = 0
+        self.busy_seconds = 0.0
+        self.switches = 0
+        self.parked_bytes = 0
+        self.queue_wait_seconds = 0.0
+        self.last_queue_wait = 0.0
+        threading.Thread(target=self._run, name=f"generate-{model_name}", daemon=True).start()
+
+    def submit(self, prompt, max_tokens=512, priority=0, client=None):
+        """Queue a prompt; higher priority values are served first"""
+        with self._cond:
+            request = GenerationRequest(prompt, max_tokens, priority, client, next(self._seq))
+            self._waiting.append(request)
+            self._cond.notify()
+        return request
+
+    def call(self, fn, changes_context=True):
+        """Run fn(llm) on the scheduler thread between decoding turns and return its result
+
+        Pass changes_context=False when fn leaves the context alone (e.g. it
+        only tokenizes), so the decoding request is not parked for it.
+        """
+        reply = queue.Queue()
+        with self._cond:
+            self._calls.append((fn, changes_context, reply))
+            self._cond.notify()
+        ok, value = reply.get()
+        if not ok:
+            raise value
+        return value
+
+    def _key(self, request):
+        return -request.priority, self._served[request.client], len(request.generated), request.seq
+
+    def _next(self):
+        """Admit waiting requests into free slots and pick whose turn it is"""
+        while self._waiting and len(self._active) < self.max_active:
+            request = min(self._waiting, key=self._key)
+            self._waiting.remove(request)
+            request.started_at = time.perf_counter()
+            wait = request.started_at - request.submitted_at
+            self.queue_wait_seconds += wait
+            self.last_queue_wait = wait
+            self._active.append(request)
+        if not self._active:
+            return None
+        best = min(self._active, key=self._key)
+        resident = self._resident
+        if (resident is not best and resident in self._active and self._slice_used < self.slice_tokens
+                and resident.priority >= best.priority):
+            return resident
+        return best
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._waiting and not self._active and not self._calls:
+                    self._cond.wait()
+            # Keep the model pinned in the pool while there is work for it
+            try:
+                with self.use_model(self.model_name) as llm:
+                    self._drain(llm)
+            except Exception as e:
+                logger.error("Generation on %s failed: %s", self.model_name, e)
+                with self._cond:
+                    failed, self._active, self._waiting = self._active + self._waiting, [], []
+                    calls, self._calls = self._calls, []
+                for request in failed:
+                    self._finish(request, e)
+                for _, _, reply in calls:
+                    reply.put((False, e))
+            self._resident = None
+
+    def _drain(self, llm):
+        while True:
+            with self._cond:
+                calls, self._calls = self._calls, []
+            for fn, changes_context, reply in calls:
+                self._run_call(llm, fn, changes_context, reply)
+            with self._cond:
+                request = self._next()
+                if request is None and not self._calls:
+                    return
+            if request is None:
+                continue
+            start = time.perf_counter()
+            try:
+                finished, decoded = self._turn(llm, request)
+            except Exception as e:
+                logger.error("Request %d on %s failed: %s", request.seq, self.model_name, e)
+                finished, decoded = e, 0
+                self._resident = None
+            with self._cond:
+                self.tokens += decoded
+                self.busy_seconds += time.perf_counter() - start
+                self._served[request.client] += decoded
+                self._slice_used += decoded
+                if finished is not False:
+                    self._active.remove(request)
+            if finished is not False:
+                self._finish(request, finished if isinstance(finished, Exception) else None)
+
+    def _run_call(self, llm, fn, changes_context, reply):
+        if changes_context:
+            self._park(llm)
+        try:
+            reply.put((True, fn(llm)))
+        except Exception as e:
+            reply.put((False, e))
+
+    def _hold(self, delta):
+        self.parked_bytes += delta
+        if self.hold_bytes is not None and delta:
+            self.hold_bytes(self.model_name, delta)
+
+    def _park(self, llm):
+        """Save the resident request's context so something else can use it"""
+        request, self._resident = self._resident, None
+        if request is not None and request in self._active:
+            request.state = llm.save_state()
+            request.state_bytes = state_bytes(request.state)
+            self._hold(request.state_bytes)
+            self.switches += 1
+
+    def _drop_state(self, request):
+        if request.state is not None:
+            request.state = None
+            self._hold(-request.state_bytes)
+            request.state_bytes = 0
+
+    def _resume(self, llm, request):
+        """Bring the request's tokens into the live context"""
+        if self._resident is request:
+            return
+        self._park(llm)
+        self._slice_used = 0
+        if request.state is not None:
+            llm.load_state(request.state)
+            self._drop_state(request)
+        else:
+            request.prompt_tokens = llm.tokenize(request.prompt.encode("utf-8"))
+            live = Llama.longest_token_prefix(llm.input_ids[:llm.n_tokens].tolist(), request.prompt_tokens)
+            if llm.cache is not None:
+                try:
+                    saved = llm.cache[request.prompt_tokens]
+                    if Llama.longest_token_prefix(saved.input_ids.tolist(), request.prompt_tokens) > live:
+                        llm.load_state(saved)
+                except KeyError:
+                    pass
+            # llama.cpp always evaluates at least the last prompt token
+            request.reused_tokens = Llama.longest_token_prefix(
+                llm.input_ids[:llm.n_tokens].tolist(), request.prompt_tokens[:-1]
+            )
+        self._resident = request
+
+    def _turn(self, llm, request):
+        """Decode up to quantum tokens; return (finished, tokens decoded)"""
+        self._resume(llm, request)
+        tokens = request.prompt_tokens + request.generated
+        decoded = 0
+        finished = False
+        first_token_at = None
+        if hasattr(llm.draft_model, "begin"):
+            llm.draft_model.begin(request)
+        generator = llm.generate(tokens)
+        try:
+            for token in generator:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                if token == llm.token_eos():
+                    finished = True
+                    break
+                request.generated.append(token)
+                decoded += 1
+                piece = request._decoder.decode(llm.detokenize([token]))
+                if piece:
+                    request._pieces.put(piece)
+                    request.text += piece
+                if (len(request.generated) >= request.max_tokens
+                        or len(tokens) + decoded >= llm.n_ctx()):
+                    finished = True
+                    break
+                if decoded >= self.quantum:
+                    break
+        finally:
+            generator.close()
+        if first_token_at is not None:
+            request.decode_seconds += time.perf_counter() - first_token_at
+            request.decode_tokens += max(decoded - 1, 0)
+        if finished and llm.cache is not None:
+            llm.cache[request.prompt_tokens + request.generated] = llm.save_state()
+        return finished, decoded
+
+    def _finish(self, request, error=None):
+        request.finished_at = time.perf_counter()
+        request.error = error
+        self._drop_state(request)
+        with self._cond:
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+        request._pieces.put(_DONE)
+
+    def stats(self):
+        """Return queue depth, queue wait and aggregate decoding throughput"""
+        with self._cond:
+            started = self.completed + self.failed + len(self._active)
+            return {
+                "waiting": len(self._waiting),
+                "active": len(self._active),
+                "completed": self.completed,
+                "failed": self.failed,
+                "tokens": self.tokens,
+                "tokens_per_sec": self.tokens / self.busy_seconds if self.busy_seconds else 0.0,
+                "mean_queue_wait_seconds": self.queue_wait_seconds / started if started else 0.0,
+                "last_queue_wait_seconds": self.last_queue_wait,
+                "context_switches": self.switches,
+                "parked_states": sum(request.state is not None for request in self._active),
+                "parked_bytes": self.parked_bytes,
+            }
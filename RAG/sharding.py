@@ -0,0 +1,230 @@
+"""
+Scatter-gather retrieval over index shards held by other SDRServer instances
+"""
+
+import hashlib
+import ipaddress
+import logging
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import httpx
+from langchain_core.documents import Document
+
+from RAG.vector_index import merge_scored
+
+logger = logging.getLogger(__name__)
+
+
+def shard_for(filename, shards):
+    """Rendezvous hashing: the shard with the highest hash of (shard, filename) owns the file
+
+    Every coordinator computes the same owner without shared state, and
+    adding or removing a shard only moves the files that shard gains or held.
+    """
+    return max(shards, key=lambda shard: hashlib.sha256(f"{shard}\0{filename}".encode('utf-8')).digest())
+
+
+def _addresses(host):
+    """The addresses host resolves to, with this machine's own addresses all standing for "local" """
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except (socket.gaierror, UnicodeError):
+        return {host}
+    try:
+        own = set(socket.gethostbyname_ex(socket.gethostname())[2])
+    except OSError:
+        own = set()
+    local = set()
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])
+        local.add("local" if ip.is_loopback or ip.is_unspecified or address in own else address)
+    return local
+
+
+def same_server(url, other):
+    """Whether two server URLs reach the same host and port, e.g. http://localhost:8080 and http://127.0.0.1:8080"""
+    url, other = urlsplit(url), urlsplit(other)
+    default_ports = {"http": 80, "https": 443}
+    if (url.port or default_ports.get(url.scheme)) != (other.port or default_ports.get(other.scheme)):
+        return False
+    if not url.hostname or not other.hostname:
+        return False
+    return bool(_addresses(url.hostname) & _addresses(other.hostname))
+
+
+def encode_matches(results):
+    """scored_search results as JSON for /shard/search"""
+    return {ranking: [{"score": score, "text": doc.page_content, "metadata": doc.metadata}
+                      for score, doc in matches]
+            for ranking, matches in results.items()}
+
+
+def decode_matches(payload):
+    return {ranking: [(match["score"], Document(page_content=match["text"], metadata=match["metadata"]))
+                      for match in matches]
+            for ranking, matches in payload.items()}
+
+
+class ShardCoordinator:
+    """Fans queries out to the SDRServer instances that each own a shard of the uploads
+
+    Each upload is stored and indexed on one shard, chosen by shard_for.
+    A query goes to every shard at once; each returns its best matches with
+    L2 distances and BM25 scores, which merge_scored combines as a single
+    index would. Vector rankings come out exactly the same; BM25 scores use
+    each shard's own term statistics, which stay close to the global ones
+    because hashing spreads files evenly. Shards that fail or miss the
+    timeout are left out: the answer comes from the shards that replied,
+    and the missing ones are reported. Only when no shard replies does the
+    search fail.
+
+    Every search reply carries the shard's index version. The versions seen
+    last are what version() returns for version_ttl seconds, so the answer
+    cache is keyed without an extra round trip per query; a change on a
+    shard reaches the cache at most version_ttl seconds late.
+
+    self_url is where this server is reached; it may not be one of the
+    shards, or every upload and search it owns would be forwarded back to
+    itself without end.
+    """
+
+    def __init__(self, shards, timeout=10.0, version_ttl=2.0, self_url=None):
+        self.shards = [shard.rstrip("/") for shard in shards]
+        if self_url:
+            for shard in self.shards:
+                if same_server(shard, self_url):
+                    raise ValueError(f"Shard {shard} is this server ({self_url}); list only the other servers")
+        self.timeout = timeout
+        self.version_ttl = version_ttl
+        self._versions = None  # (((shard, version), ...), time.monotonic() when seen)
+        self.client = httpx.Client(timeout=timeout,
+                                   limits=httpx.Limits(max_keepalive_connections=4 * len(self.shards)))
+        self._executor = ThreadPoolExecutor(max_workers=4 * len(self.shards), thread_name_prefix="shard")
+        self._lock = threading.Lock()
+        self._stats = {shard: {"requests": 0, "errors": 0, "seconds": 0.0, "last_ms": None, "last_error": None}
+                       for shard in self.shards}
+        self.searches = 0
+        self.partial_searches = 0
+        self.last_search = None
+
+    def owner(self, filename):
+        return shard_for(filename, self.shards)
+
+    def _request(self, shard, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.client.request(method, shard + path, **kwargs)
+            response.raise_for_status()
+            result = response.json()
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stats = self._stats[shard]
+                stats["requests"] += 1
+                stats["errors"] += 1
+                stats["last_error"] = str(e)
+            logger.warning("Shard %s failed on %s after %.0f ms: %s", shard, path, elapsed * 1000, e)
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            stats = self._stats[shard]
+            stats["requests"] += 1
+            stats["seconds"] += elapsed
+            stats["last_ms"] = elapsed * 1000
+        return result, elapsed
+
+    def _scatter(self, method, path, **kwargs):
+        """Send one request to every shard; return {shard: (result, seconds)} and {shard: error}"""
+        futures = {shard: self._executor.submit(self._request, shard, method, path, **kwargs)
+                   for shard in self.shards}
+        replies, errors = {}, {}
+        for shard, future in futures.items():
+            try:
+                replies[shard] = future.result()
+            except Exception as e:
+                errors[shard] = str(e)
+        return replies, errors
+
+    def _remember_versions(self, replies):
+        versions = tuple((shard, replies[shard][0]["version"] if shard in replies else None)
+                         for shard in self.shards)
+        with self._lock:
+            self._versions = (versions, time.monotonic())
+        return versions
+
+    def version(self):
+        """Index versions of all shards, None for unreachable ones; changes whenever any shard's index does
+
+        Taken from the last search or status round when it is younger than
+        version_ttl seconds, otherwise asked of every shard.
+        """
+        with self._lock:
+            cached = self._versions
+        if cached is not None and time.monotonic() - cached[1] < self.version_ttl:
+            return cached[0]
+        replies, _ = self._scatter("GET", "/shard/status")
+        return self._remember_versions(replies)
+
+    def search(self, query_text, k=4, mode="hybrid", vector=None):
+        """Return the k best chunks over all reachable shards"""
+        payload = {"query": query_text, "k": k, "mode": mode}
+        if vector is not None:
+            # Embedded once here instead of once per shard
+            payload["vector"] = [float(x) for x in vector]
+        start = time.perf_counter()
+        replies, errors = self._scatter("POST", "/shard/search", json=payload)
+        if not replies:
+            raise RuntimeError(f"No index shard answered: {errors}")
+        self._remember_versions(replies)
+        documents = merge_scored([decode_matches(result["results"]) for result, _ in replies.values()], k, mode)
+
+        report = {
+            "total_ms": (time.perf_counter() - start) * 1000,
+            "shards": {shard: {"ms": seconds * 1000,
+                               "matches": sum(len(matches) for matches in result["results"].values())}
+                       for shard, (result, seconds) in replies.items()},
+            "missing": errors,
+        }
+        with self._lock:
+            self.searches += 1
+            self.partial_searches += int(bool(errors))
+            self.last_search = report
+        if errors:
+            logger.warning("Answering from %d of %d shards; missing %s",
+                           len(replies), len(self.shards), ", ".join(errors))
+        return documents
+
+    def upload(self, filename, stream, content_type=None):
+        """Store an upload on its owning shard; return (shard, that shard's reply)"""
+        shard = self.owner(filename)
+        result, _ = self._request(shard, "POST", "/upload",
+                                  files={"file": (filename, stream, content_type or "application/octet-stream")})
+        return shard, result
+
+    def ingest_status(self, filename=None):
+        """Ingestion progress of one file from its shard, or of every shard"""
+        if filename is not None:
+            result, _ = self._request(self.owner(filename), "GET", "/ingest/status", params={"file": filename})
+            return result
+        replies, errors = self._scatter("GET", "/ingest/status")
+        status = {shard: result for shard, (result, _) in replies.items()}
+        status.update({shard: {"error": error} for shard, error in errors.items()})
+        return status
+
+    def stats(self):
+        """Return per-shard request counts and latency, and the last search's per-shard breakdown"""
+        with self._lock:
+            return {
+                "shards": {shard: {"requests": stats["requests"], "errors": stats["errors"],
+                                   "mean_ms": stats["seconds"] * 1000 / (stats["requests"] - stats["errors"])
+                                   if stats["requests"] > stats["errors"] else None,
+                                   "last_ms": stats["last_ms"], "last_error": stats["last_error"]}
+                           for shard, stats in self._stats.items()},
+                "searches": self.searches,
+                "partial_searches": self.partial_searches,
+                "last_search": self.last_search,
+            }
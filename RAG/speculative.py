@@ -0,0 +1,71 @@
+"""
+Draft models for speculative decoding in the llama.cpp path
+"""
+
+import numpy as np
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+
+class LlamaDraft(LlamaDraftModel):
+    """Greedy drafts from a smaller GGUF model sharing the main model's vocabulary
+
+    The draft model keeps its own context, so each call only evaluates the
+    tokens accepted since the previous one.
+    """
+
+    def __init__(self, llm, num_pred_tokens=8):
+        self.llm = llm
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids, /, **kwargs):
+        draft = []
+        generator = self.llm.generate(input_ids.tolist(), temp=0.0)
+        try:
+            for token in generator:
+                draft.append(token)
+                if len(draft) >= self.num_pred_tokens:
+                    break
+        finally:
+            generator.close()
+        return np.array(draft, dtype=np.intc)
+
+
+class CountingDraft(LlamaDraftModel):
+    """Wraps a draft model to count drafted and accepted tokens per request
+
+    llama.cpp calls the draft model once per verification pass, with the
+    context so far. The growth of that context since the previous call
+    shows how many of the previous draft tokens were accepted: all tokens
+    added except the one the main model sampled itself.
+    """
+
+    def __init__(self, draft):
+        self.draft = draft
+        self.request = None
+        self._last_length = None
+        self._last_drafted = 0
+
+    def begin(self, request):
+        """Attribute the following calls to request, starting a new decoding run"""
+        self.request = request
+        self._last_length = None
+
+    def __call__(self, input_ids, /, **kwargs):
+        length = len(input_ids)
+        request = self.request
+        if request is not None:
+            request.verify_passes += 1
+            if self._last_length is not None:
+                request.drafted_tokens += self._last_drafted
+                request.accepted_tokens += min(max(length - self._last_length - 1, 0), self._last_drafted)
+        draft = self.draft(input_ids, **kwargs)
+        self._last_length = length
+        self._last_drafted = len(draft)
+        return draft
+
+
+def make_draft(kind, num_pred_tokens=8, draft_llm=None):
+    """Return a counting draft model: prompt lookup, or a loaded draft Llama"""
+    if kind == "prompt_lookup":
+        return CountingDraft(LlamaPromptLookupDecoding(max_ngram_size=3, num_pred_tokens=num_pred_tokens))
+    return CountingDraft(LlamaDraft(draft_llm, num_pred_tokens))
@@ -0,0 +1,38 @@
+"""
+Helpers for streaming generated answers token by token
+"""
+
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def timed_stream(pieces, start, model, on_complete=None):
+    """Pass text pieces through, logging time to first token and total duration
+
+    start is the time.perf_counter() of the request, so retrieval counts
+    towards time to first token. on_complete gets the full answer once the
+    stream ends normally.
+    """
+    first_token_ms = None
+    answer = []
+    for piece in pieces:
+        if not piece:
+            continue
+        if first_token_ms is None:
+            first_token_ms = (time.perf_counter() - start) * 1000
+            logger.info("Time to first token %.0f ms (model=%s)", first_token_ms, model)
+        answer.append(piece)
+        yield piece
+    logger.info("Streamed %d pieces in %.0f ms (model=%s, first token %s ms)", len(answer),
+                (time.perf_counter() - start) * 1000, model,
+                f"{first_token_ms:.0f}" if first_token_ms is not None else "-")
+    if on_complete is not None:
+        on_complete("".join(answer))
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,510 @@
+"""
+Streaming loaders for tabular and record-oriented uploads (CSV, JSON, XML, XLSX)
+"""
+
+import csv
+import io
+import json
+import os
+import tempfile
+import zipfile
+from array import array
+from functools import lru_cache
+from xml.etree.ElementTree import iterparse
+
+from langchain_core.documents import Document
+
+# Rows are grouped into documents of about this many characters; the chunker
+# then cuts them into chunks of whole rows
+BLOCK_CHARS = 64 * 1024
+
+READ_SIZE = 64 * 1024
+
+XLSX_RELATIONSHIP = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _clean(value):
+    """One line per row: newlines inside a value would split it"""
+    return " ".join(str(value).split())
+
+
+def row_blocks(rows, source, header=None, **metadata):
+    """Group numbered row lines into documents of about BLOCK_CHARS
+
+    rows yields (number, line), numbers ascending: the row's line in the
+    source file, or its record number. Each document carries the header
+    (column names) in its metadata, and row_start, the number of its first
+    row; rows left out in between (blank ones) stay in as empty lines, so
+    the chunker can tell each row's number from its line in the document.
+    The chunker repeats the header at the top of every chunk cut from it.
+    """
+    block, size, row_start = [], 0, None
+
+    def document():
+        return Document(page_content="\n".join(block),
+                        metadata=dict(metadata, source=source, header=header, row_start=row_start))
+
+    for number, line in rows:
+        if block:
+            gap = number - row_start - len(block)
+            if size + gap >= BLOCK_CHARS:
+                yield document()
+                block, size = [], 0
+            else:
+                block.extend([""] * gap)
+                size += gap
+        if not block:
+            row_start = number
+        block.append(line)
+        size += len(line) + 1
+        if size >= BLOCK_CHARS:
+            yield document()
+            block, size = [], 0
+    if block:
+        yield document()
+
+
+def _fields_line(fields):
+    return "; ".join(f"{name}: {_clean(value)}" for name, value in fields if _clean(value))
+
+
+def load_csv(path):
+    """Yield documents of CSV rows under the header row, reading one row at a time
+
+    Rows are numbered by the file line they start on, the header being line 1.
+    """
+    with open(path, newline="", encoding="utf-8-sig", errors="replace") as f:
+        sample = f.read(READ_SIZE)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.reader(f, dialect)
+        header = next(reader, None)
+        if header is None:
+            return
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=dialect.delimiter, lineterminator="")
+
+        def line(row):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow([_clean(value) for value in row])
+            return buffer.getvalue()
+
+        def numbered():
+            # A quoted value may span lines, so a row starts after the line the last one ended on
+            first = reader.line_num + 1
+            for row in reader:
+                if any(value.strip() for value in row):
+                    yield first, line(row)
+                first = reader.line_num + 1
+
+        yield from row_blocks(numbered(), path, line(header))
+
+
+def flatten(value, prefix=""):
+    """Yield (dotted field name, scalar value) pairs of a decoded JSON value"""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}.{key}" if prefix else str(key))
+    elif isinstance(value, list):
+        if all(not isinstance(item, (dict, list)) for item in value):
+            yield prefix or "value", ", ".join(str(item) for item in value)
+        else:
+            for i, item in enumerate(value):
+                yield from flatten(item, f"{prefix}[{i}]")
+    elif value is not None:
+        yield prefix or "value", value
+
+
+class _JsonStream:
+    """Reads JSON values one at a time from a file, holding only the current one in memory"""
+
+    def __init__(self, f):
+        self.f = f
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        data = self.f.read(READ_SIZE)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it, "" at the end"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def take(self, expected):
+        char = self.peek()
+        if char not in expected:
+            raise ValueError(f"Expected one of {expected!r} in JSON, found {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self, limit=None):
+        """Decode the value at the current position
+
+        With a limit, a value that does not end within limit characters is
+        left unread and _LARGE returned, for the caller to walk instead.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number or literal cut at the end of the buffer may continue in the next read
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            if limit is not None and len(self.buffer) - self.pos > limit:
+                return _LARGE
+            self._fill()
+
+    def elements(self):
+        """Walk the array at the current position, yielding once at each element for the caller to read"""
+        self.take("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.take(",]") == "]":
+                return
+
+    def members(self):
+        """Walk the object at the current position, yielding each key with the stream at its value"""
+        self.take("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.take(":")
+            yield key
+            if self.take(",}") == "}":
+                return
+
+
+# Values ending within this many characters are decoded whole; larger ones
+# are walked, so no object or array is ever held in memory whole
+SMALL_VALUE_CHARS = BLOCK_CHARS
+
+# Fields per record when a large object is walked
+RECORD_FIELDS = 1000
+
+_LARGE = object()
+
+
+def _array_records(stream, prefix):
+    """Each element of an array is a record of its own"""
+    for _ in stream.elements():
+        item = stream.value(SMALL_VALUE_CHARS)
+        if item is _LARGE:
+            yield from _walk(stream, prefix)
+        else:
+            yield prefix, item
+
+
+def _object_records(stream, prefix):
+    """Records of a large object: each object or list of objects in it, then its plain fields
+
+    A large object is usually a map of records (id -> record), so unlike
+    in a small document its nested objects are records of their own.
+    """
+    fields = {}
+    for key in stream.members():
+        path = f"{prefix}.{key}" if prefix else str(key)
+        value = stream.value(SMALL_VALUE_CHARS)
+        if value is _LARGE:
+            yield from _walk(stream, path)
+        elif isinstance(value, dict):
+            yield path, value
+        elif isinstance(value, list) and any(isinstance(item, dict) for item in value):
+            for item in value:
+                yield path, item
+        else:
+            fields[key] = value
+            if len(fields) >= RECORD_FIELDS:
+                yield prefix, fields
+                fields = {}
+    if fields:
+        yield prefix, fields
+
+
+def _walk(stream, prefix):
+    char = stream.peek()
+    if char == "[":
+        yield from _array_records(stream, prefix)
+    elif char == "{":
+        yield from _object_records(stream, prefix)
+    else:
+        yield prefix, stream.value()
+
+
+def _document_records(document):
+    """Records of a small top-level object: its arrays of objects, then its remaining fields"""
+    fields = {}
+    for key, value in document.items():
+        if isinstance(value, list) and any(isinstance(item, dict) for item in value):
+            for item in value:
+                yield str(key), item
+        else:
+            fields[key] = value
+    if fields:
+        yield "", fields
+
+
+def json_records(stream):
+    """Yield (prefix, record) for the records of a JSON document
+
+    Values that end within SMALL_VALUE_CHARS are decoded whole; larger
+    ones are walked without ever being held whole. Array elements are
+    records of their own, at any depth, with the array's key path as
+    prefix. In the first top-level object, arrays of objects are split up
+    the same way and the remaining fields form one more record; a large
+    one is walked and its nested objects become records too. Further
+    values after the first (JSON Lines) are records of their own.
+    """
+    first = True
+    while stream.peek():
+        value = stream.value(SMALL_VALUE_CHARS)
+        if value is _LARGE:
+            yield from _walk(stream, "")
+        elif isinstance(value, list):
+            for item in value:
+                yield "", item
+        elif isinstance(value, dict) and first:
+            yield from _document_records(value)
+        else:
+            yield "", value
+        first = False
+
+
+def load_json(path):
+    """Yield documents of JSON records, one "field: value; ..." line per record"""
+    with open(path, encoding="utf-8-sig", errors="replace") as f:
+        records = (_fields_line(flatten(record, prefix)) for prefix, record in json_records(_JsonStream(f)))
+        yield from row_blocks(enumerate((line for line in records if line), 1), path)
+
+
+def _element_fields(element, prefix=""):
+    """Yield (path, value) for the attributes and text of an element and its descendants"""
+    for name, value in element.attrib.items():
+        yield f"{prefix}@{_local(name)}", value
+    if element.text and element.text.strip():
+        yield prefix.rstrip("/") or _local(element.tag), element.text
+    for child in element:
+        yield from _element_fields(child, f"{prefix}{_local(child.tag)}/")
+
+
+def xml_records(path):
+    """Yield the fields of each record element, freeing each record once read
+
+    Records are the elements at the first depth where siblings repeat a tag,
+    e.g. each <item> in <items><item/><item/></items>. Content outside the
+    records is yielded last as one more record, or as it is read once it
+    reaches RECORD_FIELDS elements, so a document without repeating
+    elements is never held whole either.
+    """
+    stack = []
+    record_depth = None
+    last_ended = {}  # depth -> (element, parent) that last ended there, until record_depth is known
+    outside = []  # (element, depth) of elements ended outside records and still in the tree
+    held = 0  # elements in them
+    for event, element in iterparse(path, events=("start", "end")):
+        if event == "start":
+            stack.append(element)
+            depth = len(stack)
+            if record_depth is None and depth > 1:
+                previous, parent = last_ended.get(depth, (None, None))
+                if previous is not None and previous.tag == element.tag and parent is stack[-2]:
+                    record_depth = depth
+                    yield list(_element_fields(previous))
+                    held -= sum(1 for _ in previous.iter())
+                    outside = [entry for entry in outside if entry[0] is not previous]
+                    parent.remove(previous)
+                    last_ended.clear()
+            continue
+        depth = len(stack)
+        stack.pop()
+        if depth == record_depth:
+            yield list(_element_fields(element))
+            element.clear()
+            stack[-1].remove(element)
+        elif depth == 1:
+            rest = list(_element_fields(element))
+            if rest:
+                yield rest
+        elif record_depth is None or depth < record_depth:
+            if record_depth is None:
+                last_ended[depth] = (element, stack[-1])
+            # Its descendants are in it now
+            while outside and outside[-1][1] > depth:
+                outside.pop()
+            outside.append((element, depth))
+            held += 1
+            if held >= RECORD_FIELDS:
+                # The parser may be ahead of the events: only elements that ended are taken out
+                tags = [_local(parent.tag) for parent in stack[1:]]
+                fields = []
+                for ended, ended_depth in outside:
+                    prefix = "".join(f"{tag}/" for tag in tags[:ended_depth - 2])
+                    fields.extend(_element_fields(ended, f"{prefix}{_local(ended.tag)}/"))
+                    stack[ended_depth - 2].remove(ended)
+                yield fields
+                outside, held = [], 0
+                last_ended.clear()
+
+
+def load_xml(path):
+    """Yield documents of XML records, one "path: value; ..." line per record"""
+    yield from row_blocks(enumerate((line for line in map(_fields_line, xml_records(path)) if line), 1), path)
+
+
+def _column(reference):
+    """Zero-based column of a cell reference such as "AB12" """
+    number = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        number = number * 26 + ord(char.upper()) - ord("A") + 1
+    return number - 1
+
+
+class _SharedStrings:
+    """A workbook's shared strings, spooled to a temporary file and read back by index
+
+    Sheets refer to them in any order, so they cannot be streamed; on disk
+    they cost memory only for their offsets.
+    """
+
+    def __init__(self, archive):
+        self.file = tempfile.TemporaryFile()
+        self.offsets = array("q", [0])
+        self.get = lru_cache(maxsize=4096)(self._read)
+        if "xl/sharedStrings.xml" not in archive.namelist():
+            return
+        with archive.open("xl/sharedStrings.xml") as f:
+            for _, element in iterparse(f):
+                if _local(element.tag) == "si":
+                    # Rich text keeps its runs in <r><t>; phonetic guides (<rPh>) are left out
+                    text = "".join(t.text or "" for part in element if _local(part.tag) in ("t", "r")
+                                   for t in part.iter() if _local(t.tag) == "t")
+                    self.offsets.append(self.offsets[-1] + self.file.write(text.encode("utf-8")))
+                    element.clear()
+
+    def _read(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        self.file.seek(start)
+        return self.file.read(end - start).decode("utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+
+def _sheets(archive):
+    """Return (sheet name, member path) in workbook order"""
+    targets = {}
+    with archive.open("xl/_rels/workbook.xml.rels") as f:
+        for _, element in iterparse(f):
+            if _local(element.tag) == "Relationship":
+                target = element.get("Target")
+                targets[element.get("Id")] = target.lstrip("/") if target.startswith("/") else "xl/" + target
+    sheets = []
+    with archive.open("xl/workbook.xml") as f:
+        for _, element in iterparse(f):
+            if _local(element.tag) == "sheet":
+                sheets.append((element.get("name"), targets[element.get(XLSX_RELATIONSHIP)]))
+    return sheets
+
+
+def _sheet_rows(archive, member, strings):
+    """Yield (row number, cell values) of each row of a worksheet, reading one row at a time"""
+    with archive.open(member) as f:
+        sheet_data = None
+        number = 0
+        for event, element in iterparse(f, events=("start", "end")):
+            tag = _local(element.tag)
+            if event == "start":
+                if tag == "sheetData":
+                    sheet_data = element
+                continue
+            if tag != "row":
+                continue
+            number = int(element.get("r") or number + 1)
+            values = {}
+            for position, cell in enumerate(element):
+                if _local(cell.tag) != "c":
+                    continue
+                kind = cell.get("t")
+                text = None
+                for part in cell:
+                    if _local(part.tag) == "v":
+                        text = part.text
+                    elif _local(part.tag) == "is":
+                        text = "".join(t.text or "" for t in part.iter() if _local(t.tag) == "t")
+                if text is None:
+                    continue
+                if kind == "s":
+                    text = strings.get(int(text))
+                elif kind == "b":
+                    text = "TRUE" if text == "1" else "FALSE"
+                reference = cell.get("r")
+                values[_column(reference) if reference else position] = text
+            element.clear()
+            if sheet_data is not None:
+                sheet_data.remove(element)
+            if values:
+                yield number, [_clean(values.get(column, "")) for column in range(max(values) + 1)]
+
+
+def load_xlsx(path):
+    """Yield documents of each worksheet's rows under its first row, reading one row at a time
+
+    Reads the workbook's XML directly, so no spreadsheet library is needed
+    and no sheet is ever held in memory whole. Rows are numbered as in the sheet.
+    """
+    with zipfile.ZipFile(path) as archive, _SharedStrings(archive) as strings:
+        for name, member in _sheets(archive):
+            rows = _sheet_rows(archive, member, strings)
+            _, header = next(rows, (None, None))
+            if header is None:
+                continue
+            yield from row_blocks(((number, "\t".join(row)) for number, row in rows), path,
+                                  f"Sheet: {name}\n" + "\t".join(header), sheet=name)
+
+
+STREAMING_LOADERS = {
+    'csv': load_csv,
+    'json': load_json,
+    'xml': load_xml,
+    'xlsx': load_xlsx,
+}
+
+
+def streaming_loader(path):
+    """Return the streaming loader for a file's extension, or None"""
+    return STREAMING_LOADERS.get(os.path.splitext(path)[1].lstrip('.').lower())
@@ -0,0 +1,237 @@
+"""
+On-disk cache of parsed documents, keyed by file content hash
+
+Run `python -m RAG.text_cache prune` to drop the entries of files that
+were deleted from the uploads folder or changed since they were parsed.
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# What reading a truncated or damaged entry raises: gzip, zlib and JSON errors
+CORRUPT_ERRORS = (OSError, EOFError, zlib.error, ValueError, KeyError)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    sha256 TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL,
+    raw_bytes INTEGER NOT NULL,
+    parse_seconds REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL
+);
+"""
+
+
+class ParsedTextCache:
+    """Documents extracted from each upload, stored once per content hash
+
+    Parsing is the slowest step of ingestion, and its result depends only
+    on the file's bytes, so a changed chunker or embedding model re-chunks
+    and re-embeds from here instead of parsing every file again. Each
+    entry is the file's documents with their metadata (pages, element
+    types) as gzip-compressed JSON Lines, written and read one document at
+    a time; a SQLite database records sizes, the time the parse took and
+    which upload paths point at which hash, so prune can tell the entries
+    of deleted files apart.
+    """
+
+    def __init__(self, folder, compresslevel=6):
+        self.folder = folder
+        self.compresslevel = compresslevel
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0  # parse time the hits would have cost
+        self.corrupt = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(folder, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(folder, "entries.sqlite"), check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def _path(self, key):
+        return os.path.join(self.folder, key[:2], key + ".jsonl.gz")
+
+    def _remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key, source=None, parse=None):
+        """Return an iterator over the cached documents for a key (content hash and loader version), or None
+
+        The documents are read back one line at a time. source, the upload
+        path being indexed, is recorded against the key and replaces the
+        source metadata of the cached documents. An entry found truncated
+        or damaged while reading is deleted; parse, a function returning
+        the file's documents, then takes over from the first document not
+        yet read and stores the entry again. Without it the error is raised.
+        """
+        try:
+            f = gzip.open(self._path(key), "rt", encoding="utf-8")
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT parse_seconds FROM entries WHERE sha256 = ?", (key,)).fetchone()
+            self._db.execute("UPDATE entries SET last_used = ? WHERE sha256 = ?", (time.time(), key))
+            if source is not None:
+                self._db.execute("INSERT OR REPLACE INTO sources (path, sha256) VALUES (?, ?)", (source, key))
+            self.hits += 1
+            self.seconds_saved += row[0] if row else 0.0
+        return self._read(f, key, source, parse)
+
+    def _read(self, f, key, source, parse):
+        read = 0
+        try:
+            with f:
+                for line in f:
+                    record = json.loads(line)
+                    metadata = record["metadata"]
+                    if source is not None and "source" in metadata:
+                        metadata["source"] = source
+                    document = Document(page_content=record["text"], metadata=metadata)
+                    read += 1
+                    yield document
+            return
+        except CORRUPT_ERRORS as e:
+            logger.warning("Parsed-text entry %s is damaged (%s: %s); parsing again", key, type(e).__name__, e)
+            with self._lock:
+                self.corrupt += 1
+                self._db.execute("DELETE FROM entries WHERE sha256 = ?", (key,))
+            self._remove(key)
+            if parse is None:
+                raise
+        # The parse is the same as the one cached, so the documents already read are skipped
+        for index, document in enumerate(self.put(key, parse(), source)):
+            if index >= read:
+                yield document
+
+    def put(self, key, documents, source=None):
+        """Store the documents parsed from a file under its key, passing each one on as it is written
+
+        Returns a generator, so the entry is written while the caller reads
+        the documents and a large file is never held whole. The entry only
+        appears once the documents have all been read; a parse that fails
+        or is left unfinished leaves nothing behind. The time spent waiting
+        for documents is recorded as the parse time.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a unique name and renamed, so readers never see half a file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        documents = iter(documents)
+        raw_size, parse_seconds = 0, 0.0
+        stored = False
+        try:
+            with gzip.open(tmp_path, "wb", self.compresslevel) as f:
+                while True:
+                    start = time.perf_counter()
+                    document = next(documents, None)
+                    parse_seconds += time.perf_counter() - start
+                    if document is None:
+                        break
+                    line = (json.dumps({"text": document.page_content, "metadata": document.metadata},
+                                       ensure_ascii=False, default=str) + "\n").encode("utf-8")
+                    f.write(line)
+                    raw_size += len(line)
+                    yield document
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+            stored = True
+        finally:
+            if not stored:
+                try:
+                    os.remove(tmp_path)
+                except FileNotFoundError:
+                    pass
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (sha256, bytes, raw_bytes, parse_seconds, last_used) "
+                "VALUES (?, ?, ?, ?, ?)", (key, size, raw_size, parse_seconds, time.time())
+            )
+            if source is not None:
+                self._db.execute("INSERT OR REPLACE INTO sources (path, sha256) VALUES (?, ?)", (source, key))
+
+    def prune(self, upload_folder):
+        """Drop entries no longer backing any file in upload_folder; return (entries, bytes) removed
+
+        A path whose file was deleted stops referencing its hash, and a
+        re-uploaded file already points at its new hash, so what is left
+        unreferenced is content that no upload has any more.
+        """
+        with self._lock:
+            for (path,) in self._db.execute("SELECT path FROM sources").fetchall():
+                if not os.path.exists(os.path.join(upload_folder, path)):
+                    self._db.execute("DELETE FROM sources WHERE path = ?", (path,))
+            stale = self._db.execute(
+                "SELECT sha256, bytes FROM entries WHERE sha256 NOT IN (SELECT sha256 FROM sources)"
+            ).fetchall()
+            for sha256, _ in stale:
+                self._db.execute("DELETE FROM entries WHERE sha256 = ?", (sha256,))
+        for sha256, _ in stale:
+            self._remove(sha256)
+        removed_bytes = sum(size for _, size in stale)
+        if stale:
+            logger.info("Pruned %d parsed-text entries (%d bytes)", len(stale), removed_bytes)
+        return len(stale), removed_bytes
+
+    def stats(self):
+        """Return hit/miss counters, parse time saved and the compressed and original sizes"""
+        with self._lock:
+            entries, size, raw_size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bytes), 0), COALESCE(SUM(raw_bytes), 0) FROM entries"
+            ).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": size,
+                "raw_bytes": raw_size,
+                "compression_ratio": raw_size / size if size else None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "corrupt": self.corrupt,
+                "parse_seconds_saved": self.seconds_saved,
+            }
+
+
+def main():
+    from config import RAG_CONFIG, UPLOAD_FOLDER
+
+    parser = argparse.ArgumentParser(description="Maintain the parsed-text cache")
+    parser.add_argument("command", choices=["prune", "stats"])
+    parser.add_argument("--uploads", default=UPLOAD_FOLDER, help="Uploads folder the cache belongs to")
+    parser.add_argument("--cache", default=RAG_CONFIG['TEXT_CACHE_FOLDER'], help="Cache folder")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    cache = ParsedTextCache(args.cache)
+    if args.command == "prune":
+        entries, size = cache.prune(args.uploads)
+        print(f"Removed {entries} entries, {size / (1024 * 1024):.1f} MB")
+    stats = cache.stats()
+    print(f"{stats['entries']} entries, {stats['bytes'] / (1024 * 1024):.1f} MB on disk "
+          f"({stats['raw_bytes'] / (1024 * 1024):.1f} MB of parsed text)")
+
+
+if __name__ == "__main__":
+    main()
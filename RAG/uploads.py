@@ -0,0 +1,279 @@
+"""
+Resumable chunked uploads, streamed to disk and hashed as they arrive
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+INCOMING_FOLDER = ".incoming"  # hidden, so the ingestion scan skips partial files
+DONE_SUFFIX = ".done"  # outcome of a finished upload, kept for expiry so a retried last chunk gets it
+
+
+class UploadOffsetError(Exception):
+    """A chunk did not start where the bytes confirmed so far end"""
+
+    def __init__(self, offset):
+        super().__init__(f"Upload continues at offset {offset}")
+        self.offset = offset
+
+
+class UploadLimitError(Exception):
+    """As many uploads as allowed are already in progress"""
+
+    def __init__(self, limit):
+        super().__init__(f"Too many uploads in progress (at most {limit})")
+        self.limit = limit
+
+
+class UploadSessions:
+    """Uploads in progress, each a partial file plus the SHA-256 of its bytes so far
+
+    A client creates a session with the file name and size, then sends the
+    bytes in order, each chunk with the offset it starts at. Chunks are
+    copied to the partial file block by block and fed to the hash on the
+    way, so memory use depends on neither chunk nor file size. The offset
+    reached is saved after every chunk, including one cut short by a
+    dropped connection, and the client resumes from it. Partial files live
+    in a hidden folder inside the uploads folder: a finished upload is
+    renamed into place, never copied. After a restart a session is picked
+    up again by truncating its file to the saved offset and rehashing it.
+
+    At most max_sessions uploads are in progress at once. A finished
+    upload leaves its outcome behind until it expires, so a client whose
+    last chunk was answered by a dropped connection can ask again.
+    """
+
+    def __init__(self, upload_folder, max_bytes=1024 * 1024 * 1024, chunk_size=8 * 1024 * 1024,
+                 expiry=24 * 3600, block_size=1024 * 1024, max_sessions=16):
+        self.upload_folder = upload_folder
+        self.folder = os.path.join(upload_folder, INCOMING_FOLDER)
+        self.max_bytes = max_bytes
+        self.max_sessions = max_sessions
+        self.chunk_size = chunk_size  # suggested to clients
+        self.expiry = expiry
+        self.block_size = block_size
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.bytes_received = 0
+        self.completed = 0
+        self.unchanged = 0  # completed uploads identical to the file already under that name
+        self.interrupted = 0  # chunks cut short, e.g. by a dropped connection
+        self.restored = 0  # sessions reloaded from disk after a restart
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _path(self, upload_id, suffix):
+        if not upload_id.isalnum():
+            raise KeyError(upload_id)
+        return os.path.join(self.folder, upload_id + suffix)
+
+    def _save(self, session):
+        meta = {key: session[key] for key in ("id", "filename", "size", "offset", "sha256", "created", "updated")}
+        path = self._path(session["id"], ".json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+    def _restore(self, upload_id):
+        """Load a session saved by an earlier process; the bytes after its saved offset were never confirmed"""
+        try:
+            with open(self._path(upload_id, ".json")) as f:
+                session = json.load(f)
+        except (OSError, ValueError):
+            raise KeyError(upload_id)
+        digest = hashlib.sha256()
+        try:
+            with open(self._path(upload_id, ".part"), "r+b") as f:
+                f.truncate(session["offset"])
+                for block in iter(lambda: f.read(self.block_size), b""):
+                    digest.update(block)
+        except OSError:
+            raise KeyError(upload_id)
+        session.update(hash=digest, lock=threading.Lock())
+        self.restored += 1
+        logger.info("Resumed upload %s of %s at %d of %d bytes", upload_id, session["filename"],
+                    session["offset"], session["size"])
+        return session
+
+    def _session(self, upload_id):
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            if session is None:
+                session = self._sessions[upload_id] = self._restore(upload_id)
+            return session
+
+    def create(self, filename, size):
+        """Start an upload and return its status
+
+        Raises UploadLimitError when max_sessions uploads are already in progress.
+        """
+        filename = os.path.basename(filename or "")
+        if not filename:
+            raise ValueError("A file name is required")
+        if size < 0 or size > self.max_bytes:
+            raise ValueError(f"Size must be between 0 and {self.max_bytes} bytes")
+        self.expire()
+        now = time.time()
+        session = {"id": uuid.uuid4().hex, "filename": filename, "size": size, "offset": 0, "sha256": None,
+                   "created": now, "updated": now, "hash": hashlib.sha256(), "lock": threading.Lock()}
+        with self._lock:
+            # Counted on disk, so sessions not reloaded since a restart count too
+            if sum(name.endswith(".json") for name in os.listdir(self.folder)) >= self.max_sessions:
+                raise UploadLimitError(self.max_sessions)
+            open(self._path(session["id"], ".part"), "wb").close()
+            if size == 0:
+                session["sha256"] = session["hash"].hexdigest()
+            self._save(session)
+            self._sessions[session["id"]] = session
+        return self.status(session["id"])
+
+    def status(self, upload_id):
+        """Return offset, size and, once every byte arrived, the content hash
+
+        finished is set once the upload was stored or found unchanged; the
+        status then comes from the outcome it left behind.
+        """
+        try:
+            session = self._session(upload_id)
+        except KeyError:
+            try:
+                with open(self._path(upload_id, DONE_SUFFIX)) as f:
+                    done = json.load(f)
+            except (OSError, ValueError):
+                raise KeyError(upload_id)
+            return dict(done, chunk_size=self.chunk_size)
+        return {"upload_id": session["id"], "filename": session["filename"], "size": session["size"],
+                "offset": session["offset"], "complete": session["sha256"] is not None,
+                "sha256": session["sha256"], "chunk_size": self.chunk_size, "finished": False}
+
+    def append(self, upload_id, offset, stream):
+        """Copy a chunk from stream to the partial file; it must start at the confirmed offset
+
+        Raises UploadOffsetError when it does not, so the client can resend
+        from the right place. Whatever arrived is kept even if reading the
+        stream fails halfway.
+        """
+        session = self._session(upload_id)
+        with session["lock"]:
+            if offset != session["offset"] or session["sha256"] is not None:
+                raise UploadOffsetError(session["offset"])
+            remaining = session["size"] - offset
+            received = 0
+            try:
+                with open(self._path(upload_id, ".part"), "ab") as f:
+                    try:
+                        while True:
+                            block = stream.read(min(self.block_size, remaining - received + 1))
+                            if not block:
+                                break
+                            if received + len(block) > remaining:
+                                raise ValueError("Chunk goes past the size given when the upload was created")
+                            f.write(block)
+                            session["hash"].update(block)
+                            received += len(block)
+                    finally:
+                        f.flush()
+                        os.fsync(f.fileno())
+            except Exception:
+                self.interrupted += 1
+                raise
+            finally:
+                session["offset"] += received
+                session["updated"] = time.time()
+                if session["offset"] == session["size"]:
+                    session["sha256"] = session["hash"].hexdigest()
+                self._save(session)
+                with self._lock:
+                    self.bytes_received += received
+        return self.status(upload_id)
+
+    def finish(self, upload_id):
+        """Move a complete upload into the uploads folder and return its relative path"""
+        session = self._session(upload_id)
+        with session["lock"]:
+            if session["sha256"] is None:
+                raise UploadOffsetError(session["offset"])
+            os.replace(self._path(upload_id, ".part"), os.path.join(self.upload_folder, session["filename"]))
+            self._done(session, unchanged=False)
+            self._forget(upload_id)
+            self.completed += 1
+        return session["filename"]
+
+    def discard(self, upload_id, unchanged=False):
+        """Drop an upload and its partial file
+
+        unchanged counts it as a resend of the stored file, which finishes
+        it as far as the client is concerned.
+        """
+        session = self._session(upload_id)
+        with session["lock"]:
+            if unchanged:
+                self._done(session, unchanged=True)
+            self._forget(upload_id)
+            for suffix in (".part", ".json"):
+                try:
+                    os.remove(self._path(upload_id, suffix))
+                except FileNotFoundError:
+                    pass
+            self.unchanged += int(unchanged)
+
+    def _done(self, session, unchanged):
+        """Save the outcome of a finished upload for status() to report until it expires"""
+        done = {"upload_id": session["id"], "filename": session["filename"], "size": session["size"],
+                "offset": session["size"], "complete": True, "sha256": session["sha256"], "finished": True,
+                "unchanged": unchanged, "updated": time.time()}
+        path = self._path(session["id"], DONE_SUFFIX)
+        with open(path + ".tmp", "w") as f:
+            json.dump(done, f)
+        os.replace(path + ".tmp", path)
+
+    def _forget(self, upload_id):
+        try:
+            os.remove(self._path(upload_id, ".json"))
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._sessions.pop(upload_id, None)
+
+    def expire(self):
+        """Remove uploads that received nothing for longer than expiry, and outcomes kept as long"""
+        cutoff = time.time() - self.expiry
+        for name in os.listdir(self.folder):
+            upload_id, ext = os.path.splitext(name)
+            if ext not in (".json", DONE_SUFFIX):
+                continue
+            try:
+                with open(os.path.join(self.folder, name)) as f:
+                    updated = json.load(f)["updated"]
+            except (OSError, ValueError, KeyError):
+                continue
+            if updated < cutoff and ext == DONE_SUFFIX:
+                os.remove(os.path.join(self.folder, name))
+            elif updated < cutoff:
+                logger.info("Removing upload %s, idle since %s", upload_id, time.ctime(updated))
+                with self._lock:
+                    self._sessions.pop(upload_id, None)
+                for suffix in (".part", ".json"):
+                    try:
+                        os.remove(self._path(upload_id, suffix))
+                    except FileNotFoundError:
+                        pass
+
+    def stats(self):
+        """Return uploads in progress and counters"""
+        with self._lock:
+            active = len(self._sessions)
+        return {
+            "active": active,
+            "bytes_received": self.bytes_received,
+            "completed": self.completed,
+            "unchanged": self.unchanged,
+            "interrupted": self.interrupted,
+            "restored": self.restored,
+        }
@@ -0,0 +1,1253 @@
+"""
+Persistent vector index kept in sync with the uploads folder
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from RAG.bm25 import BM25Index, reciprocal_rank_fusion
+from RAG.chunker import Chunker
+from RAG.index_types import (
+    IndexPolicy, build_index, bytes_per_vector, recall_at_k, sample_ids, timed_search
+)
+from RAG.loaders import LOADER_VERSION, list_upload_files, load_file
+from RAG.parsing import ParseError
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_FOLDER = "segments"
+STAGING_FOLDER = "staging"
+SEARCH_INDEX_FILE = "search.faiss"
+SEARCH_IDS_FILE = "search.ids.npy"
+DOCSTORE_FILE = "docstore-{}.jsonl"
+OFFSETS_FILE = "docstore-{}.offsets"
+IDS_FILE = "docstore-{}.ids"
+TOMBSTONES_FILE = "tombstones.bin"
+MANIFEST_FILE = "manifest-{}.jsonl"
+META_FILE = "meta.json"
+BM25_FILE = "bm25.sqlite"
+
+SEARCH_MODES = ("hybrid", "vector", "keyword")
+
+# Map flat index codes straight from the file instead of copying them into RAM;
+# FAISS builds without IO_FLAG_MMAP_IFC fall back to the older mmap flag
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def default_index_folder(upload_folder):
+    """Return the index folder that sits next to an uploads folder"""
+    return os.path.normpath(upload_folder) + "_index"
+
+
+def _folder_name(embedding_model):
+    return re.sub(r"[^\w.-]", "_", embedding_model)
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_json(path, data):
+    # Write to a temporary file first so a crash never leaves half a file behind
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, default=str)
+    os.replace(tmp_path, path)
+
+
+def merge_scored(results, k, mode="hybrid"):
+    """Merge scored_search results from one or more indexes into the k best Documents"""
+    vector = sorted((match for result in results for match in result.get("vector", [])), key=lambda m: m[0])
+    keyword = sorted((match for result in results for match in result.get("keyword", [])), key=lambda m: -m[0])
+    if mode == "vector":
+        return [doc for _, doc in vector[:k]]
+    if mode == "keyword":
+        return [doc for _, doc in keyword[:k]]
+
+    candidates = {}
+    rankings = []
+    for matches in (vector, keyword):
+        ranking = []
+        for _, doc in matches:
+            key = (doc.metadata.get("source"), doc.metadata.get("chunk_index"))
+            candidates.setdefault(key, doc)
+            ranking.append(key)
+        rankings.append(ranking)
+    return [candidates[key] for key in reciprocal_rank_fusion(rankings)[:k]]
+
+
+class DocStore:
+    """Chunk records ({"source", "text", "metadata"}) stored as JSON lines, addressed by chunk id
+
+    The file only grows: a write appends its records as raw lines and their
+    (start, end) byte offsets to a second file, and each store object sees
+    the first count ids. Both files are memory-mapped and only the records
+    actually read are parsed, so neither opening the store nor appending to
+    it touches the records already there. Ids are never reused; compact()
+    copies the lines of live ids to the next pair of files, with a third
+    listing those ids, since they are no longer contiguous.
+    """
+
+    def __init__(self, folder=None, number=0, count=0, size=0, lines=None, base=0, kept=0):
+        self.folder = folder
+        self.number = number  # of the file pair, bumped by compact()
+        self.count = count
+        self.size = size  # bytes of the docstore file the count ids use
+        self.lines = count if lines is None else lines  # records stored, fewer than count after compact()
+        self.base = base  # ids below it were compacted, and only those in the ids file kept
+        self.kept = kept  # their offsets come first, then those of the ids from base on
+        self._data = None
+        self._offsets = None
+        self._ids = None
+        if self.rows:
+            if size:
+                with open(self.path, 'rb') as f:
+                    self._data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            self._offsets = np.memmap(self.offsets_path, dtype='int64', mode='r', shape=(self.rows, 2))
+        if kept:
+            self._ids = np.memmap(self.ids_path, dtype='int64', mode='r', shape=(kept,)).view(np.ndarray)
+
+    @property
+    def rows(self):
+        """Rows of the offsets file this store uses"""
+        return self.kept + self.count - self.base
+
+    @property
+    def path(self):
+        return os.path.join(self.folder, DOCSTORE_FILE.format(self.number))
+
+    @property
+    def offsets_path(self):
+        return os.path.join(self.folder, OFFSETS_FILE.format(self.number))
+
+    @property
+    def ids_path(self):
+        return os.path.join(self.folder, IDS_FILE.format(self.number))
+
+    def append(self, records):
+        """Write records after the last id, returning the store that also sees them
+
+        This store is left as it is, so searches on older generations keep
+        their view. Anything past its count on disk, such as the lines of
+        a write that failed before being committed, is overwritten.
+        """
+        added = 0
+        offsets = []
+        position = self.size
+        with open(self.path, 'ab') as f, open(self.offsets_path, 'ab') as offsets_file:
+            f.truncate(self.size)
+            offsets_file.truncate(self.rows * 16)
+            for record in records:
+                line = json.dumps(record, default=str).encode('utf-8') + b"\n"
+                f.write(line)
+                offsets.append((position, position + len(line)))
+                position += len(line)
+                if len(offsets) == 4096:
+                    offsets_file.write(np.asarray(offsets, dtype='int64').tobytes())
+                    added += len(offsets)
+                    offsets = []
+            offsets_file.write(np.asarray(offsets, dtype='int64').reshape(-1, 2).tobytes())
+            added += len(offsets)
+        return DocStore(self.folder, self.number, self.count + added, position, self.lines + added,
+                        self.base, self.kept)
+
+    def compact(self, live_ids):
+        """Copy the lines of live_ids, unparsed, to the next files and return the store over them
+
+        The new offsets and ids files have a row per live id only, so their
+        size follows the live chunks, not every id ever given out.
+        """
+        store = DocStore(self.folder, self.number + 1)
+        live_ids = np.sort(np.asarray(live_ids, dtype='int64'))
+        offsets = []
+        position = 0
+        with open(store.path, 'wb') as f, open(store.offsets_path, 'wb') as offsets_file:
+            for chunk_id in live_ids:
+                line = self.raw(int(chunk_id))
+                f.write(line)
+                offsets.append((position, position + len(line)))
+                position += len(line)
+                if len(offsets) == 4096:
+                    offsets_file.write(np.asarray(offsets, dtype='int64').tobytes())
+                    offsets = []
+            offsets_file.write(np.asarray(offsets, dtype='int64').reshape(-1, 2).tobytes())
+        live_ids.tofile(store.ids_path)
+        return DocStore(self.folder, store.number, self.count, position, len(live_ids), self.count, len(live_ids))
+
+    def __len__(self):
+        return self.count
+
+    def _row(self, chunk_id):
+        if chunk_id >= self.base:
+            return self.kept + chunk_id - self.base
+        row = int(np.searchsorted(self._ids, chunk_id)) if self.kept else 0
+        if row == self.kept or self._ids[row] != chunk_id:
+            raise KeyError(chunk_id)
+        return row
+
+    def raw(self, chunk_id):
+        start, end = self._offsets[self._row(chunk_id)]
+        return self._data[start:end]
+
+    def __getitem__(self, chunk_id):
+        return json.loads(self.raw(chunk_id))
+
+
+class StagedChunks:
+    """Chunks of one file and their vectors, spooled to disk until the file is written to the index
+
+    Embedding appends each batch as it comes back, records as JSON lines
+    and vectors as raw float32, so a file of any size costs one batch of
+    memory to embed. The index write then streams the records into the
+    docstore and keyword index and maps the vectors for its segment.
+    """
+
+    def __init__(self, folder):
+        self.folder = tempfile.mkdtemp(dir=folder)
+        self._records = open(os.path.join(self.folder, "records.jsonl"), 'wb')
+        self._vectors = open(os.path.join(self.folder, "vectors.f32"), 'wb')
+        self.count = 0
+        self.dim = None
+
+    def add(self, chunks, vectors):
+        """Append a batch of chunks and their embeddings"""
+        if not chunks:
+            return
+        vectors = np.asarray(vectors, dtype='float32').reshape(len(chunks), -1)
+        for chunk in chunks:
+            self._records.write(json.dumps({"text": chunk.page_content, "metadata": chunk.metadata},
+                                           default=str).encode('utf-8') + b"\n")
+        self._vectors.write(vectors.tobytes())
+        self.count += len(chunks)
+        self.dim = vectors.shape[1]
+
+    def chunks(self):
+        """Yield (text, metadata) of each staged chunk, in order"""
+        self._records.close()
+        with open(self._records.name, 'rb') as f:
+            for line in f:
+                record = json.loads(line)
+                yield record["text"], record["metadata"]
+
+    def vectors(self):
+        """The staged vectors, mapped from disk"""
+        self._vectors.close()
+        return np.memmap(self._vectors.name, dtype='float32', mode='r', shape=(self.count, self.dim))
+
+    def discard(self):
+        self._records.close()
+        self._vectors.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+class Segment:
+    """Vectors written together, in one flat FAISS index with the chunk id of each position
+
+    A segment never changes once written. Vectors of replaced or removed
+    chunks are tombstoned by listing their positions in dead, which
+    searches skip; merges and compaction drop them for good.
+    """
+
+    def __init__(self, name, index, ids, dead=None):
+        self.name = name
+        self.index = index
+        # Ascending chunk ids, one per position; a plain array view indexes faster than np.memmap
+        self.ids = ids.view(np.ndarray)
+        self.dead = dead if dead is not None else np.empty(0, dtype='int64')  # ascending positions
+        self._params = None
+        if len(self.dead):
+            # The selectors are referenced from C++ only, so they are kept alive here
+            self._dead_selector = faiss.IDSelectorBatch(self.dead)
+            self._live_selector = faiss.IDSelectorNot(self._dead_selector)
+            self._params = faiss.SearchParameters(sel=self._live_selector)
+
+    @property
+    def size(self):
+        return len(self.ids)
+
+    @property
+    def live(self):
+        return len(self.ids) - len(self.dead)
+
+    def positions(self, chunk_ids):
+        """Return (found, positions): which of chunk_ids this segment holds, and where"""
+        if not self.size:
+            return np.zeros(len(chunk_ids), dtype=bool), np.zeros(len(chunk_ids), dtype='int64')
+        positions = np.minimum(np.searchsorted(self.ids, chunk_ids), self.size - 1)
+        return self.ids[positions] == chunk_ids, positions
+
+    def live_mask(self, chunk_ids):
+        """True for each of chunk_ids this segment holds and has not tombstoned"""
+        found, positions = self.positions(chunk_ids)
+        if len(self.dead):
+            found &= ~np.isin(positions, self.dead)
+        return found
+
+    def kill(self, chunk_ids):
+        """The segment with these chunks tombstoned, or itself when it holds none of them"""
+        found, positions = self.positions(chunk_ids)
+        if not found.any():
+            return self
+        return Segment(self.name, self.index, self.ids, np.union1d(self.dead, positions[found]))
+
+    def _alive(self):
+        keep = np.ones(self.size, dtype=bool)
+        keep[self.dead] = False
+        return keep
+
+    def live_ids(self):
+        """Chunk ids of the positions not tombstoned"""
+        return self.ids[self._alive()] if len(self.dead) else self.ids
+
+    def live_vectors(self):
+        """Return (chunk ids, vectors) of the positions not tombstoned"""
+        vectors = self.index.reconstruct_n(0, self.size)
+        if not len(self.dead):
+            return self.ids.copy(), vectors
+        keep = self._alive()
+        return self.ids[keep], vectors[keep]
+
+    def search(self, query, k):
+        """Return (L2 distances, chunk ids) of the k nearest live vectors"""
+        k = min(k, self.size)
+        if k == 0:
+            return np.empty(0, dtype='float32'), np.empty(0, dtype='int64')
+        distances, positions = self.index.search(query, k, params=self._params)
+        found = positions[0] != -1
+        return distances[0][found], self.ids[positions[0][found]]
+
+
+class IndexGeneration:
+    """One published state of the index, never modified once searches can see it
+
+    Writers build the next generation off to the side and publish it with a
+    single reference swap. A search pins the generation it started on, so
+    it sees one consistent index from start to finish, and a replaced
+    generation is closed only when its last reader is done. Consecutive
+    generations share every segment a write did not touch.
+    """
+
+    def __init__(self, version, segments=(), docstore=None, search_index=None, search_info=None,
+                 search_ids=None):
+        self.version = version
+        self.segments = tuple(segments)  # in ascending chunk id order
+        self.docstore = docstore if docstore is not None else DocStore()
+        self.search_index = search_index  # approximate index, or None to search the segments directly
+        self.search_info = search_info or {"type": "flat"}
+        self.search_ids = search_ids  # chunk id of each search index position
+        self.readers = 0
+        self.retired = False
+        self.published_at = time.time()
+
+    @property
+    def live(self):
+        """Number of vectors searches can return"""
+        return sum(segment.live for segment in self.segments)
+
+    @property
+    def dead(self):
+        """Number of tombstoned vectors still stored"""
+        return sum(len(segment.dead) for segment in self.segments)
+
+    def with_search_index(self, search_index, search_info, search_ids):
+        """The same vectors with another search index, as a new generation"""
+        return IndexGeneration(self.version, self.segments, self.docstore, search_index, search_info, search_ids)
+
+    def live_mask(self, chunk_ids):
+        """True for each of chunk_ids this generation holds and has not tombstoned"""
+        chunk_ids = np.asarray(chunk_ids, dtype='int64')
+        mask = np.zeros(len(chunk_ids), dtype=bool)
+        for segment in self.segments:
+            mask |= segment.live_mask(chunk_ids)
+        return mask
+
+    def live_vectors(self):
+        """Return (chunk ids, vectors) of every live vector, in chunk id order"""
+        parts = [segment.live_vectors() for segment in self.segments if segment.live]
+        if not parts:
+            return np.empty(0, dtype='int64'), None
+        return np.concatenate([ids for ids, _ in parts]), np.concatenate([vectors for _, vectors in parts])
+
+    def vectors(self, chunk_ids):
+        """Return the stored vectors of chunk_ids, in the same order"""
+        vectors = None
+        for segment in self.segments:
+            found, positions = segment.positions(chunk_ids)
+            if found.any():
+                found_vectors = segment.index.reconstruct_batch(positions[found])
+                if vectors is None:
+                    vectors = np.zeros((len(chunk_ids), found_vectors.shape[1]), dtype='float32')
+                vectors[found] = found_vectors
+        return vectors
+
+    def search(self, query, k):
+        """Return the k nearest live vectors over all segments as [(L2 distance, chunk id)]"""
+        results = [segment.search(query, k) for segment in self.segments if segment.live]
+        if not results:
+            return []
+        distances = np.concatenate([distances for distances, _ in results])
+        ids = np.concatenate([ids for _, ids in results])
+        order = np.argsort(distances, kind='stable')[:k]
+        return [(float(distances[i]), int(ids[i])) for i in order]
+
+    def close(self):
+        # Mapped files and index memory go once no other generation shares them
+        self.segments = ()
+        self.search_index = self.search_ids = None
+        self.docstore = DocStore()
+
+
+class VectorIndex:
+    """FAISS index saved on disk and updated only for added, changed or removed files
+
+    Vectors live in immutable flat segments. A write appends its chunks to
+    the docstore, saves their vectors as a new segment and tombstones the
+    chunks it replaces, so its cost depends on the file written, not on the
+    size of the index. Small segments are merged as they pile up, doubling
+    in size each time, so a search visits O(log n) of them. When the
+    policy calls for it, an approximate IVF or HNSW search index is built
+    over the live vectors in the background after writes settle; until that
+    finishes, searches fall back to the exact segments so results never
+    come from stale positions.
+
+    Searches never wait for writes: they read an immutable IndexGeneration,
+    and a write publishes the next one only once its vectors, docstore
+    records and keyword entries are all saved (see reading()). Writes are
+    serialised among themselves.
+
+    A BM25 inverted index over the same chunks is kept in the same folder
+    under the same chunk ids, for keyword and hybrid search.
+    """
+
+    def __init__(self, upload_folder, index_folder, embeddings, embedding_model, chunker=None,
+                 embed_batch_size=64, mmap=True, policy=None, hybrid_fetch_factor=4, parser=None,
+                 text_cache=None):
+        self.upload_folder = upload_folder
+        # One sub-folder per embedding model, so switching models does not throw vectors away
+        self.index_folder = os.path.join(index_folder, _folder_name(embedding_model))
+        self.embeddings = embeddings
+        self.embedding_model = embedding_model
+        self.chunker = chunker or Chunker()
+        self.embed_batch_size = embed_batch_size
+        self.mmap = mmap  # map segment files instead of keeping their vectors in RAM
+        self.policy = policy or IndexPolicy()
+        self.hybrid_fetch_factor = hybrid_fetch_factor
+        # Turns a file path into documents; a ParserPool's parse runs it in worker processes
+        self.parser = parser or load_file
+        # A ParsedTextCache, so re-chunking and re-embedding do not parse files again
+        self.text_cache = text_cache
+        self.manifest = {}  # relative path -> {"mtime", "size", "sha256", "ids": [[first, end], ...]}
+        # The manifest is saved as a journal of changed entries, rewritten once mostly superseded
+        self._manifest_number = 0
+        self._manifest_bytes = 0
+        self._manifest_lines = 0
+        self._generation = IndexGeneration(0)
+        self._generation_lock = threading.Lock()  # guards the current generation and reader counts
+        self._draining = set()  # replaced generations that still have readers
+        self.generations_published = 0
+        self.generations_retired = 0
+        self._lock = threading.RLock()  # serialises writers
+        self._next_segment = 0
+        self._tombstones = 0  # committed entries of the tombstones file
+        self._removals = []  # (generation, chunk ids) whose keyword entries go once it retires
+        self._rebuild_timer = None
+        self.segments_written = 0
+        self.vectors_merged = 0  # vectors copied by merges and compaction
+        self.compactions = 0
+
+        os.makedirs(os.path.join(self.index_folder, SEGMENT_FOLDER), exist_ok=True)
+        # Chunks staged by writes a crash interrupted are of no use any more
+        shutil.rmtree(self._path(STAGING_FOLDER), ignore_errors=True)
+        os.makedirs(self._path(STAGING_FOLDER))
+        if not self._load():
+            self._clear()
+        self.keyword_index = BM25Index(self._path(BM25_FILE))
+        if self.keyword_index.version != self.version:
+            logger.info("Keyword index out of date, rebuilding it from the docstore")
+            self.keyword_index.rebuild(self._live_chunks(self.generation), self.version)
+        if self.generation.live and self.search_info.get("version") != self.version:
+            self._schedule_rebuild()
+
+    @property
+    def generation(self):
+        return self._generation
+
+    @property
+    def version(self):
+        return self._generation.version
+
+    @property
+    def search_index(self):
+        return self._generation.search_index
+
+    @property
+    def search_info(self):
+        return self._generation.search_info
+
+    @property
+    def docstore(self):
+        return self._generation.docstore
+
+    @contextmanager
+    def reading(self):
+        """Pin the current generation for the duration of a search"""
+        with self._generation_lock:
+            generation = self._generation
+            generation.readers += 1
+        try:
+            yield generation
+        finally:
+            with self._generation_lock:
+                generation.readers -= 1
+                finished = generation.retired and generation.readers == 0
+                if finished:
+                    self._draining.discard(generation)
+            if finished:
+                self._retire(generation)
+
+    def _publish(self, generation):
+        """Make generation the one new searches see; the previous one retires once its readers finish"""
+        with self._generation_lock:
+            previous, self._generation = self._generation, generation
+            previous.retired = True
+            idle = previous.readers == 0
+            if not idle:
+                self._draining.add(previous)
+            self.generations_published += 1
+        if idle:
+            self._retire(previous)
+        return previous
+
+    def _retire(self, generation):
+        generation.close()
+        self.generations_retired += 1
+
+    def _path(self, name):
+        return os.path.join(self.index_folder, name)
+
+    def _segment_path(self, name, suffix):
+        return os.path.join(self.index_folder, SEGMENT_FOLDER, name + suffix)
+
+    def _chunking(self):
+        return {"chunk_size": self.chunker.chunk_size, "chunk_overlap": self.chunker.chunk_overlap,
+                "tokenizer": self.chunker.tokenizer, "loader_version": LOADER_VERSION}
+
+    def _load(self):
+        """Load a previously saved index, returning False if there is none or it is unusable"""
+        meta = _read_json(self._path(META_FILE), {})
+        if not meta:
+            return False
+        if meta.get("embedding_model") != self.embedding_model:
+            logger.info("Embedding model changed (%s -> %s), rebuilding index",
+                        meta.get("embedding_model"), self.embedding_model)
+            return False
+        if meta.get("chunking") != self._chunking():
+            logger.info("Chunking settings changed, rebuilding index")
+            return False
+
+        stored = meta["docstore"]
+        docstore = DocStore(self.index_folder, stored["number"])
+        rows = stored["kept"] + stored["records"] - stored["base"]
+        tombstones = meta["tombstones"]
+        # A write interrupted before its meta was saved may have left data past the committed sizes
+        for path, size in ((docstore.path, stored["bytes"]), (docstore.offsets_path, rows * 16),
+                           (docstore.ids_path, stored["kept"] * 8), (self._path(TOMBSTONES_FILE), tombstones * 8)):
+            if (os.path.getsize(path) if os.path.exists(path) else 0) < size:
+                logger.warning("%s is shorter than its metadata says, rebuilding index", path)
+                return False
+            if os.path.exists(path):
+                os.truncate(path, size)
+        docstore = DocStore(self.index_folder, stored["number"], stored["records"], stored["bytes"], stored["lines"],
+                            stored["base"], stored["kept"])
+
+        dead = np.fromfile(self._path(TOMBSTONES_FILE), dtype='int64', count=tombstones) if tombstones else None
+        segments = []
+        for name in meta["segments"]:
+            try:
+                segment = self._read_segment(name)
+            except (OSError, RuntimeError) as e:
+                logger.warning("Segment %s unreadable (%s), rebuilding index", name, e)
+                return False
+            segments.append(segment.kill(dead) if dead is not None else segment)
+        journal = meta["manifest"]
+        self._manifest_number = journal["number"]
+        path = self._path(MANIFEST_FILE.format(self._manifest_number))
+        if (os.path.getsize(path) if os.path.exists(path) else 0) < journal["bytes"]:
+            logger.warning("%s is shorter than its metadata says, rebuilding index", path)
+            return False
+        os.truncate(path, journal["bytes"])
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                change = json.loads(line)
+                if change["entry"] is None:
+                    self.manifest.pop(change["path"], None)
+                else:
+                    self.manifest[change["path"]] = change["entry"]
+                self._manifest_lines += 1
+        self._manifest_bytes = journal["bytes"]
+        self._remove_unreferenced(meta["segments"], stored["number"], self._manifest_number)
+
+        self._next_segment = meta["next_segment"]
+        self._tombstones = tombstones
+        version = meta["version"]
+
+        search_index = search_ids = None
+        search_info = meta.get("search_index", {})
+        if search_info.get("version") == version:
+            if search_info.get("factory"):
+                search_index = faiss.read_index(self._path(SEARCH_INDEX_FILE), MMAP_FLAGS if self.mmap else 0)
+                search_ids = np.load(self._path(SEARCH_IDS_FILE), mmap_mode='r' if self.mmap else None)
+                self.policy.apply(search_index)
+        else:
+            search_info = None
+        self._generation = IndexGeneration(version, segments, docstore, search_index, search_info, search_ids)
+        return True
+
+    def _clear(self):
+        """Start an empty index, removing the files of the previous one"""
+        self._remove_unreferenced([], None, None)
+        for name in (TOMBSTONES_FILE, SEARCH_INDEX_FILE, SEARCH_IDS_FILE):
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+        self.manifest = {}
+        self._manifest_number = self._manifest_bytes = self._manifest_lines = 0
+        open(self._path(MANIFEST_FILE.format(0)), 'wb').close()
+        self._generation = IndexGeneration(0, docstore=DocStore(self.index_folder))
+        self._write_meta(self._generation)
+
+    def _remove_unreferenced(self, segment_names, docstore_number, manifest_number):
+        """Delete segment, docstore and manifest files no committed generation uses"""
+        keep = set(segment_names)
+        folder = os.path.join(self.index_folder, SEGMENT_FOLDER)
+        for name in os.listdir(folder):
+            if name.split(".")[0] not in keep:
+                os.remove(os.path.join(folder, name))
+        keep = {DOCSTORE_FILE.format(docstore_number), OFFSETS_FILE.format(docstore_number),
+                IDS_FILE.format(docstore_number), MANIFEST_FILE.format(manifest_number)}
+        for name in os.listdir(self.index_folder):
+            if name.startswith(("docstore-", "manifest-")) and name not in keep:
+                os.remove(self._path(name))
+
+    def _log_manifest(self, rel_path, entry):
+        """Set a file's manifest entry, None to drop it, and append the change to the journal
+
+        The journal counts as saved once the next meta write records its
+        new length. When superseded lines outnumber the entries it is
+        written afresh under the next number; the path of the journal that
+        replaced is returned, for removal once meta points past it.
+        """
+        replaced = None
+        if entry is None:
+            self.manifest.pop(rel_path, None)
+        else:
+            self.manifest[rel_path] = entry
+        if self._manifest_lines > 2 * len(self.manifest) + 64:
+            replaced = self._path(MANIFEST_FILE.format(self._manifest_number))
+            self._manifest_number += 1
+            lines = [json.dumps({"path": path, "entry": entry}, default=str) + "\n"
+                     for path, entry in self.manifest.items()]
+            mode, self._manifest_bytes, self._manifest_lines = 'wb', 0, 0
+        else:
+            lines = [json.dumps({"path": rel_path, "entry": entry}, default=str) + "\n"]
+            mode = 'ab'
+        data = "".join(lines).encode('utf-8')
+        with open(self._path(MANIFEST_FILE.format(self._manifest_number)), mode) as f:
+            f.truncate(self._manifest_bytes)
+            f.write(data)
+        self._manifest_bytes += len(data)
+        self._manifest_lines += len(lines)
+        return replaced
+
+    def _read_segment(self, name):
+        index = faiss.read_index(self._segment_path(name, ".faiss"), MMAP_FLAGS if self.mmap else 0)
+        ids = np.load(self._segment_path(name, ".ids.npy"), mmap_mode='r' if self.mmap else None)
+        if index.ntotal != len(ids):
+            raise RuntimeError(f"{index.ntotal} vectors but {len(ids)} ids")
+        return Segment(name, index, ids)
+
+    def _write_segment(self, ids, vectors):
+        """Save vectors as a new segment file and return the Segment searches will read"""
+        name = f"{self._next_segment:08d}"
+        self._next_segment += 1
+        index = faiss.IndexFlatL2(vectors.shape[1])
+        index.add(vectors)
+        faiss.write_index(index, self._segment_path(name, ".faiss"))
+        with open(self._segment_path(name, ".ids.npy"), 'wb') as f:
+            np.save(f, np.asarray(ids, dtype='int64'))
+        self.segments_written += 1
+        if self.mmap:
+            # Readers map the file; pages are shared with other processes through the page cache
+            return self._read_segment(name)
+        return Segment(name, index, np.asarray(ids, dtype='int64'))
+
+    def _delete_segment(self, segment):
+        for suffix in (".faiss", ".ids.npy"):
+            try:
+                os.remove(self._segment_path(segment.name, suffix))
+            except OSError:
+                pass  # still mapped on a platform that forbids removing it; cleared at the next load
+
+    def _merge(self, segments):
+        """Rewrite mostly tombstoned segments and fold small trailing ones together
+
+        Each fold at least doubles the segment it writes, as in a binary
+        counter, so a vector is copied O(log n) times over its life rather
+        than on every write. Returns (segments, segments no longer used).
+        """
+        kept, obsolete = [], []
+        for segment in segments:
+            if len(segment.dead) > segment.live:
+                obsolete.append(segment)
+                if not segment.live:
+                    continue
+                segment = self._write_segment(*segment.live_vectors())
+                self.vectors_merged += segment.size
+            kept.append(segment)
+        while len(kept) > 1 and kept[-2].live <= 2 * kept[-1].live:
+            older, newer = kept[-2], kept.pop()
+            ids, vectors = zip(older.live_vectors(), newer.live_vectors())
+            kept[-1] = self._write_segment(np.concatenate(ids), np.concatenate(vectors))
+            self.vectors_merged += kept[-1].size
+            obsolete.extend((older, newer))
+        return kept, obsolete
+
+    def _write_meta(self, generation):
+        _write_json(self._path(META_FILE), {
+            "embedding_model": self.embedding_model,
+            "chunking": self._chunking(),
+            "version": generation.version,
+            "segments": [segment.name for segment in generation.segments],
+            "next_segment": self._next_segment,
+            "docstore": {"number": generation.docstore.number, "records": generation.docstore.count,
+                         "bytes": generation.docstore.size, "lines": generation.docstore.lines,
+                         "base": generation.docstore.base, "kept": generation.docstore.kept},
+            "tombstones": self._tombstones,
+            "manifest": {"number": self._manifest_number, "bytes": self._manifest_bytes},
+            "search_index": generation.search_info,
+        })
+
+    @staticmethod
+    def _chunk_ids(entry):
+        """Chunk ids recorded for a file in its manifest entry"""
+        ranges = (entry or {}).get("ids", [])
+        if not ranges:
+            return np.empty(0, dtype='int64')
+        return np.concatenate([np.arange(first, end, dtype='int64') for first, end in ranges])
+
+    def _live_chunks(self, generation):
+        """(chunk id, source, text, metadata) of every live chunk, for rebuilding the keyword index"""
+        for segment in generation.segments:
+            for chunk_id in segment.live_ids():
+                record = generation.docstore[int(chunk_id)]
+                yield int(chunk_id), record["source"], record["text"], record["metadata"]
+
+    def _flush_removals(self):
+        """Drop the keyword entries of tombstoned chunks once no search can still see them"""
+        with self._generation_lock:
+            # The chunks were alive in that generation and every older one
+            oldest = min((generation.version for generation in self._draining), default=None)
+            ready = [ids for generation, ids in self._removals if oldest is None or generation.version < oldest]
+            self._removals = [(generation, ids) for generation, ids in self._removals
+                              if oldest is not None and generation.version >= oldest]
+        for ids in ready:
+            self.keyword_index.remove(ids)
+
+    def _write(self, rel_path, entry, staged=None):
+        """Replace the indexed chunks of rel_path, or remove them when entry is None, in one new generation
+
+        Order matters for searches running meanwhile: new docstore records,
+        segment and keyword entries are saved under fresh chunk ids that the
+        current generation does not show; only then is the next generation
+        published, and the keyword entries of the chunks it tombstones are
+        dropped once no search still reads an older generation.
+        """
+        self._flush_removals()
+        current = self.generation
+        version = current.version + 1
+        docstore = current.docstore
+        segments = list(current.segments)
+
+        added = np.empty(0, dtype='int64')
+        if staged is not None and staged.count:
+            first = docstore.count
+            docstore = docstore.append({"source": rel_path, "text": text, "metadata": metadata}
+                                       for text, metadata in staged.chunks())
+            added = np.arange(first, docstore.count, dtype='int64')
+            segments.append(self._write_segment(added, staged.vectors()))
+            entry = dict(entry, ids=[[first, docstore.count]])
+
+        dead = self._chunk_ids(self.manifest.get(rel_path))
+        if len(dead):
+            segments = [segment.kill(dead) for segment in segments]
+        segments, obsolete = self._merge(segments)
+
+        generation = IndexGeneration(version, segments, docstore)
+        compacting = docstore.lines - generation.live > max(generation.live, 1024)
+        if compacting:
+            generation, removed = self._compacted(generation)
+            obsolete.extend(segment for segment in segments if segment not in generation.segments)
+            dead = np.union1d(dead, removed)
+
+        self.keyword_index.add(((int(chunk_id), rel_path, text, metadata)
+                                for chunk_id, (text, metadata) in zip(added, staged.chunks()))
+                               if len(added) else (), version)
+        saved = (self.manifest.get(rel_path), self._tombstones,
+                 self._manifest_number, self._manifest_bytes, self._manifest_lines)
+        try:
+            if len(dead) and not compacting:
+                with open(self._path(TOMBSTONES_FILE), 'ab') as f:
+                    f.truncate(self._tombstones * 8)
+                    f.write(dead.tobytes())
+                self._tombstones += len(dead)
+            replaced_files = [self._log_manifest(rel_path, entry)]
+            if compacting:
+                self._tombstones = 0
+                replaced_files += [current.docstore.path, current.docstore.offsets_path, current.docstore.ids_path]
+            self._write_meta(generation)
+        except Exception:
+            # Leave the manifest describing the published generation, so a retry kills the right ids
+            previous_entry, self._tombstones, self._manifest_number, self._manifest_bytes, self._manifest_lines = saved
+            if previous_entry is None:
+                self.manifest.pop(rel_path, None)
+            else:
+                self.manifest[rel_path] = previous_entry
+            self.keyword_index.remove(added)
+            raise
+        previous = self._publish(generation)
+        if compacting:
+            os.truncate(self._path(TOMBSTONES_FILE), 0)
+        for path in replaced_files:
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+        for segment in obsolete:
+            self._delete_segment(segment)
+        if len(dead):
+            with self._generation_lock:
+                self._removals.append((previous, dead))
+            self._flush_removals()
+        # The approximate index covers the old vectors only until rebuilt
+        self._schedule_rebuild()
+
+    def _compacted(self, generation):
+        """Drop every tombstoned vector and the docstore lines no live chunk uses
+
+        Run once dead chunks outnumber live ones, so its O(index) cost is
+        spread over at least as many removals. Returns the compacted
+        generation and the chunk ids it dropped.
+        """
+        removed = [segment.ids[segment.dead] for segment in generation.segments if len(segment.dead)]
+        segments = []
+        for segment in generation.segments:
+            if len(segment.dead):
+                segment = self._write_segment(*segment.live_vectors())
+                self.vectors_merged += segment.size
+            segments.append(segment)
+        live_ids = np.concatenate([segment.ids for segment in segments]) if segments else np.empty(0, dtype='int64')
+        docstore = generation.docstore.compact(live_ids)
+        self.compactions += 1
+        logger.info("Compacted index: %d live chunks of %d ids", len(live_ids), docstore.count)
+        return (IndexGeneration(generation.version, segments, docstore),
+                np.concatenate(removed) if removed else np.empty(0, dtype='int64'))
+
+    def _schedule_rebuild(self):
+        """Rebuild the search index once writes have been quiet for policy.rebuild_delay"""
+        if self._rebuild_timer is not None:
+            self._rebuild_timer.cancel()
+        self._rebuild_timer = threading.Timer(self.policy.rebuild_delay, self._rebuild_in_background)
+        self._rebuild_timer.daemon = True
+        self._rebuild_timer.start()
+
+    def _rebuild_in_background(self):
+        try:
+            self._flush_removals()
+            self.rebuild_search_index()
+        except Exception as e:
+            logger.error("Rebuilding search index failed: %s", e)
+
+    def _index_matches(self, generation, search_index, search_ids, compressed, query, k):
+        """Top-k [(L2 distance, chunk id)] from a search index, ranked by exact distance
+
+        A compressed index is asked for rerank_factor times more candidates,
+        so ranking them on the stored vectors recovers what compression lost.
+        """
+        fetch_k = min(k * self.policy.rerank_factor if compressed else k, search_index.ntotal)
+        positions = search_index.search(query, fetch_k)[1][0]
+        ids = np.asarray(search_ids)[positions[positions != -1]]
+        # Exact distances, even when an approximate index picked the candidates
+        distances = ((generation.vectors(ids) - query[0]) ** 2).sum(axis=1) if len(ids) else []
+        return sorted(zip(map(float, distances), map(int, ids)))[:k]
+
+    def _measure(self, generation, search_index=None, search_ids=None, compressed=False):
+        """Compare a search index against exact search, querying with a sample of the stored vectors
+
+        Exact neighbours come from searching the segments themselves, so
+        measuring never copies the vectors; only the sampled ones are read.
+        """
+        live_ids = np.concatenate([segment.live_ids() for segment in generation.segments])
+        k = min(self.policy.eval_k, len(live_ids))
+        sample = sample_ids(live_ids, self.policy.eval_queries)
+        queries = generation.vectors(sample)
+        exact_ids, exact_ms = timed_search(
+            lambda q, k: [chunk_id for _, chunk_id in generation.search(q, k)], queries, k
+        )
+        report = {"k": k, "exact_ms": exact_ms, "exact_bytes_per_vector": queries.shape[1] * 4,
+                  "eval_queries": len(sample)}
+        if search_index is None:
+            return dict(report, recall_at_k=1.0, search_ms=exact_ms)
+
+        found_ids, search_ms = timed_search(
+            lambda q, k: [chunk_id for _, chunk_id in
+                          self._index_matches(generation, search_index, search_ids, compressed, q, k)],
+            queries, k
+        )
+        report.update(recall_at_k=recall_at_k(exact_ids, found_ids), search_ms=search_ms,
+                      bytes_per_vector=bytes_per_vector(search_index))
+        if compressed:
+            def raw_ids(q, k):
+                positions = search_index.search(q, k)[1][0]
+                return np.asarray(search_ids)[positions[positions != -1]]
+
+            found_ids, _ = timed_search(raw_ids, queries, k)
+            report["recall_at_k_without_rerank"] = recall_at_k(exact_ids, found_ids)
+        return report
+
+    def rebuild_search_index(self):
+        """Pick the index type for the current corpus, build it and measure its recall@k
+
+        Returns the new search_info, or None if the index changed meanwhile.
+        Exact search over the segments needs no search index: then the
+        vectors are not read at all.
+        """
+        with self.reading() as generation:
+            version, n_vectors = generation.version, generation.live
+            if not n_vectors:
+                return None
+            search_index = ids = None
+            if self.policy.index_type == "flat" or (
+                    self.policy.index_type == "auto" and n_vectors <= self.policy.flat_max_vectors):
+                index_type = "flat"
+                info = {"type": index_type}
+            else:
+                report = self._measure(generation)
+                index_type = self.policy.choose(n_vectors, report["exact_ms"])
+                info = dict(report, type=index_type)
+
+            # Plain exact search needs no extra index; anything approximate or compressed does
+            if index_type != "flat" or self.policy.compression:
+                start = time.perf_counter()
+                ids, vectors = generation.live_vectors()
+                search_index, factory, compression = build_index(index_type, vectors, self.policy)
+                del vectors
+                info.update(factory=factory, compression=compression, build_s=time.perf_counter() - start)
+                info.update(self._measure(generation, search_index, ids, compressed=bool(compression)))
+        info.update(self.policy.params(index_type), version=version, vectors=n_vectors)
+
+        with self._lock:
+            if self.version != version:
+                return None  # a write landed meanwhile and scheduled another rebuild
+            path = self._path(SEARCH_INDEX_FILE)
+            if search_index is not None:
+                faiss.write_index(search_index, path + ".tmp")
+                os.replace(path + ".tmp", path)
+                with open(self._path(SEARCH_IDS_FILE) + ".tmp", 'wb') as f:
+                    np.save(f, ids)
+                os.replace(self._path(SEARCH_IDS_FILE) + ".tmp", self._path(SEARCH_IDS_FILE))
+                if self.mmap:
+                    search_index = faiss.read_index(path, MMAP_FLAGS)
+                    self.policy.apply(search_index)
+            else:
+                for name in (SEARCH_INDEX_FILE, SEARCH_IDS_FILE):
+                    if os.path.exists(self._path(name)):
+                        os.remove(self._path(name))
+            generation = self.generation.with_search_index(search_index, info, ids)
+            self._write_meta(generation)
+            self._publish(generation)
+        logger.info("Search index for %d vectors: %s", n_vectors, info)
+        return info
+
+    def set_search_params(self, nprobe=None, ef_search=None):
+        """Change IVF nprobe / HNSW efSearch and re-measure recall@k"""
+        with self._lock:
+            if nprobe is not None:
+                self.policy.nprobe = nprobe
+            if ef_search is not None:
+                self.policy.ef_search = ef_search
+            search_index = self.search_index
+            if search_index is None:
+                return self.search_info
+            self.policy.apply(search_index)
+
+        with self.reading() as generation:
+            if generation.search_index is not search_index:
+                return dict(generation.search_info)  # rebuilt meanwhile, with the new params
+            version = generation.version
+            info = dict(generation.search_info)
+            info.update(self._measure(generation, search_index, generation.search_ids,
+                                      compressed=bool(info.get("compression"))))
+        info.update(self.policy.params(info["type"]))
+        with self._lock:
+            if self.version == version and self.search_index is search_index:
+                generation = self.generation
+                generation = generation.with_search_index(search_index, info, generation.search_ids)
+                self._write_meta(generation)
+                self._publish(generation)
+        return info
+
+    def stats(self):
+        """Return index size, segments, search index report, keyword index size and generation counters"""
+        with self.reading() as generation:
+            vectors, version, search_info = generation.live, generation.version, dict(generation.search_info)
+            storage = {
+                "segments": len(generation.segments),
+                "tombstoned": generation.dead,
+                "docstore_lines": generation.docstore.lines,
+                "segments_written": self.segments_written,
+                "vectors_merged": self.vectors_merged,
+                "compactions": self.compactions,
+            }
+        with self._generation_lock:
+            generations = {
+                "published": self.generations_published,
+                "retired": self.generations_retired,
+                "draining": len(self._draining),
+                "readers": self._generation.readers,
+                "age_s": time.time() - self._generation.published_at,
+            }
+        return {"vectors": vectors, "version": version, "storage": storage, "search_index": search_info,
+                "keyword_index": self.keyword_index.stats(), "generations": generations}
+
+    def file_entry(self, rel_path, sha256=None):
+        """Return the manifest entry describing the current state of a file
+
+        The content hash is only computed when mtime or size moved, so an
+        untouched file is never read, and not at all when the caller already
+        hashed the content, as chunked uploads do while receiving it.
+        """
+        path = os.path.join(self.upload_folder, rel_path)
+        stat = os.stat(path)
+        entry = self.manifest.get(rel_path)
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            return entry
+        return {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": sha256 or file_sha256(path)}
+
+    def parse_file(self, rel_path, entry):
+        """Lazily yield the documents of a file, from the parsed-text cache when its content was parsed before
+
+        Documents are parsed (and cached) as they are read, never all held
+        at once; a file that cannot be parsed raises ParseError on reading.
+        """
+        key = f"{entry['sha256']}-{LOADER_VERSION}"
+        documents = None
+        if self.text_cache is not None:
+            documents = self.text_cache.get(key, rel_path, lambda: self._parse(rel_path))
+        if documents is None:
+            documents = self._parse(rel_path)
+            if self.text_cache is not None:
+                documents = self.text_cache.put(key, documents, rel_path)
+        return documents
+
+    def _parse(self, rel_path):
+        try:
+            yield from self.parser(os.path.join(self.upload_folder, rel_path))
+        except ParseError:
+            raise
+        except Exception as e:
+            raise ParseError(f"{type(e).__name__}: {e}") from e
+
+    def needs_indexing(self, rel_path, entry):
+        """Return True when the file content differs from what is indexed"""
+        indexed = self.manifest.get(rel_path)
+        return not indexed or indexed["sha256"] != entry["sha256"]
+
+    def scan(self):
+        """Compare the uploads folder against the manifest
+
+        Returns (changed, removed) lists of relative paths. Files whose content
+        hash is unchanged are not reported even if their mtime moved.
+        """
+        present = list_upload_files(self.upload_folder)
+        changed = []
+        for rel_path in present:
+            entry = self.file_entry(rel_path)
+            if self.needs_indexing(rel_path, entry):
+                changed.append(rel_path)
+            elif entry is not self.manifest.get(rel_path):
+                self.touch_file(rel_path, entry)
+        present = set(present)
+        removed = [rel_path for rel_path in self.manifest if rel_path not in present]
+        return changed, removed
+
+    def chunk_documents(self, rel_path, documents):
+        """Lazily split a file's documents into chunks"""
+        return self.chunker.split_documents(documents, source=rel_path)
+
+    def stage(self, chunks=(), vectors=None):
+        """Return StagedChunks for a write, holding chunks and their vectors if given"""
+        staged = StagedChunks(self._path(STAGING_FOLDER))
+        if vectors is not None:
+            staged.add(list(chunks), vectors)
+        return staged
+
+    def embed_documents(self, chunks, on_batch=None):
+        """Embed chunks batch by batch as they are produced, returning them as StagedChunks
+
+        Each batch is spooled to disk once embedded, so only one batch is in
+        memory however large the file. on_batch, if given, is called with
+        the number of chunks embedded so far.
+        """
+        staged = self.stage()
+        chunks = iter(chunks)
+        try:
+            while True:
+                batch = list(islice(chunks, self.embed_batch_size))
+                if not batch:
+                    return staged
+                staged.add(batch, self.embeddings.embed_documents([c.page_content for c in batch]))
+                if on_batch:
+                    on_batch(staged.count)
+        except BaseException:
+            staged.discard()
+            raise
+
+    def replace_file(self, rel_path, entry, staged=None):
+        """Swap the indexed content of one file for freshly embedded chunks, then discard staged
+
+        Removal of the old vectors and insertion of the new ones land in the
+        same generation, so a concurrent search never sees a half-indexed file.
+        staged None records the file with no chunks, e.g. one that failed to parse.
+        """
+        try:
+            with self._lock:
+                self._write(rel_path, entry, staged)
+        finally:
+            if staged is not None:
+                staged.discard()
+
+    def remove_file(self, rel_path):
+        """Forget a file that was deleted from the uploads folder"""
+        with self._lock:
+            if rel_path in self.manifest:
+                self._write(rel_path, None)
+
+    def touch_file(self, rel_path, entry):
+        """Record a new mtime for a file whose content did not change"""
+        with self._lock:
+            # The chunk ids stay those of the indexed content
+            replaced = self._log_manifest(rel_path, dict(entry, ids=self.manifest.get(rel_path, {}).get("ids", [])))
+            self._write_meta(self.generation)
+            if replaced is not None:
+                os.remove(replaced)
+
+    def index_file(self, rel_path):
+        """Parse, embed and index a single file synchronously"""
+        entry = self.file_entry(rel_path)
+        if not self.needs_indexing(rel_path, entry):
+            self.touch_file(rel_path, entry)
+            return
+        try:
+            staged = self.embed_documents(self.chunk_documents(rel_path, self.parse_file(rel_path, entry)))
+        except ParseError as e:
+            # Keep it in the manifest so it is retried only once the file changes
+            logger.error("Failed to load %s: %s", rel_path, e)
+            self.replace_file(rel_path, dict(entry, error=str(e)))
+            return
+        self.replace_file(rel_path, entry, staged)
+
+    def refresh(self, workers=1):
+        """Update the index for files added, changed or removed since the last refresh
+
+        Up to workers changed files are indexed at once, so a parser pool
+        can parse them in parallel. Returns True when the index contents changed.
+        """
+        changed, removed = self.scan()
+        for rel_path in removed:
+            self.remove_file(rel_path)
+        if workers > 1 and len(changed) > 1:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="refresh") as executor:
+                list(executor.map(self.index_file, changed))
+        else:
+            for rel_path in changed:
+                self.index_file(rel_path)
+        if changed or removed:
+            logger.info("Index updated: %d changed, %d removed, %d vectors",
+                        len(changed), len(removed), len(self))
+        return bool(changed or removed)
+
+    def search(self, query_text, k=4, mode="hybrid", vector=None):
+        """Return the k most relevant chunks
+
+        "vector" ranks by embedding distance, "keyword" by BM25 alone without
+        calling the embedding model, and "hybrid" fuses both rankings with
+        reciprocal-rank fusion so exact identifiers and paraphrases both match.
+        vector is the query embedding, if the caller already has it.
+        """
+        return merge_scored([self.scored_search(query_text, k, mode, vector)], k, mode)
+
+    def scored_search(self, query_text, k=4, mode="hybrid", vector=None):
+        """Return the rankings search() merges, with scores comparable across indexes
+
+        {"vector": [(L2 distance, Document)], "keyword": [(BM25 score, Document)]},
+        each holding only the rankings the mode uses; hybrid fetches more
+        candidates than k for the fusion. Index shards answer with this, so a
+        coordinator can merge them with merge_scored as if they were one index.
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}', expected one of {SEARCH_MODES}")
+        fetch_k = k * self.hybrid_fetch_factor if mode == "hybrid" else k
+        if mode != "keyword" and vector is None and self.generation.live:
+            vector = self.embeddings.embed_query(query_text)
+        results = {}
+        # Both rankings come from the same generation, keyword entries included
+        with self.reading() as generation:
+            if mode != "keyword":
+                results["vector"] = self._vector_matches(generation, fetch_k, vector)
+            if mode != "vector":
+                results["keyword"] = self._keyword_matches(generation, query_text, fetch_k)
+        return results
+
+    def _keyword_matches(self, generation, query_text, k):
+        return [(score, Document(page_content=text, metadata=metadata))
+                for score, text, metadata in self.keyword_index.search(query_text, k, generation.live_mask)]
+
+    def _vector_matches(self, generation, k, vector):
+        if vector is None or not generation.live:
+            return []
+        vector = np.asarray([vector], dtype='float32')
+        if generation.search_index is None:
+            matches = generation.search(vector, k)
+        else:
+            matches = self._index_matches(generation, generation.search_index, generation.search_ids,
+                                          bool(generation.search_info.get("compression")), vector, k)
+        records = [(distance, generation.docstore[chunk_id]) for distance, chunk_id in matches]
+        return [(distance, Document(page_content=record["text"], metadata=record["metadata"]))
+                for distance, record in records]
+
+    def __len__(self):
+        return self.generation.live
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+"""
+Server memory and resumability of chunked uploads against multipart /upload
+
+Starts a stub Ollama server and, for each upload method, a fresh SDRServer
+process. Sends a --mb megabyte file while sampling the server's resident
+memory, and reports the peak above its idle size. The chunked run also
+drops the connection in the middle of one chunk, resumes from the offset
+the server confirmed and checks the server's hash against the file's.
+
+A multipart request must fit MAX_CONTENT_LENGTH, so that run sends
+49 MB of the file. The file is random bytes named .pdf: parsing happens in the parser worker
+processes and fails fast, so the server process measured only handles
+the upload itself.
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_sharding import start_server, wait_until_up
+from tests.stub_ollama import start_stub_server
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class MemorySampler:
+    """Samples a process's resident memory until stopped and keeps the peak"""
+
+    def __init__(self, pid, interval=0.005):
+        self.pid = pid
+        self.interval = interval
+        self.baseline = rss_mb(pid)
+        self.peak = self.baseline
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, rss_mb(self.pid))
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.peak - self.baseline
+
+
+def multipart_upload(url, path):
+    # The whole request must fit MAX_CONTENT_LENGTH (50 MB), multipart framing included
+    size = min(os.path.getsize(path), 49 * 1024 * 1024)
+    with open(path, "rb") as f:
+        response = httpx.post(url + "/upload", files={"file": (os.path.basename(path), f.read(size))},
+                              timeout=120)
+    response.raise_for_status()
+    print(f"  sent {size / (1024 * 1024):.0f} MB, the most one request may carry")
+    return None
+
+
+def interrupted_chunk(url, upload_id, offset, data, sent):
+    """Send a PATCH announcing all of data but only sent bytes of it, then drop the connection"""
+    address = urlparse(url)
+    with socket.create_connection((address.hostname, address.port)) as sock:
+        sock.sendall((f"PATCH /uploads/{upload_id} HTTP/1.1\r\nHost: {address.netloc}\r\n"
+                      f"Upload-Offset: {offset}\r\nContent-Type: application/octet-stream\r\n"
+                      f"Content-Length: {len(data)}\r\n\r\n").encode() + data[:sent])
+        time.sleep(0.5)
+
+
+def chunked_upload(url, path, interrupt=True):
+    """Upload path in chunks, dropping one chunk halfway when interrupt is set; return the server's report"""
+    size = os.path.getsize(path)
+    status = httpx.post(url + "/uploads", json={"filename": os.path.basename(path), "size": size}).json()
+    upload_id, chunk_size = status["upload_id"], status["chunk_size"]
+    offset = 0
+    with open(path, "rb") as f:
+        while offset < size:
+            f.seek(offset)
+            data = f.read(chunk_size)
+            if interrupt and offset >= size // 2:
+                interrupt = False
+                interrupted_chunk(url, upload_id, offset, data, len(data) // 3)
+                # Resume from whatever the server kept of that chunk
+                resumed = int(httpx.head(f"{url}/uploads/{upload_id}").headers["Upload-Offset"])
+                print(f"  connection dropped at offset {offset + len(data) // 3}, server confirmed {resumed}")
+                offset = resumed
+                continue
+            response = httpx.patch(f"{url}/uploads/{upload_id}", content=data, timeout=120,
+                                   headers={"Upload-Offset": str(offset),
+                                            "Content-Type": "application/octet-stream"})
+            if response.status_code == 409:
+                offset = int(response.headers["Upload-Offset"])
+                continue
+            response.raise_for_status()
+            status = response.json()
+            offset = status["offset"]
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chunked uploads against multipart /upload")
+    parser.add_argument("--mb", type=int, default=50)
+    parser.add_argument("--port", type=int, default=18200)
+    args = parser.parse_args()
+
+    stub = start_stub_server(load_latency=0, dim=64)
+    workdir = tempfile.mkdtemp(prefix="sdr-upload-")
+    path = os.path.join(workdir, "large.pdf")
+    with open(path, "wb") as f:
+        for _ in range(args.mb):
+            f.write(os.urandom(1024 * 1024))
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    expected = digest.hexdigest()
+
+    try:
+        for label, upload in (("multipart /upload", multipart_upload), ("chunked /uploads", chunked_upload)):
+            port = args.port + (label.startswith("chunked"))
+            process = start_server(port, os.path.join(workdir, label.split()[0]),
+                                   {"OLLAMA_HOST": stub.url})
+            url = f"http://127.0.0.1:{port}"
+            try:
+                wait_until_up(url)
+                time.sleep(1)
+                print(f"{label}:")
+                sampler = MemorySampler(process.pid)
+                start = time.perf_counter()
+                report = upload(url, path)
+                elapsed = time.perf_counter() - start
+                growth = sampler.stop()
+                print(f"  took {elapsed:.2f}s, server idle {sampler.baseline:.0f} MB, "
+                      f"peak +{growth:.1f} MB")
+                if report is not None:
+                    match = "matches" if report["sha256"] == expected else "DOES NOT match"
+                    print(f"  server sha256 {report['sha256'][:16]}... {match} the file")
+                    # The same bytes under the same name leave the stored file and its index alone
+                    again = chunked_upload(url, path, interrupt=False)
+                    print(f"  same file again: unchanged={again['unchanged']}")
+                    print(f"  upload stats: {httpx.get(url + '/stats').json()['uploads']}")
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        stub.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+"""
+Search latency while a bulk ingest writes to the same index
+
+Builds a synthetic index, then runs searcher threads twice: once on an idle
+index and once while a writer thread replaces files one after another, the
+way the ingestion queue does. Searches read published index generations
+and never wait for a write, so p99 should stay close to the idle run.
+A third run makes every search take the writer lock, as searches did
+before index generations, for comparison.
+
+"write ms" is the writer's CPU time per file. A write appends a segment
+instead of rewriting the index, so it stays the same as --files grows.
+With no --embed-ms the writer runs flat out, which on a machine with few
+cores takes CPU time from the searchers; --embed-ms pauses before each
+file the way waiting for the embedding model paces real ingestion.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from RAG.vector_index import VectorIndex
+
+MODEL = "bench"
+# Enough distinct terms that, as in real text, each one occurs in a small share of the chunks
+WORDS = np.array([f"term{i}" for i in range(2000)])
+
+
+def synthetic_file(rng, number, chunks, dim):
+    documents = [
+        Document(page_content=" ".join(rng.choice(WORDS, 40)) + f" ERR_{number}_{i}",
+                 metadata={"source": f"file{number}.txt", "chunk_index": i})
+        for i in range(chunks)
+    ]
+    entry = {"mtime": time.time(), "size": 0, "sha256": f"{number}-{time.time()}"}
+    return documents, entry, rng.random((chunks, dim), dtype='float32')
+
+
+def percentile(values, p):
+    return sorted(values)[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+def search_load(index, queries, mode, threads, stop, locked=False):
+    """Run searcher threads until stop is set; return all latencies"""
+    latencies = []
+    lock = threading.Lock()
+
+    def searcher(seed):
+        rng = np.random.default_rng(seed)
+        local = []
+        while not stop.is_set():
+            text, vector = queries[rng.integers(len(queries))]
+            start = time.perf_counter()
+            if locked:
+                with index._lock:
+                    index.search(text, 4, mode, vector=vector)
+            else:
+                index.search(text, 4, mode, vector=vector)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=searcher, args=(seed,)) for seed in range(threads)]
+    for worker in workers:
+        worker.start()
+    return workers, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark search latency during ingestion")
+    parser.add_argument("--files", type=int, default=200, help="Files indexed before the measurement")
+    parser.add_argument("--ingest-files", type=int, default=40, help="Files written during each ingest run")
+    parser.add_argument("--chunks", type=int, default=50, help="Chunks per file")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--threads", type=int, default=4, help="Concurrent searcher threads")
+    parser.add_argument("--seconds", type=float, default=3.0, help="Length of the idle run")
+    parser.add_argument("--mode", default="hybrid", choices=["hybrid", "vector", "keyword"])
+    parser.add_argument("--embed-ms", type=float, default=0, help="Pause before each file written, as embedding does")
+    parser.add_argument("--no-mmap", action="store_true", help="Keep the index in RAM instead of mapping it")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="sdr_bench_")
+    index = VectorIndex(folder, folder, None, MODEL, mmap=not args.no_mmap)
+    # No approximate index rebuilds in the middle of the measurement
+    index.policy.rebuild_delay = 3600
+    rng = np.random.default_rng(0)
+    print(f"Indexing {args.files} files x {args.chunks} chunks...")
+    for number in range(args.files):
+        documents, entry, vectors = synthetic_file(rng, number, args.chunks, args.dim)
+        index.replace_file(f"file{number}.txt", entry, index.stage(documents, vectors))
+    queries = [(" ".join(rng.choice(WORDS, 3)), rng.random(args.dim, dtype='float32')) for _ in range(256)]
+
+    stop = threading.Event()
+    workers, idle = search_load(index, queries, args.mode, args.threads, stop)
+    time.sleep(args.seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+
+    def ingest_run(first, locked):
+        # Staged up front, as embedding does before the write being timed
+        files = [(entry, index.stage(documents, vectors)) for documents, entry, vectors in
+                 (synthetic_file(rng, number, args.chunks, args.dim)
+                  for number in range(first, first + args.ingest_files))]
+        stop = threading.Event()
+        workers, latencies = search_load(index, queries, args.mode, args.threads, stop, locked)
+        start = time.perf_counter()
+        cpu = 0.0
+        for number, (entry, staged) in enumerate(files, first):
+            time.sleep(args.embed_ms / 1000)
+            cpu_start = time.thread_time()
+            index.replace_file(f"file{number}.txt", entry, staged)
+            cpu += time.thread_time() - cpu_start
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for worker in workers:
+            worker.join()
+        return latencies, elapsed, cpu * 1000 / args.ingest_files
+
+    busy, ingest_seconds, write_ms = ingest_run(args.files, locked=False)
+    locked, locked_seconds, locked_write_ms = ingest_run(args.files + args.ingest_files, locked=True)
+
+    print(f"{'run':>22} {'searches':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'files/s':>8} {'write ms':>9}")
+    for label, latencies, seconds, cpu_ms in (("idle", idle, None, None),
+                                              ("during ingest", busy, ingest_seconds, write_ms),
+                                              ("during ingest, locked", locked, locked_seconds, locked_write_ms)):
+        files_per_sec = f"{args.ingest_files / seconds:.2f}" if seconds else "-"
+        cpu_ms = f"{cpu_ms:.1f}" if cpu_ms else "-"
+        print(f"{label:>22} {len(latencies):>9} {percentile(latencies, 0.5):>8.2f} "
+              f"{percentile(latencies, 0.99):>8.2f} {max(latencies) * 1000:>8.2f} {files_per_sec:>8} {cpu_ms:>9}")
+    print(f"Storage: {index.stats()['storage']}")
+    print(f"Generations: {index.stats()['generations']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+"""
+Cold-start time and memory of a memory-mapped vs fully loaded vector index
+
+Builds a synthetic index once, then opens it in fresh child processes in
+both modes and reports open time, first-search latency, RSS and anonymous
+(non file-backed, hence unshareable) memory. Linux only, as it reads /proc.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from RAG.vector_index import IndexGeneration, VectorIndex
+
+MODEL = "bench"
+
+
+def memory_mb():
+    """Return (RSS, anonymous) memory of this process in MB"""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":"):
+                fields[parts[0][:-1]] = int(parts[1])
+    return fields.get("Rss", 0) / 1024, fields.get("Anonymous", 0) / 1024
+
+
+def build(folder, vectors, dim):
+    index = VectorIndex(folder, folder, None, MODEL, mmap=False)
+    data = np.random.default_rng(0).random((vectors, dim), dtype='float32')
+    records = ({"source": f"doc{i // 50}.txt", "text": f"chunk {i}", "metadata": {}} for i in range(vectors))
+    # One segment written directly; keyword search is not measured, so its index stays empty
+    generation = IndexGeneration(1, [index._write_segment(np.arange(vectors), data)], index.docstore.append(records))
+    index._write_meta(generation)
+    index.keyword_index.rebuild([], 1)
+
+
+def child(folder, mode, dim, queries):
+    rss_before, anon_before = memory_mb()
+    start = time.perf_counter()
+    index = VectorIndex(folder, folder, None, MODEL, mmap=(mode == "mmap"))
+    open_seconds = time.perf_counter() - start
+    rss_open, anon_open = memory_mb()
+
+    rng = np.random.default_rng(1)
+    start = time.perf_counter()
+    generation = index.generation
+    [generation.docstore[chunk_id] for _, chunk_id in generation.search(rng.random((1, dim), dtype='float32'), 4)]
+    first_search = time.perf_counter() - start
+    for query in rng.random((queries, 1, dim), dtype='float32'):
+        generation.search(query, 4)
+    rss_search, anon_search = memory_mb()
+
+    print(json.dumps({
+        "mode": mode,
+        "open_s": open_seconds,
+        "first_search_s": first_search,
+        "rss_open_mb": rss_open - rss_before,
+        "anon_open_mb": anon_open - anon_before,
+        "rss_after_search_mb": rss_search - rss_before,
+        "anon_after_search_mb": anon_search - anon_before,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark memory-mapped index loading")
+    parser.add_argument("--vectors", type=int, default=500000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=32)
+    parser.add_argument("--folder", help="Reuse an index folder built by a previous run")
+    parser.add_argument("--child", choices=["mmap", "full"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.folder, args.child, args.dim, args.queries)
+        return
+
+    folder = args.folder or tempfile.mkdtemp(prefix="sdr_bench_")
+    if not os.path.exists(os.path.join(folder, MODEL, "meta.json")):
+        print(f"Building {args.vectors} x {args.dim} index in {folder}...")
+        build(folder, args.vectors, args.dim)
+
+    print(f"{'mode':>5} {'open s':>8} {'1st search s':>13} {'RSS MB':>8} {'anon MB':>8} "
+          f"{'RSS MB*':>8} {'anon MB*':>9}")
+    for mode in ("full", "mmap"):
+        output = subprocess.run(
+            [sys.executable, __file__, "--child", mode, "--folder", folder,
+             "--dim", str(args.dim), "--queries", str(args.queries)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        r = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:>5} {r['open_s']:>8.3f} {r['first_search_s']:>13.4f} {r['rss_open_mb']:>8.0f} "
+              f"{r['anon_open_mb']:>8.0f} {r['rss_after_search_mb']:>8.0f} {r['anon_after_search_mb']:>9.0f}")
+    print("* after a batch of searches; file-backed pages are shared between processes via the page cache")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+"""
+Latency of sparse generate requests: a fresh client per request versus the
+shared OllamaService with keep_alive and warm-up
+
+Runs against a local stub Ollama server by default, which unloads a model
+once its keep_alive runs out and charges --load-latency to load it again.
+The stub's keep_alive is scaled down so the gaps between requests outlast
+Ollama's default in seconds rather than minutes.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ollama
+
+from RAG.ollama_client import OllamaService
+from tests.stub_ollama import start_stub_server
+
+
+def run(label, generate, requests, gap):
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        generate()
+        latencies.append(time.perf_counter() - start)
+        time.sleep(gap)
+    print(f"{label:>22} {statistics.mean(latencies) * 1000:>9.1f} {max(latencies) * 1000:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a pooled, keep-alive Ollama client")
+    parser.add_argument("--host", help="Ollama URL (default: start a local stub server)")
+    parser.add_argument("--model", default="llama2")
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--gap", type=float, default=0.5, help="Seconds between requests")
+    parser.add_argument("--default-keep-alive", default="0.2s",
+                        help="Keep-alive of the per-request client, standing in for Ollama's 5m default")
+    parser.add_argument("--keep-alive", default="30m", help="Keep-alive of the shared client")
+    parser.add_argument("--load-latency", type=float, default=0.5, help="Stub model load time in seconds")
+    args = parser.parse_args()
+
+    server = None
+    host = args.host
+    if host is None:
+        server = start_stub_server(load_latency=args.load_latency)
+        host = server.url
+        print(f"Using stub Ollama server at {host}")
+
+    print(f"{'client':>22} {'mean ms':>9} {'max ms':>9}")
+    run("fresh per request",
+        lambda: ollama.Client(host=host).generate(model=args.model, prompt="hello",
+                                                  keep_alive=args.default_keep_alive),
+        args.requests, args.gap)
+    if server is not None:
+        fresh_connections, fresh_loads = server.connections, server.loads
+        # Let the model unload so the shared client starts from a cold server too
+        time.sleep(1.0)
+
+    service = OllamaService(host, keep_alive=args.keep_alive)
+    service.warm_up([args.model], background=False)
+    run("shared + keep_alive", lambda: service.generate(args.model, "hello"), args.requests, args.gap)
+
+    stats = service.stats()
+    print(f"warm-up: {stats['warmup'][args.model]}")
+    if server is not None:
+        print(f"fresh per request: {fresh_connections} connections, {fresh_loads} model loads")
+        print(f"shared client: {server.connections - fresh_connections} connections, "
+              f"{server.loads - fresh_loads} model loads (warm-up included)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+"""
+Embedding throughput for different batch sizes and concurrency levels
+
+Runs against a local stub Ollama server by default; pass --host to measure
+a real Ollama box on the LAN instead.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from RAG.ollama_client import OllamaBatchEmbeddings
+from tests.stub_ollama import start_stub_server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched Ollama embedding calls")
+    parser.add_argument("--host", help="Ollama URL (default: start a local stub server)")
+    parser.add_argument("--model", default="llama2")
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--batch-sizes", default="1,8,32,64")
+    parser.add_argument("--concurrency", default="1,2,4,8")
+    args = parser.parse_args()
+
+    host = args.host
+    if host is None:
+        host = start_stub_server(load_latency=0).url
+        print(f"Using stub Ollama server at {host}")
+
+    texts = [f"chunk number {i} of the benchmark corpus" for i in range(args.texts)]
+    print(f"{'batch':>6} {'conc':>5} {'requests':>9} {'texts/s':>10}")
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            embeddings = OllamaBatchEmbeddings(args.model, host=host, batch_size=batch_size,
+                                               max_concurrency=concurrency)
+            embeddings.embed_documents(texts)
+            stats = embeddings.stats()
+            print(f"{batch_size:>6} {concurrency:>5} {stats['requests']:>9} {stats['texts_per_sec']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+"""
+Request spread, failover and latency of OllamaRouter across several hosts
+
+Starts local stub Ollama servers, sends concurrent generate requests
+through the router and takes one host down halfway; prints how requests
+were spread, how many failed over and the per-host latency. Pass --host
+several times to use real Ollama hosts instead (nothing is taken down).
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from RAG.ollama_client import OllamaService
+from RAG.ollama_router import OllamaRouter
+from tests.stub_ollama import start_stub_server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark routing across several Ollama hosts")
+    parser.add_argument("--host", action="append", help="Ollama URL (default: start local stub servers)")
+    parser.add_argument("--stubs", type=int, default=3)
+    parser.add_argument("--model", default="llama2")
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=6)
+    args = parser.parse_args()
+
+    stubs = []
+    hosts = args.host
+    if not hosts:
+        stubs = [start_stub_server(latency=0.02 * (i + 1), load_latency=0.2) for i in range(args.stubs)]
+        hosts = [stub.url for stub in stubs]
+        print(f"Using {len(stubs)} stub Ollama servers, the first one fastest")
+
+    router = OllamaRouter([OllamaService(host) for host in hosts], health_interval=0.5)
+    router.warm_up([args.model], background=False)
+
+    def query(i):
+        if stubs and i == args.requests // 2:
+            stubs[0].fail = True
+            print(f"Taking {stubs[0].url} down")
+        start = time.perf_counter()
+        try:
+            router.generate(args.model, f"question {i}")
+            return time.perf_counter() - start, None
+        except Exception as e:
+            return time.perf_counter() - start, e
+
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        results = list(executor.map(query, range(args.requests)))
+
+    failed = [error for _, error in results if error is not None]
+    latencies = sorted(elapsed for elapsed, _ in results)
+    print(f"{len(results) - len(failed)}/{len(results)} answered, "
+          f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    print(f"{'host':>28} {'healthy':>8} {'requests':>9} {'errors':>7} {'failovers':>10} {'latency ms':>11}")
+    for host, stats in router.stats()["hosts"].items():
+        latency = f"{stats['latency_ms']:.1f}" if stats["latency_ms"] is not None else "-"
+        print(f"{host:>28} {str(stats['healthy']):>8} {stats['requests']:>9} {stats['errors']:>7} "
+              f"{stats['failovers']:>10} {latency:>11}")
+
+
+if __name__ == "__main__":
+    main()
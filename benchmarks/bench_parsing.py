@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+"""
+Parsing throughput of the ParserPool for growing numbers of worker processes
+
+Writes --files synthetic text files and parses all of them with 1, 2, 4 ...
+up to --max-workers processes, reporting files/sec and MB/sec. With
+--synthetic, parsing is a CPU-bound stand-in for PDF extraction, so the
+benchmark runs without the document parsing libraries installed. With
+--hang, one extra file never finishes parsing, to show it failing on its
+own after --timeout while the others keep going.
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document
+
+from RAG.loaders import load_file
+from RAG.parsing import ParserPool
+
+HANG_FILE = "hang.txt"
+
+
+def synthetic_loader(path, rounds=200):
+    """Read a file and burn CPU on it in proportion to its size, like text extraction does"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if os.path.basename(path) == HANG_FILE:
+        while True:
+            time.sleep(1)
+    digest = b""
+    for _ in range(rounds):
+        digest = hashlib.sha256(digest + data).digest()
+    return [Document(page_content=data.decode("utf-8"), metadata={"source": path})]
+
+
+def write_files(folder, count, size_kb):
+    paths = []
+    line = "The router raised error ERR_042 while the backup link was down.\n"
+    for i in range(count):
+        path = os.path.join(folder, f"doc{i}.txt")
+        with open(path, "w") as f:
+            f.write(line * (size_kb * 1024 // len(line)))
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel parsing of uploaded files")
+    parser.add_argument("--files", type=int, default=64)
+    parser.add_argument("--size-kb", type=int, default=256, help="Size of each file")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--timeout", type=float, default=5.0, help="Per-file parse timeout in seconds")
+    parser.add_argument("--synthetic", action="store_true", help="CPU-bound stand-in instead of the real loaders")
+    parser.add_argument("--hang", action="store_true", help="Add a file whose parsing never finishes")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="sdr_parse_")
+    try:
+        paths = write_files(folder, args.files, args.size_kb)
+        if args.hang:
+            with open(os.path.join(folder, HANG_FILE), "w") as f:
+                f.write("never parsed\n")
+            paths.insert(0, os.path.join(folder, HANG_FILE))
+        loader = synthetic_loader if args.synthetic else load_file
+
+        counts = []
+        workers = 1
+        while workers < args.max_workers:
+            counts.append(workers)
+            workers *= 2
+        counts.append(args.max_workers)
+
+        print(f"{len(paths)} files, {args.size_kb} KB each, {'synthetic' if args.synthetic else 'real'} parser")
+        print(f"{'workers':>8} {'seconds':>8} {'files/s':>8} {'MB/s':>8} {'failed':>7} {'timeouts':>9} {'speedup':>8}")
+        baseline = None
+        for workers in counts:
+            pool = ParserPool(workers, args.timeout, loader=loader)
+            start = time.perf_counter()
+            errors = [error for _, _, error in pool.parse_many(paths) if error is not None]
+            elapsed = time.perf_counter() - start
+            stats = pool.stats()
+            pool.close()
+            baseline = baseline or elapsed
+            print(f"{workers:>8} {elapsed:>8.2f} {stats['files_per_sec']:>8.1f} {stats['mb_per_sec']:>8.1f} "
+                  f"{stats['failures']:>7} {stats['timeouts']:>9} {baseline / elapsed:>7.2f}x")
+            for error in errors[:1]:
+                print(f"{'':>8} first error: {error}")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
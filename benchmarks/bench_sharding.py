@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+"""
+Scatter-gather retrieval over index shards running as separate local processes
+
+Starts a stub Ollama server, --shards SDRServer processes that each own a
+shard of the uploads and a coordinator in front of them. Uploads synthetic
+documents through the coordinator, reports where they landed and the
+per-shard search latency, then stops one shard to show answers coming from
+the remaining ones.
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tests.stub_ollama import start_stub_server
+
+SERVER = "import sys; from server import create_app; create_app().run(port=int(sys.argv[1]), threaded=True)"
+
+
+def start_server(port, folder, env):
+    env = dict(os.environ, SDR_UPLOAD_FOLDER=os.path.join(folder, "uploads"),
+               SDR_INDEX_FOLDER=os.path.join(folder, "index"), **env)
+    log = open(os.path.join(folder + ".log"), "w")
+    return subprocess.Popen([sys.executable, "-c", SERVER, str(port)], cwd=ROOT, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_until_up(url, timeout=60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url + "/models")
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start, see its log")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sharded retrieval across local SDRServer processes")
+    parser.add_argument("--shards", type=int, default=3)
+    parser.add_argument("--documents", type=int, default=30)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--base-port", type=int, default=18100)
+    parser.add_argument("--model", default="llama2")
+    args = parser.parse_args()
+
+    stub = start_stub_server(load_latency=0, dim=64)
+    env = {"OLLAMA_HOST": stub.url}
+    workdir = tempfile.mkdtemp(prefix="sdr-shards-")
+    processes = []
+    try:
+        shards = []
+        for i in range(args.shards):
+            port = args.base_port + 1 + i
+            processes.append(start_server(port, os.path.join(workdir, f"shard{i}"), env))
+            shards.append(f"http://127.0.0.1:{port}")
+        coordinator = f"http://127.0.0.1:{args.base_port}"
+        processes.append(start_server(args.base_port, os.path.join(workdir, "coordinator"),
+                                      dict(env, SDR_SHARDS=",".join(shards))))
+        for url in shards + [coordinator]:
+            wait_until_up(url)
+
+        placed = {shard: 0 for shard in shards}
+        for i in range(args.documents):
+            text = f"Report {i}: router r{i % 7} raised error ERR_{i:03d} during outage {i}.\n"
+            reply = httpx.post(coordinator + "/upload", files={"file": (f"report{i}.txt", text.encode())}).json()
+            placed[reply["shard"]] += 1
+        while any(httpx.get(shard + "/ingest/status").json()["pending"] for shard in shards):
+            time.sleep(0.2)
+        print("Documents per shard:", ", ".join(f"{shard} {count}" for shard, count in placed.items()))
+
+        def run_queries(label):
+            latencies = []
+            for i in range(args.queries):
+                start = time.perf_counter()
+                response = httpx.post(coordinator + "/query", timeout=60,
+                                      json={"query": f"which router raised ERR_{i:03d}?", "model": args.model})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+            stats = httpx.get(coordinator + "/stats").json()["shards"]
+            print(f"{label}: {args.queries} queries, median {statistics.median(latencies) * 1000:.1f} ms, "
+                  f"{stats['partial_searches']} partial")
+            for shard, shard_stats in stats["shards"].items():
+                mean = f"{shard_stats['mean_ms']:.1f}" if shard_stats["mean_ms"] is not None else "-"
+                print(f"  {shard}: {shard_stats['requests']} requests, {shard_stats['errors']} errors, mean {mean} ms")
+            print(f"  last search missing: {list(stats['last_search']['missing']) or 'none'}")
+
+        run_queries("All shards up")
+        processes[0].terminate()
+        processes[0].wait()
+        print(f"Stopped {shards[0]}")
+        run_queries("One shard down")
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+"""
+Memory and throughput of the streaming CSV, JSON, XML and XLSX loaders
+
+Writes a synthetic file of --mb megabytes in each format, streams it
+through its loader and the chunker, and reports rows, chunks, MB/s and
+the peak Python memory allocated while doing so. Peak memory should stay
+flat as --mb grows, since no file is ever held in memory whole.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from RAG.chunker import Chunker
+from RAG.structured_loaders import STREAMING_LOADERS
+
+COLUMNS = ["id", "host", "error", "status", "note"]
+
+
+def record(i):
+    return {"id": i, "host": f"router{i % 97}", "error": f"ERR_{i:07d}", "status": "down" if i % 5 else "up",
+            "note": f"link flapped {i % 13} times during the maintenance window"}
+
+
+def rows_until(size):
+    """Yield records until their rough text size reaches size bytes"""
+    written, i = 0, 0
+    while written < size:
+        row = record(i)
+        written += sum(len(str(value)) for value in row.values()) + 40
+        i += 1
+        yield row
+
+
+def write_csv(path, size):
+    with open(path, "w") as f:
+        f.write(",".join(COLUMNS) + "\n")
+        for row in rows_until(size):
+            f.write(",".join(str(row[column]) for column in COLUMNS) + "\n")
+
+
+def write_json(path, size):
+    with open(path, "w") as f:
+        f.write('{"generated": "bench", "records": [\n')
+        for i, row in enumerate(rows_until(size)):
+            f.write(("," if i else "") + json.dumps(row) + "\n")
+        f.write("]}\n")
+
+
+def write_xml(path, size):
+    with open(path, "w") as f:
+        f.write("<log><records>\n")
+        for row in rows_until(size):
+            f.write(f'<record id="{row["id"]}">' + "".join(
+                f"<{column}>{escape(str(row[column]))}</{column}>" for column in COLUMNS[1:]) + "</record>\n")
+        f.write("</records></log>\n")
+
+
+def write_xlsx(path, size):
+    """A minimal workbook with inline strings, as spreadsheet tools accept"""
+    def cells(values, number):
+        return "".join(f'<c r="{chr(65 + i)}{number}" t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+                       for i, value in enumerate(values))
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("xl/workbook.xml",
+                         '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                         'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                         '<sheets><sheet name="Incidents" sheetId="1" r:id="rId1"/></sheets></workbook>')
+        archive.writestr("xl/_rels/workbook.xml.rels",
+                         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                         '<Relationship Id="rId1" Target="worksheets/sheet1.xml"/></Relationships>')
+        with archive.open("xl/worksheets/sheet1.xml", "w") as f:
+            f.write(b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            f.write(f'<row r="1">{cells(COLUMNS, 1)}</row>'.encode())
+            for number, row in enumerate(rows_until(size), 2):
+                f.write(f'<row r="{number}">{cells([row[c] for c in COLUMNS], number)}</row>'.encode())
+            f.write(b"</sheetData></worksheet>")
+
+
+WRITERS = {"csv": write_csv, "json": write_json, "xml": write_xml, "xlsx": write_xlsx}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the streaming structured-data loaders")
+    parser.add_argument("--mb", type=float, default=50, help="Size of each generated file's data")
+    parser.add_argument("--formats", default="csv,json,xml,xlsx")
+    parser.add_argument("--chunk-size", type=int, default=256)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="sdr_structured_")
+    chunker = Chunker(args.chunk_size, 32)
+    print(f"{'format':>7} {'file MB':>8} {'rows':>9} {'chunks':>8} {'seconds':>8} {'MB/s':>7} {'peak MB':>8}")
+    try:
+        for ext in args.formats.split(","):
+            path = os.path.join(folder, f"data.{ext}")
+            WRITERS[ext](path, int(args.mb * 1024 * 1024))
+            file_mb = os.path.getsize(path) / (1024 * 1024)
+
+            def run():
+                rows = chunks = 0
+                sample = None
+                for chunk in chunker.split_documents(STREAMING_LOADERS[ext](path)):
+                    chunks += 1
+                    rows = max(rows, chunk.metadata.get("row_end", 0))
+                    sample = sample or chunk
+                return rows, chunks, sample
+
+            start = time.perf_counter()
+            rows, chunks, sample = run()
+            elapsed = time.perf_counter() - start
+            # A second pass under tracemalloc, which slows everything down, for the peak
+            tracemalloc.start()
+            run()
+            peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+            print(f"{ext:>7} {file_mb:>8.1f} {rows:>9} {chunks:>8} {elapsed:>8.2f} {file_mb / elapsed:>7.1f} "
+                  f"{peak:>8.1f}")
+            print(f"{'':>7} first chunk rows {sample.metadata['row_start']}-{sample.metadata['row_end']}: "
+                  f"{sample.page_content[:100]!r}")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,14 @@ Configuration settings for System Discovery and Researching
 
 import os
 
+# Folders can be moved per process, e.g. to run several index shards on one machine
+UPLOAD_FOLDER = os.environ.get('SDR_UPLOAD_FOLDER', './uploads')
+INDEX_FOLDER = os.environ.get('SDR_INDEX_FOLDER', './uploads_index')
+
 # Flask configuration
 FLASK_CONFIG = {
     'MAX_CONTENT_LENGTH': 50 * 1024 * 1024,  # 50MB max file size
-    'UPLOAD_FOLDER': './uploads',
+    'UPLOAD_FOLDER': UPLOAD_FOLDER,
     'SECRET_KEY': os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 }
 
@@ -17,6 +21,56 @@ ALLOWED_EXTENSIONS = {
     'csv', 'xlsx', 'xls', 'json', 'xml', 'html', 'htm'
 }
 
+# Retrieval configuration
+RAG_CONFIG = {
+    'INDEX_FOLDER': INDEX_FOLDER,  # persistent vector index, next to the uploads
+    'EMBEDDING_MODEL': 'llama2',
+    'TOP_K': 4,
+    'SEARCH_MODE': 'hybrid',  # hybrid, vector or keyword (BM25 only, no embedding call)
+    'CHUNK_SIZE': 256,  # tokens per chunk, so TOP_K chunks fit a 2048-token context
+    'CHUNK_OVERLAP': 32,
+    'INGEST_WORKERS': os.cpu_count() or 2,  # files ingested at once; at least PARSE_WORKERS keeps every core parsing
+    'PARSE_WORKERS': None,  # parser processes, None for one per CPU core
+    'PARSE_TIMEOUT': 120,  # seconds before a file's parser is killed and the file marked failed
+    'UPLOAD_CHUNK_MB': 8,  # chunk size suggested to chunked-upload clients, below MAX_CONTENT_LENGTH
+    'UPLOAD_MAX_MB': 50,  # largest file a chunked upload may declare
+    'UPLOAD_MAX_SESSIONS': 16,  # chunked uploads in progress at once
+    'UPLOAD_EXPIRY_HOURS': 24,  # unfinished chunked uploads idle this long are deleted
+    'INDEX_MMAP': True,  # map the saved index instead of copying it into every process
+    'INDEX_TYPE': 'auto',  # auto, flat, ivf or hnsw
+    'INDEX_LATENCY_TARGET_MS': 10,  # auto keeps exact search while it is this fast
+    'INDEX_FLAT_MAX_VECTORS': 50000,  # auto always keeps exact search up to this size
+    'INDEX_NPROBE': 16,  # IVF lists scanned per query
+    'INDEX_EF_SEARCH': 64,  # HNSW candidate list size per query
+    'INDEX_COMPRESSION': None,  # None, 'sq8', 'pq' or 'opq' to shrink the search index in RAM
+    'INDEX_RERANK_FACTOR': 4,  # compressed search fetches this many times top-k for exact re-ranking
+    'EMBEDDING_CACHE_FOLDER': os.path.join(INDEX_FOLDER, 'embedding_cache'),  # shared by both engines
+    'EMBEDDING_CACHE_MB': 512,
+    'TEXT_CACHE_FOLDER': os.path.join(INDEX_FOLDER, 'text_cache'),  # parsed documents by content hash, shared too
+    'OLLAMA_HOST': os.environ.get('OLLAMA_HOST'),  # None means the ollama library default
+    # Several Ollama hosts on the LAN to spread requests over, e.g. OLLAMA_HOSTS=http://a:11434,http://b:11434
+    'OLLAMA_HOSTS': [host for host in os.environ.get('OLLAMA_HOSTS', '').split(',') if host],
+    'OLLAMA_HEALTH_INTERVAL': 10,  # seconds between health checks of each host
+    'EMBED_BATCH_SIZE': 32,  # texts per /api/embed request
+    'EMBED_CONCURRENCY': 4,  # max in-flight embedding requests
+    'OLLAMA_KEEP_ALIVE': '30m',  # how long Ollama keeps a model loaded after a request (-1: forever)
+    'OLLAMA_KEEP_ALIVE_MODELS': {},  # per-model overrides, e.g. {'rag-gemma3': -1}
+    'OLLAMA_TIMEOUT': 300,  # seconds per request, model loading included
+    'OLLAMA_MAX_CONNECTIONS': 16,  # pooled HTTP connections to Ollama
+    'OLLAMA_WARMUP': True,  # load AVAILABLE_MODELS into Ollama when the server starts
+    'RESPONSE_CACHE_SIZE': 1000,  # answers kept for repeated questions
+    'RESPONSE_CACHE_TTL': 3600,  # seconds
+    'RESPONSE_CACHE_THRESHOLD': 0.95,  # cosine similarity for a question to count as repeated
+    # SDRServer URLs that each own a shard of the uploads, e.g. SDR_SHARDS=http://a:8080,http://b:8080;
+    # when set, this server stores uploads on them and answers queries from all of them
+    'SHARDS': [shard for shard in os.environ.get('SDR_SHARDS', '').split(',') if shard],
+    'SHARD_TIMEOUT': 10,  # seconds to wait for a shard before answering without it
+    'SHARD_VERSION_TTL': 2,  # seconds shard index versions seen in replies are trusted for the answer cache
+    'SELF_URL': os.environ.get('SDR_SELF_URL'),  # this server's URL as other nodes see it, never used as its own shard
+    # Client addresses allowed to read /stats and retune the index, e.g. SDR_ADMIN_ADDRESSES=127.0.0.1,10.0.0.5
+    'ADMIN_ADDRESSES': os.environ.get('SDR_ADMIN_ADDRESSES', '127.0.0.1,::1').split(',')
+}
+
 # Available models
 AVAILABLE_MODELS = ["rag-gemma3", "gemma3", "llama2", "qwen2.5-coder", "Esperto_Python"]
 
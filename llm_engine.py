@@ -2,22 +2,91 @@
 Local LLM Engine using llama-cpp-python for GGUF models
 """
 
-from llama_cpp import Llama
-from sentence_transformers import SentenceTransformer
-from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import DirectoryLoader
+import llama_cpp
+from llama_cpp import Llama, LlamaRAMCache, LlamaState
+from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain.chains import RetrievalQA
+import hashlib
+import json
+import logging
 import os
+import threading
+import time
+
+from RAG.autotune import model_profile, model_settings
+from RAG.chunker import Chunker
+from RAG.embedding_cache import CachedEmbeddings, EmbeddingCache
+from RAG.ingest import IngestionQueue
+from RAG.model_pool import ModelPool, kv_cache_bytes
+from RAG.parsing import ParserPool
+from RAG.prompt_states import PromptStateStore
+from RAG.response_cache import ResponseCache
+from RAG.scheduler import FairShareScheduler
+from RAG.speculative import make_draft
+from RAG.streaming import timed_stream
+from RAG.text_cache import ParsedTextCache
+from RAG.vector_index import VectorIndex, default_index_folder
+
+logger = logging.getLogger(__name__)
+
 
 class LocalLLMEngine:
     """Handles local LLM functionality with GGUF models"""
 
-    def __init__(self, models_dir="./models", upload_folder="./uploads", embedding_model="all-MiniLM-L6-v2"):
+    def __init__(self, models_dir="./models", upload_folder="./uploads", embedding_model="all-MiniLM-L6-v2",
+                 index_folder=None, top_k=4, chunk_size=256, chunk_overlap=32, embedding_cache=None,
+                 index_mmap=True, index_policy=None, search_mode="hybrid", response_cache=None,
+                 n_ctx=2048, n_threads=4, memory_budget_mb=8192, model_idle_ttl=600, prompt_cache_mb=512,
+                 prompt_state_folder=None, decode_quantum=16, decode_slice=256, max_active_requests=4,
+                 profile_folder=None, speculative=None, draft_tokens=8, parse_workers=None, parse_timeout=120.0,
+                 text_cache=None, ingest_workers=2, rescan_interval=30.0):
         self.models_dir = models_dir
         self.upload_folder = upload_folder
         self.embedding_model_name = embedding_model
-        self.llm = None
+        self.index_folder = index_folder or default_index_folder(upload_folder)
+        self.top_k = top_k
+        self.search_mode = search_mode
+        self.response_cache = response_cache or ResponseCache()
+        self.index_mmap = index_mmap
+        self.index_policy = index_policy
+        self.chunker = Chunker(chunk_size, chunk_overlap)
+        self.embedding_cache = embedding_cache or EmbeddingCache(os.path.join(self.index_folder, "embedding_cache"))
+        self.text_cache = text_cache or ParsedTextCache(os.path.join(self.index_folder, "text_cache"))
+        # Workers come from a fork server, so even those replaced mid-run never copy the loaded models
+        self.parser = ParserPool(parse_workers, parse_timeout)
+        # Files are indexed in the background, not on the query path: ingest() queues
+        # one, and the uploads folder is rescanned every rescan_interval seconds
+        self.ingest_workers = ingest_workers
+        self.rescan_interval = rescan_interval
+        self.ingestion = None
+        self.n_ctx = n_ctx
+        self.n_threads = n_threads
+        # Written by `python -m RAG.autotune`; overrides n_ctx and n_threads per model
+        self.profile_folder = profile_folder or os.path.join(models_dir, ".autotune")
+        # Opt-in speculative decoding: "prompt_lookup" drafts by copying from the
+        # prompt (retrieved context), a GGUF file name uses that model as drafter
+        self.speculative = speculative
+        self.draft_tokens = draft_tokens
+        self.prompt_cache_bytes = prompt_cache_mb * 1024 * 1024
+        # Several GGUF models stay loaded at once, within the memory budget
+        self.models = ModelPool(self._load_llm, self._model_path, memory_budget_mb * 1024 * 1024,
+                                n_ctx=n_ctx, idle_ttl=model_idle_ttl, extra_bytes=self.prompt_cache_bytes,
+                                extra_for=self._draft_bytes)
+        # Named prefix states restored into the prompt cache whenever a model loads
+        self.prompt_states = PromptStateStore(prompt_state_folder or os.path.join(self.index_folder, "prompt_states"))
+        self._fingerprints = {}
+        # One scheduler per model serialises access to its llama.cpp context
+        self.decode_quantum = decode_quantum
+        self.decode_slice = decode_slice
+        self.max_active_requests = max_active_requests
+        self._schedulers = {}
+        self._schedulers_lock = threading.Lock()
+        self.prompt_stats = {"requests": 0, "prompt_tokens": 0, "reused_tokens": 0, "last": None}
+        self.speculative_stats = {"requests": 0, "drafted_tokens": 0, "accepted_tokens": 0, "verify_passes": 0,
+                                  "last": None}
+        self._prompt_stats_lock = threading.Lock()
         self.embeddings = None
+        self.vector_index = None
         self.available_models = self._get_available_models()
 
     def _get_available_models(self):
@@ -27,55 +96,311 @@ class LocalLLMEngine:
         models = [f for f in os.listdir(self.models_dir) if f.endswith('.gguf')]
         return models
 
+    def _model_path(self, model_name):
+        return os.path.join(self.models_dir, model_name)
+
+    def _llama_params(self, model_name):
+        """llama.cpp settings for a model: this host's autotune profile, else the defaults"""
+        params = {"n_ctx": self.n_ctx, "n_threads": self.n_threads}
+        params.update(model_settings(self.profile_folder, model_name, self._model_path(model_name)))
+        return params
+
+    def _load_llm(self, model_name):
+        params = self._llama_params(model_name)
+        logger.info("Loading %s with %s", model_name, params)
+        draft = self._draft_for(model_name, params)
+        llm = Llama(
+            model_path=self._model_path(model_name),
+            verbose=False,
+            draft_model=draft,
+            **params
+        )
+        draft_llm = getattr(getattr(draft, "draft", None), "llm", None)
+        if draft_llm is not None and draft_llm.n_vocab() != llm.n_vocab():
+            logger.warning("Draft model %s does not share the vocabulary of %s; speculative decoding disabled",
+                           self.speculative, model_name)
+            llm.draft_model = None
+        if self.prompt_cache_bytes:
+            # Evaluated states keyed by token prefix; a prompt that shares its
+            # instructions and retrieved context with an earlier one resumes from there
+            llm.set_cache(LlamaRAMCache(capacity_bytes=self.prompt_cache_bytes))
+            self._restore_prompt_states(llm, model_name)
+        return llm
+
+    def _token_counter(self, model_name):
+        """Count tokens with the tokenizer of the model in the pool, loading it back only if it was evicted"""
+        def count(text):
+            llm = self.models.loaded(model_name)
+            if llm is None:
+                with self.models.use(model_name) as llm:
+                    pass
+            return len(llm.tokenize(text.encode("utf-8"), add_bos=False))
+        return count
+
+    def _tokenizer_name(self, model_name):
+        """Names a model's vocabulary by a hash of its token pieces, so only a different vocabulary re-chunks"""
+        digest = hashlib.sha256()
+        with self.models.use(model_name) as llm:
+            for token in range(llm.n_vocab()):
+                digest.update(llm.detokenize([token]) + b"\0")
+        return f"llama.cpp/{digest.hexdigest()[:16]}"
+
+    def _draft_for(self, model_name, params):
+        """Draft model for speculative decoding of model_name, or None"""
+        if not self.speculative or self.speculative == model_name:
+            return None
+        if self.speculative == "prompt_lookup":
+            return make_draft("prompt_lookup", self.draft_tokens)
+        if self.speculative not in self.available_models:
+            raise ValueError(f"Draft model '{self.speculative}' not found in {self.models_dir}")
+        draft_llm = Llama(
+            model_path=self._model_path(self.speculative),
+            n_ctx=params["n_ctx"],
+            n_threads=params["n_threads"],
+            verbose=False
+        )
+        return make_draft("model", self.draft_tokens, draft_llm)
+
+    def _draft_bytes(self, model_name, llm=None):
+        """Memory of the draft model loaded with model_name: its file plus its KV cache"""
+        draft = getattr(getattr(getattr(llm, "draft_model", None), "draft", None), "llm", None)
+        if llm is not None and draft is None:
+            # Prompt lookup, no draft, or one dropped for not sharing the vocabulary
+            return 0
+        if draft is None and (self.speculative in (None, model_name, "prompt_lookup")
+                              or self.speculative not in self.available_models):
+            return 0
+        n_ctx = draft.n_ctx() if draft is not None else self._llama_params(model_name)["n_ctx"]
+        return (os.path.getsize(self._model_path(self.speculative))
+                + kv_cache_bytes(getattr(draft, "metadata", None) or {}, n_ctx, self.models.kv_bytes_per_token))
+
+    def _context_params(self, model_name):
+        """Parameters a saved state depends on besides the model file"""
+        return {"n_ctx": self._llama_params(model_name)["n_ctx"], "llama_cpp": llama_cpp.__version__}
+
+    def _fingerprint(self, model_name):
+        params = self._context_params(model_name)
+        key = (model_name, json.dumps(params, sort_keys=True))
+        if key not in self._fingerprints:
+            self._fingerprints[key] = self.prompt_states.fingerprint(self._model_path(model_name), params)
+        return self._fingerprints[key]
+
+    def _restore_prompt_states(self, llm, model_name):
+        restored = []
+        for name, tokens, state in self.prompt_states.load(self._fingerprint(model_name), model_name, LlamaState):
+            llm.cache[tokens] = state
+            restored.append(name)
+        if restored:
+            logger.info("Restored %d prompt states for %s: %s", len(restored), model_name, ", ".join(restored))
+
+    def snapshot_prefix(self, model_name, name, text):
+        """Evaluate a prompt prefix (system prompt, common context) and save its state to disk
+
+        End the prefix at a natural boundary such as a newline, so it tokenizes
+        the same way alone as at the start of full prompts. The state is
+        restored into the prompt cache on every later load of this model.
+        """
+        if model_name not in self.available_models:
+            raise ValueError(f"Model '{model_name}' not found in {self.models_dir}")
+        if not self.prompt_cache_bytes:
+            raise ValueError("Prompt states need the prompt cache; set prompt_cache_mb")
+        def evaluate(llm):
+            tokens = llm.tokenize(text.encode("utf-8"))
+            llm.reset()
+            llm.eval(tokens)
+            state = llm.save_state()
+            llm.cache[tokens] = state
+            return tokens, state
+
+        tokens, state = self._scheduler(model_name).call(evaluate)
+        size = self.prompt_states.save(self._fingerprint(model_name), model_name, self._context_params(model_name),
+                                       name, tokens, state)
+        logger.info("Saved prompt state %s for %s (%d tokens, %d MB)", name, model_name, len(tokens),
+                    size // (1024 * 1024))
+        return {"name": name, "model": model_name, "tokens": len(tokens), "bytes": size}
+
+    def _scheduler(self, model_name):
+        with self._schedulers_lock:
+            if model_name not in self._schedulers:
+                self._schedulers[model_name] = FairShareScheduler(
+                    self.models.use, model_name, quantum=self.decode_quantum, max_active=self.max_active_requests,
+                    slice_tokens=self.decode_slice, hold_bytes=self.models.hold
+                )
+            return self._schedulers[model_name]
+
+    def _record_request(self, model_name, request):
+        """Log and count prompt reuse and speculative decoding figures of a finished request"""
+        if request.prompt_tokens is None:
+            return
+        if request.verify_passes:
+            self._record_speculation(model_name, request)
+        prompt_tokens, reused = len(request.prompt_tokens), request.reused_tokens
+        with self._prompt_stats_lock:
+            self.prompt_stats["requests"] += 1
+            self.prompt_stats["prompt_tokens"] += prompt_tokens
+            self.prompt_stats["reused_tokens"] += reused
+            self.prompt_stats["last"] = {"model": model_name, "prompt_tokens": prompt_tokens, "reused_tokens": reused}
+        logger.info("Prompt of %d tokens, %d reused from the KV cache, %.2fs queued (model=%s)",
+                    prompt_tokens, reused, request.started_at - request.submitted_at, model_name)
+
+    def _record_speculation(self, model_name, request):
+        tokens_per_sec = request.decode_tokens / request.decode_seconds if request.decode_seconds else 0.0
+        # Speedup against plain decoding as measured by autotune, when this host was tuned
+        baseline = model_profile(self.profile_folder, model_name, self._model_path(model_name)).get(
+            "generate_tokens_per_sec")
+        last = {
+            "model": model_name,
+            "drafted_tokens": request.drafted_tokens,
+            "accepted_tokens": request.accepted_tokens,
+            "acceptance_rate": request.accepted_tokens / request.drafted_tokens if request.drafted_tokens else 0.0,
+            "tokens_per_pass": len(request.generated) / request.verify_passes,
+            "tokens_per_sec": tokens_per_sec,
+            "speedup": tokens_per_sec / baseline if baseline else None,
+        }
+        with self._prompt_stats_lock:
+            stats = self.speculative_stats
+            stats["requests"] += 1
+            stats["drafted_tokens"] += request.drafted_tokens
+            stats["accepted_tokens"] += request.accepted_tokens
+            stats["verify_passes"] += request.verify_passes
+            stats["last"] = last
+        logger.info("Speculative decoding: %d of %d drafted tokens accepted (%.0f%%), %.2f tokens per pass, "
+                    "%.1f tokens/s (model=%s)", request.accepted_tokens, request.drafted_tokens,
+                    last["acceptance_rate"] * 100, last["tokens_per_pass"], tokens_per_sec, model_name)
+
     def load_model(self, model_name):
-        """Load a specific GGUF model"""
+        """Load a specific GGUF model into the pool, along with the embeddings and index"""
         if model_name not in self.available_models:
             raise ValueError(f"Model '{model_name}' not found in {self.models_dir}")
 
-        model_path = os.path.join(self.models_dir, model_name)
-        self.llm = Llama(
-            model_path=model_path,
-            n_ctx=2048,
-            n_threads=4,
-            verbose=False
-        )
-        self.embeddings = SentenceTransformer(self.embedding_model_name)
+        with self.models.use(model_name):
+            pass
+        if self.embeddings is None:
+            self.embeddings = HuggingFaceEmbeddings(model_name=self.embedding_model_name)
+        if self.vector_index is None:
+            # Chunk sizes in the tokens of the model that opens the index, so top_k chunks fit its prompt
+            self.chunker.token_counter = self._token_counter(model_name)
+            self.chunker.tokenizer = self._tokenizer_name(model_name)
+            self.vector_index = VectorIndex(
+                self.upload_folder, self.index_folder,
+                CachedEmbeddings(self.embeddings, self.embedding_model_name, self.embedding_cache),
+                self.embedding_model_name,
+                chunker=self.chunker,
+                mmap=self.index_mmap,
+                policy=self.index_policy,
+                parser=self.parser.parse,
+                text_cache=self.text_cache
+            )
+            self.ingestion = IngestionQueue(self.vector_index, self.ingest_workers).start(
+                rescan_interval=self.rescan_interval)
         return True
 
-    def query(self, query_text, selected_model="gemma-2b.gguf"):
-        """Process a query using local LLM"""
-        if not self.llm or not self.embeddings:
-            if not self.load_model(selected_model):
-                return "Error: No model loaded"
+    def ingest(self, filename, sha256=None):
+        """Queue an uploaded file for background indexing; before load_model the first scan picks it up"""
+        if self.ingestion is None:
+            return None
+        return self.ingestion.submit(filename, sha256)
+
+    def _prepare(self, query_text, selected_model, search_mode):
+        """Return (cached answer, prompt, store) where store(answer) fills the response cache"""
+        if selected_model not in self.available_models:
+            raise ValueError(f"Model '{selected_model}' not found in {self.models_dir}")
+        if self.embeddings is None:
+            self.load_model(selected_model)
+
+        search_mode = search_mode or self.search_mode
+        version = self.vector_index.version
+        # Keyword searches never embed; their answers are cached by exact question text
+        question = None if search_mode == "keyword" else self.vector_index.embeddings.embed_query(query_text)
+        cache_key = (selected_model, search_mode)
+
+        def store(answer):
+            self.response_cache.put(cache_key, version, query_text, question, answer)
 
-        # Load documents from folder
-        loader = DirectoryLoader(self.upload_folder)
-        documents = loader.load()
+        cached = self.response_cache.get(cache_key, version, query_text, question)
+        if cached is not None:
+            return cached, None, store
 
-        if not documents:
+        # Get relevant chunks, reusing the question embedding
+        relevant_docs = self.vector_index.search(query_text, self.top_k, search_mode, vector=question)
+
+        if not relevant_docs:
             # No documents, respond directly
             prompt = f"Query: {query_text}\n\nAnswer:"
         else:
-            # Create retriever with FAISS using local embeddings
-            from langchain_community.embeddings import HuggingFaceEmbeddings
-            hf_embeddings = HuggingFaceEmbeddings(model_name=self.embedding_model_name)
-            vectorstore = FAISS.from_documents(documents, hf_embeddings)
-            retriever = vectorstore.as_retriever()
-
-            # Get relevant documents
-            relevant_docs = retriever.get_relevant_documents(query_text)
             context = "\n".join([doc.page_content for doc in relevant_docs])
 
             # Create prompt with context
             prompt = f"Context: {context}\n\nQuery: {query_text}\n\nAnswer:"
+        return None, prompt, store
+
+    def query(self, query_text, selected_model="gemma-2b.gguf", search_mode=None, priority=0, client=None):
+        """Process a query using local LLM; higher priority requests are decoded first"""
+        cached, prompt, store = self._prepare(query_text, selected_model, search_mode)
+        if cached is not None:
+            return cached
 
-        # Generate response using local LLM
+        # Generate response using local LLM, sharing it with concurrent queries
         try:
-            response = self.llm(prompt, max_tokens=512)
-            return response['choices'][0]['text'].strip()
+            request = self._scheduler(selected_model).submit(prompt, 512, priority, client)
+            answer = request.result().strip()
+            self._record_request(selected_model, request)
+            store(answer)
+            return answer
         except Exception as e:
             return f"Error generating response: {str(e)}"
 
+    def query_stream(self, query_text, selected_model="gemma-2b.gguf", search_mode=None, priority=0,
+                     client=None):
+        """Process a query using local LLM, returning an iterator of answer pieces"""
+        start = time.perf_counter()
+        cached, prompt, store = self._prepare(query_text, selected_model, search_mode)
+        if cached is not None:
+            return timed_stream([cached], start, selected_model)
+
+        request = self._scheduler(selected_model).submit(prompt, 512, priority, client)
+
+        def pieces():
+            leading = True
+            for text in request.stream():
+                if leading:
+                    # Match query(), which strips the answer
+                    text = text.lstrip()
+                    leading = not text
+                yield text
+            self._record_request(selected_model, request)
+
+        return timed_stream(pieces(), start, selected_model, on_complete=lambda answer: store(answer.strip()))
+
+    def stats(self):
+        """Return model pool, cache and index counters"""
+        return {
+            "models": self.models.stats(),
+            "prompt_cache": self._prompt_cache_stats(),
+            "speculative": self._speculative_stats(),
+            "schedulers": {name: scheduler.stats() for name, scheduler in list(self._schedulers.items())},
+            "index": self.vector_index.stats() if self.vector_index is not None else None,
+            "parsing": self.parser.stats(),
+            "ingestion_pending": self.ingestion.pending() if self.ingestion is not None else 0,
+            "embedding_cache": self.embedding_cache.stats(),
+            "text_cache": self.text_cache.stats(),
+            "response_cache": self.response_cache.stats(),
+        }
+
+    def _prompt_cache_stats(self):
+        with self._prompt_stats_lock:
+            stats = dict(self.prompt_stats)
+        stats["reused_fraction"] = stats["reused_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+        return stats
+
+    def _speculative_stats(self):
+        with self._prompt_stats_lock:
+            stats = dict(self.speculative_stats)
+        stats["mode"] = self.speculative
+        stats["acceptance_rate"] = (stats["accepted_tokens"] / stats["drafted_tokens"]
+                                    if stats["drafted_tokens"] else 0.0)
+        return stats
+
     def get_available_models(self):
         """Return list of available models"""
         return self.available_models
\ No newline at end of file
@@ -2,32 +2,120 @@
 Flask server for System Discovery and Researching
 """
 
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 import os
 import argparse
 import signal
 import sys
 
-from config import FLASK_CONFIG, AVAILABLE_MODELS, DEFAULT_HOST, DEFAULT_PORT
-from utils import allowed_file, validate_file_content, ensure_upload_folder, safe_save_file
+from config import FLASK_CONFIG, RAG_CONFIG, AVAILABLE_MODELS, DEFAULT_HOST, DEFAULT_PORT
+from utils import allowed_file, validate_file_content, ensure_upload_folder, safe_filename, safe_save_file
 from RAG.rag_engine import SDREngine
+from RAG.embedding_cache import EmbeddingCache
+from RAG.index_types import IndexPolicy
+from RAG.ollama_client import OllamaService
+from RAG.ollama_router import OllamaRouter
+from RAG.response_cache import ResponseCache
+from RAG.sharding import ShardCoordinator, encode_matches
+from RAG.streaming import sse_event
+from RAG.text_cache import ParsedTextCache
+from RAG.uploads import UploadLimitError, UploadOffsetError, UploadSessions
+from RAG.vector_index import SEARCH_MODES
 
 class SDRServer:
     """Flask server wrapper for System Discovery and Researching"""
 
-    def __init__(self):
+    def __init__(self, self_url=None):
         print("Initializing SDRServer...")
+        # Where other nodes reach this server, so it never lists itself as a shard
+        self.self_url = self_url or RAG_CONFIG['SELF_URL'] or f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"
         self.app = Flask(__name__)
         self.app.config.update(FLASK_CONFIG)
         self.upload_folder = self.app.config['UPLOAD_FOLDER']
         ensure_upload_folder(self.upload_folder)
 
         print("Creating SDREngine...")
-        self.sdr_engine = SDREngine(self.upload_folder, AVAILABLE_MODELS)
+        self.sdr_engine = SDREngine(
+            self.upload_folder, AVAILABLE_MODELS,
+            index_folder=RAG_CONFIG['INDEX_FOLDER'],
+            embedding_model=RAG_CONFIG['EMBEDDING_MODEL'],
+            top_k=RAG_CONFIG['TOP_K'],
+            search_mode=RAG_CONFIG['SEARCH_MODE'],
+            ingest_workers=RAG_CONFIG['INGEST_WORKERS'],
+            parse_workers=RAG_CONFIG['PARSE_WORKERS'],
+            parse_timeout=RAG_CONFIG['PARSE_TIMEOUT'],
+            chunk_size=RAG_CONFIG['CHUNK_SIZE'],
+            chunk_overlap=RAG_CONFIG['CHUNK_OVERLAP'],
+            embedding_cache=EmbeddingCache(
+                RAG_CONFIG['EMBEDDING_CACHE_FOLDER'],
+                RAG_CONFIG['EMBEDDING_CACHE_MB'] * 1024 * 1024
+            ),
+            text_cache=ParsedTextCache(RAG_CONFIG['TEXT_CACHE_FOLDER']),
+            uploads=UploadSessions(
+                self.upload_folder,
+                max_bytes=RAG_CONFIG['UPLOAD_MAX_MB'] * 1024 * 1024,
+                chunk_size=RAG_CONFIG['UPLOAD_CHUNK_MB'] * 1024 * 1024,
+                expiry=RAG_CONFIG['UPLOAD_EXPIRY_HOURS'] * 3600,
+                max_sessions=RAG_CONFIG['UPLOAD_MAX_SESSIONS']
+            ),
+            ollama_client=self.create_ollama_client(),
+            shards=self.create_shard_coordinator(),
+            embed_batch_size=RAG_CONFIG['EMBED_BATCH_SIZE'],
+            embed_concurrency=RAG_CONFIG['EMBED_CONCURRENCY'],
+            index_mmap=RAG_CONFIG['INDEX_MMAP'],
+            index_policy=IndexPolicy(
+                RAG_CONFIG['INDEX_TYPE'],
+                latency_target_ms=RAG_CONFIG['INDEX_LATENCY_TARGET_MS'],
+                flat_max_vectors=RAG_CONFIG['INDEX_FLAT_MAX_VECTORS'],
+                nprobe=RAG_CONFIG['INDEX_NPROBE'],
+                ef_search=RAG_CONFIG['INDEX_EF_SEARCH'],
+                compression=RAG_CONFIG['INDEX_COMPRESSION'],
+                rerank_factor=RAG_CONFIG['INDEX_RERANK_FACTOR']
+            ),
+            response_cache=ResponseCache(
+                RAG_CONFIG['RESPONSE_CACHE_SIZE'],
+                ttl=RAG_CONFIG['RESPONSE_CACHE_TTL'],
+                threshold=RAG_CONFIG['RESPONSE_CACHE_THRESHOLD']
+            )
+        )
+        if RAG_CONFIG['OLLAMA_WARMUP']:
+            # In the background, so the server is up while the models load
+            print("Warming up Ollama models...")
+            self.sdr_engine.warm_up()
         print("Setting up routes...")
         self.setup_routes()
         print("SDRServer initialized successfully")
 
+    def create_ollama_client(self):
+        """A pooled client for OLLAMA_HOST, or a router when OLLAMA_HOSTS lists several hosts"""
+        def service(host):
+            return OllamaService(
+                host,
+                keep_alive=RAG_CONFIG['OLLAMA_KEEP_ALIVE'],
+                model_keep_alive=RAG_CONFIG['OLLAMA_KEEP_ALIVE_MODELS'],
+                timeout=RAG_CONFIG['OLLAMA_TIMEOUT'],
+                max_connections=RAG_CONFIG['OLLAMA_MAX_CONNECTIONS']
+            )
+
+        hosts = RAG_CONFIG['OLLAMA_HOSTS']
+        if len(hosts) > 1:
+            print(f"Routing Ollama requests across {len(hosts)} hosts")
+            return OllamaRouter([service(host) for host in hosts],
+                                health_interval=RAG_CONFIG['OLLAMA_HEALTH_INTERVAL'])
+        return service(hosts[0] if hosts else RAG_CONFIG['OLLAMA_HOST'])
+
+    def create_shard_coordinator(self):
+        """A coordinator over the SHARDS servers, or None to serve this server's own index"""
+        if not RAG_CONFIG['SHARDS']:
+            return None
+        print(f"Coordinating {len(RAG_CONFIG['SHARDS'])} index shards")
+        return ShardCoordinator(RAG_CONFIG['SHARDS'], RAG_CONFIG['SHARD_TIMEOUT'], RAG_CONFIG['SHARD_VERSION_TTL'],
+                                self_url=self.self_url)
+
+    def admin_request(self):
+        """Whether the current request comes from an address allowed to use the admin endpoints"""
+        return request.remote_addr in RAG_CONFIG['ADMIN_ADDRESSES']
+
     def setup_routes(self):
         """Setup Flask routes"""
 
@@ -58,31 +146,226 @@ class SDRServer:
             if not validate_file_content(file):
                 return jsonify({"error": "Invalid file content"}), 400
 
+            if self.sdr_engine.shards:
+                # The owning shard stores and indexes it, under the name it is saved as there
+                try:
+                    shard, reply = self.sdr_engine.shards.upload(safe_filename(file.filename), file.stream,
+                                                                 file.mimetype)
+                except Exception as e:
+                    return jsonify({"error": f"Upload to shard failed: {str(e)}"}), 502
+                return jsonify(dict(reply, shard=shard)), 200
+
             try:
                 filename = safe_save_file(file, self.upload_folder, file.filename)
-                return jsonify({"message": f"File '{filename}' uploaded successfully!"}), 200
             except Exception as e:
                 return jsonify({"error": f"Upload failed: {str(e)}"}), 500
 
-        @self.app.route("/query", methods=["POST"])
-        def query():
-            """Process query"""
+            # Parsing and embedding happen in the background, not on the next query
+            job = self.sdr_engine.ingest(filename)
+            return jsonify({
+                "message": f"File '{filename}' uploaded successfully! Indexing in background.",
+                "ingest": job
+            }), 200
+
+        @self.app.route("/ingest/status", methods=["GET"])
+        def ingest_status():
+            """Get per-file ingestion progress"""
+            filename = request.args.get("file")
+            if self.sdr_engine.shards:
+                try:
+                    return jsonify(self.sdr_engine.shards.ingest_status(filename))
+                except Exception as e:
+                    return jsonify({"error": f"Shard status failed: {str(e)}"}), 502
+            if filename is None:
+                jobs = self.sdr_engine.ingest_status()
+                return jsonify({"files": jobs, "pending": self.sdr_engine.ingestion.pending()})
+
+            job = self.sdr_engine.ingest_status(filename)
+            if job is None:
+                return jsonify({"error": f"No ingestion job for '{filename}'"}), 404
+            return jsonify(job)
+
+        # Chunked uploads: POST /uploads starts one, PATCH sends the bytes from the offset in the
+        # Upload-Offset header, GET (or HEAD) reports the offset to resume from after a dropped connection
+        @self.app.route("/uploads", methods=["POST"])
+        def create_upload():
+            """Start a resumable chunked upload"""
             data = request.json
             if data is None:
                 return jsonify({"error": "Invalid JSON"}), 400
+            filename = data.get("filename") or ""
+            if not allowed_file(filename):
+                return jsonify({"error": "File type not allowed"}), 400
+            if self.sdr_engine.shards:
+                # The bytes are not relayed; the client uploads to the owning shard directly
+                return jsonify({"error": "Upload this file to its shard",
+                                "shard": self.sdr_engine.shards.owner(safe_filename(filename))}), 409
+            try:
+                status = self.sdr_engine.start_upload(filename, int(data.get("size", -1)))
+            except (TypeError, ValueError) as e:
+                return jsonify({"error": str(e)}), 400
+            except UploadLimitError as e:
+                return jsonify({"error": str(e)}), 429
+            return jsonify(status), 200 if status["complete"] else 201
+
+        def upload_status_response(status, code=200):
+            response = jsonify(status)
+            response.headers["Upload-Offset"] = str(status["offset"])
+            response.headers["Upload-Length"] = str(status["size"])
+            return response, code
+
+        @self.app.route("/uploads/<upload_id>", methods=["GET"])
+        def upload_status(upload_id):
+            """Offset to resume a chunked upload from"""
+            try:
+                return upload_status_response(self.sdr_engine.uploads.status(upload_id))
+            except KeyError:
+                return jsonify({"error": "Unknown upload"}), 404
+
+        @self.app.route("/uploads/<upload_id>", methods=["PATCH"])
+        def upload_chunk(upload_id):
+            """Append the request body to a chunked upload at the Upload-Offset header"""
+            uploads = self.sdr_engine.uploads
+            try:
+                offset = int(request.headers.get("Upload-Offset", ""))
+            except ValueError:
+                return jsonify({"error": "Upload-Offset header is required"}), 400
+            try:
+                if not uploads.status(upload_id)["complete"]:
+                    # Read from the raw stream, so Werkzeug never buffers the chunk
+                    uploads.append(upload_id, offset, request.stream)
+                if uploads.status(upload_id)["complete"]:
+                    return upload_status_response(self.sdr_engine.complete_upload(upload_id))
+                return upload_status_response(uploads.status(upload_id))
+            except KeyError:
+                return jsonify({"error": "Unknown upload"}), 404
+            except UploadOffsetError as e:
+                return upload_status_response(dict(uploads.status(upload_id), error=str(e)), 409)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            except Exception as e:
+                return jsonify({"error": f"Upload failed: {str(e)}"}), 500
+
+        @self.app.route("/uploads/<upload_id>", methods=["DELETE"])
+        def cancel_upload(upload_id):
+            """Abandon a chunked upload"""
+            try:
+                self.sdr_engine.uploads.discard(upload_id)
+            except KeyError:
+                return jsonify({"error": "Unknown upload"}), 404
+            return jsonify({"message": "Upload cancelled"}), 200
+
+        @self.app.route("/stats", methods=["GET"])
+        def stats():
+            """Get performance counters"""
+            if not self.admin_request():
+                return jsonify({"error": "Not allowed from this address"}), 403
+            return jsonify(self.sdr_engine.stats())
+
+        @self.app.route("/index/search_params", methods=["POST"])
+        def set_search_params():
+            """Tune IVF nprobe / HNSW efSearch and report the resulting recall@k"""
+            if not self.admin_request():
+                return jsonify({"error": "Not allowed from this address"}), 403
+            data = request.json
+            if data is None:
+                return jsonify({"error": "Invalid JSON"}), 400
+            try:
+                nprobe = int(data["nprobe"]) if "nprobe" in data else None
+                ef_search = int(data["ef_search"]) if "ef_search" in data else None
+            except (TypeError, ValueError):
+                return jsonify({"error": "nprobe and ef_search must be integers"}), 400
+            return jsonify(self.sdr_engine.vector_index.set_search_params(nprobe, ef_search))
+
+        @self.app.route("/shard/search", methods=["POST"])
+        def shard_search():
+            """Scored matches from this server's index, for a coordinator to merge"""
+            data = request.json
+            if data is None or not data.get("query"):
+                return jsonify({"error": "Query text is required"}), 400
+            mode = data.get("mode", RAG_CONFIG['SEARCH_MODE'])
+            if mode not in SEARCH_MODES:
+                return jsonify({"error": f"mode must be one of {list(SEARCH_MODES)}"}), 400
+            try:
+                k = int(data.get("k", RAG_CONFIG['TOP_K']))
+            except (TypeError, ValueError):
+                k = 0
+            if k < 1:
+                return jsonify({"error": "k must be a positive integer"}), 400
+            vector_index = self.sdr_engine.vector_index
+            # Read first, so a coordinator never caches an answer under a newer version than it saw
+            version = vector_index.version
+            try:
+                results = vector_index.scored_search(data["query"], k, mode, data.get("vector"))
+            except Exception as e:
+                return jsonify({"error": f"Search failed: {str(e)}"}), 500
+            return jsonify({"version": version, "results": encode_matches(results)})
+
+        @self.app.route("/shard/status", methods=["GET"])
+        def shard_status():
+            """Index version and size of this server's shard"""
+            vector_index = self.sdr_engine.vector_index
+            return jsonify({"version": vector_index.version, "chunks": len(vector_index),
+                            "files": len(vector_index.manifest)})
+
+        def parse_query():
+            """Return (query_text, model, search_mode, stream) or an error response"""
+            data = request.json
+            if data is None:
+                return None, (jsonify({"error": "Invalid JSON"}), 400)
 
             query_text = data.get("query", "")
             selected_model = data.get("model", "llama2")
+            search_mode = data.get("search_mode")
 
             if not query_text:
-                return jsonify({"error": "Query text is required"}), 400
+                return None, (jsonify({"error": "Query text is required"}), 400)
+            if search_mode is not None and search_mode not in SEARCH_MODES:
+                return None, (jsonify({"error": f"search_mode must be one of {list(SEARCH_MODES)}"}), 400)
+            return (query_text, selected_model, search_mode, bool(data.get("stream"))), None
 
+        def stream_query(query_text, selected_model, search_mode):
+            """Answer as Server-Sent Events: token events, then done or error"""
             try:
-                response = self.sdr_engine.query(query_text, selected_model)
+                pieces = self.sdr_engine.query_stream(query_text, selected_model, search_mode)
+            except Exception as e:
+                return jsonify({"error": f"Query failed: {str(e)}"}), 500
+
+            def events():
+                try:
+                    for piece in pieces:
+                        yield sse_event("token", {"token": piece})
+                    yield sse_event("done", {})
+                except Exception as e:
+                    yield sse_event("error", {"error": f"Error generating response: {str(e)}"})
+
+            return Response(stream_with_context(events()), mimetype="text/event-stream",
+                            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+        @self.app.route("/query", methods=["POST"])
+        def query():
+            """Process query; with "stream": true the answer is sent as Server-Sent Events"""
+            args, error = parse_query()
+            if error:
+                return error
+            query_text, selected_model, search_mode, stream = args
+            if stream:
+                return stream_query(query_text, selected_model, search_mode)
+
+            try:
+                response = self.sdr_engine.query(query_text, selected_model, search_mode)
                 return jsonify({"response": response}), 200
             except Exception as e:
                 return jsonify({"error": f"Query failed: {str(e)}"}), 500
 
+        @self.app.route("/query/stream", methods=["POST"])
+        def query_stream():
+            """Process query, streaming the answer as Server-Sent Events"""
+            args, error = parse_query()
+            if error:
+                return error
+            return stream_query(*args[:3])
+
     def run(self, host=DEFAULT_HOST, port=DEFAULT_PORT, debug=True):
         """Run the server"""
         def signal_handler(sig, frame):
@@ -94,10 +377,25 @@ class SDRServer:
 
         print(f"Starting server on {host}:{port}")
         print("Press Ctrl+C to stop the server.")
-        self.app.run(host=host, port=port, debug=debug)
+        # The reloader re-imports this module in a child process, which would
+        # build a second server with its own ingest workers and Ollama clients
+        self.app.run(host=host, port=port, debug=debug, use_reloader=False)
+
+def create_app():
+    """Build one server and return its Flask app, for WSGI servers and `flask --app server:create_app`"""
+    return SDRServer().app
+
+_app = None
 
-# For backward compatibility
-app = SDRServer().app
+def __getattr__(name):
+    # For backward compatibility: `from server import app` builds the server
+    # on first use instead of on every import of this module
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run the RAG system server")
@@ -105,5 +403,5 @@ if __name__ == "__main__":
     parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to bind to")
     args = parser.parse_args()
 
-    server = SDRServer()
+    server = SDRServer(RAG_CONFIG['SELF_URL'] or f"http://{args.host}:{args.port}")
     server.run(args.host, args.port)
\ No newline at end of file
@@ -0,0 +1,30 @@
+"""
+Shared fixtures: stub Ollama servers standing in for real ones
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tests.stub_ollama import start_stub_server
+
+
+@pytest.fixture
+def make_stub():
+    """Start stub Ollama servers with start_stub_server's options; all are stopped after the test"""
+    servers = []
+
+    def make(**options):
+        options = dict({"latency": 0.0, "per_item": 0.0, "dim": 8, "load_latency": 0.0}, **options)
+        server = start_stub_server(**options)
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,183 @@
+"""
+Minimal stand-in for an Ollama server, for tests and benchmarks on machines without Ollama
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_embedding(text, dim):
+    """Deterministic pseudo-embedding derived from the text hash"""
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    return [digest[i % len(digest)] / 255.0 for i in range(dim)]
+
+
+def keep_alive_seconds(value, default=300.0):
+    """Ollama's keep_alive as seconds: a number, a duration like "30m", negative for forever"""
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        match = re.fullmatch(r"(-?[\d.]+)(ms|s|m|h)?", str(value).strip())
+        if not match:
+            return default
+        seconds = float(match.group(1)) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600, None: 1}[match.group(2)]
+    return float("inf") if seconds < 0 else seconds
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    """Answers /api/embed and /api/generate after a fixed round-trip delay plus a per-item cost
+
+    A model not requested within its keep_alive is unloaded, and the next
+    request for it waits load_latency first, like a real Ollama server.
+    Connections are kept alive (HTTP/1.1), and each new one is counted, as
+    is the largest number of requests handled at once (max_in_flight).
+    GET /api/ps lists the loaded models. Setting server.fail makes every
+    request fail with a 500, and server.models (if set) limits the models
+    this server has pulled; others get a 404.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def _load(self, model, keep_alive):
+        """Return the seconds spent loading model, and record its keep_alive"""
+        server = self.server
+        now = time.time()
+        with server.stats_lock:
+            expires = server.loaded.get(model)
+            loaded = expires is not None and expires > now
+            server.keep_alives.append((model, keep_alive))
+            if not loaded:
+                server.loads += 1
+        load_seconds = 0.0 if loaded else server.load_latency
+        time.sleep(load_seconds)
+        with server.stats_lock:
+            server.loaded[model] = time.time() + keep_alive_seconds(keep_alive)
+        return load_seconds
+
+    def _send_chunked(self, lines):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for line in lines:
+            data = (json.dumps(line) + "\n").encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        if server.fail:
+            self._send_json({"error": "stub failure"}, 500)
+        elif self.path == "/api/ps":
+            now = time.time()
+            with server.stats_lock:
+                loaded = [model for model, expires in server.loaded.items() if expires > now]
+            self._send_json({"models": [{"name": model, "model": model} for model in loaded]})
+        else:
+            self._send_json({"error": f"unknown endpoint {self.path}"}, 404)
+
+    def do_POST(self):
+        server = self.server
+        with server.stats_lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            self._post()
+        finally:
+            with server.stats_lock:
+                server.in_flight -= 1
+
+    def _post(self):
+        length = int(self.headers.get("Content-Length", 0))
+        data = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+
+        if server.fail:
+            self._send_json({"error": "stub failure"}, 500)
+            return
+        if server.models is not None and data.get("model") not in server.models:
+            self._send_json({"error": f"model '{data.get('model')}' not found"}, 404)
+            return
+
+        if self.path == "/api/embed":
+            texts = data.get("input", [])
+            if isinstance(texts, str):
+                texts = [texts]
+            with server.stats_lock:
+                server.requests += 1
+            load_seconds = self._load(data.get("model"), data.get("keep_alive"))
+            time.sleep(server.latency + server.per_item * len(texts))
+            self._send_json({
+                "model": data.get("model"),
+                "embeddings": [fake_embedding(text, server.dim) for text in texts],
+                "load_duration": int(load_seconds * 1e9),
+            })
+        elif self.path == "/api/generate":
+            model = data.get("model")
+            with server.stats_lock:
+                server.requests += 1
+            load_seconds = self._load(model, data.get("keep_alive"))
+            done = {"model": model, "response": "", "done": True, "load_duration": int(load_seconds * 1e9)}
+            # An empty prompt only loads the model
+            words = [f"word{i} " for i in range(server.answer_tokens)] if data.get("prompt") else []
+            time.sleep(server.latency)
+            if data.get("stream", True):
+                def lines():
+                    for word in words:
+                        time.sleep(server.per_item)
+                        yield {"model": model, "response": word, "done": False}
+                    yield done
+                self._send_chunked(lines())
+            else:
+                time.sleep(server.per_item * len(words))
+                self._send_json(dict(done, response="".join(words)))
+        else:
+            self._send_json({"error": f"unknown endpoint {self.path}"}, 404)
+
+
+def start_stub_server(latency=0.02, per_item=0.001, dim=384, port=0, load_latency=0.5, answer_tokens=16,
+                      models=None):
+    """Start a stub server in a background thread and return it; its URL is server.url"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubOllamaHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.per_item = per_item
+    server.dim = dim
+    server.load_latency = load_latency
+    server.answer_tokens = answer_tokens
+    server.models = set(models) if models is not None else None
+    server.fail = False
+    server.requests = 0
+    server.connections = 0
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.loads = 0
+    server.loaded = {}  # model -> time it unloads
+    server.keep_alives = []  # (model, keep_alive) of every request
+    server.stats_lock = threading.Lock()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,58 @@
+"""
+Autotuning: per-host profiles, invalidated by a changed model file, and the coordinate search
+"""
+
+import json
+
+from RAG import autotune
+
+
+def test_a_profile_applies_until_the_model_file_changes(tmp_path):
+    model = tmp_path / "model.gguf"
+    model.write_bytes(b"weights")
+    folder = str(tmp_path / ".autotune")
+    autotune.save_profile(folder, {"model.gguf": {"size": 7, "params": {"n_threads": 4}}})
+    autotune.save_profile(folder, {"other.gguf": {"size": 1, "params": {"n_threads": 2}}})
+
+    assert autotune.model_settings(folder, "model.gguf", str(model)) == {"n_threads": 4}
+    assert sorted(autotune.load_profile(folder)) == ["model.gguf", "other.gguf"]
+
+    model.write_bytes(b"new weights")
+    assert autotune.model_settings(folder, "model.gguf", str(model)) == {}
+
+
+def test_a_profile_from_another_version_is_ignored(tmp_path):
+    folder = tmp_path / ".autotune"
+    folder.mkdir()
+    with open(autotune.profile_path(str(folder)), "w") as f:
+        json.dump({"version": autotune.PROFILE_VERSION + 1, "models": {"model.gguf": {}}}, f)
+
+    assert autotune.load_profile(str(folder)) == {}
+
+
+def fake_benchmark(model_path, params):
+    """Generation peaks at 4 threads, prompt evaluation at 8 and n_batch 512; an 8192 context is slow"""
+    generate = 10.0 - abs(params["n_threads"] - 4)
+    prompt = 100.0 * params.get("n_threads_batch", params["n_threads"]) - abs(params["n_batch"] - 512) / 10
+    slowdown = 1.5 if params["n_ctx"] > 4096 else 1.0
+    if not params["use_mmap"]:
+        slowdown *= 1.2
+    return {
+        "params": dict(params),
+        "load_seconds": 0.0,
+        "prompt_tokens_per_sec": prompt,
+        "generate_tokens_per_sec": generate,
+        "request_seconds": slowdown * (autotune.PROMPT_TOKENS / prompt + autotune.GENERATED_TOKENS / generate),
+    }
+
+
+def test_each_setting_is_tuned_in_turn(monkeypatch):
+    monkeypatch.setattr(autotune.os, "cpu_count", lambda: 8)
+    monkeypatch.setattr(autotune, "benchmark", fake_benchmark)
+    monkeypatch.setattr(autotune, "context_candidates", lambda model_path: [2048, 4096, 8192])
+
+    best, results = autotune.tune_model("model.gguf")
+
+    assert best == {"n_ctx": 4096, "n_batch": 512, "n_threads": 4, "n_threads_batch": 8,
+                    "use_mmap": True, "use_mlock": False}
+    assert {result["params"]["n_ctx"] for result in results} == {2048, 4096, 8192}
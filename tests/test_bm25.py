@@ -0,0 +1,53 @@
+"""
+BM25 inverted index and reciprocal-rank fusion: identifiers kept whole, a persistent index, fused rankings
+"""
+
+import numpy as np
+
+from RAG.bm25 import BM25Index, reciprocal_rank_fusion, tokenize
+
+CHUNKS = [
+    (0, "errors.md", "Error ERR_042 means the uplink on eth0.100 went down.", {"page": 1}),
+    (1, "errors.md", "Error ERR_043 means the power supply failed.", {"page": 1}),
+    (2, "guide.md", "Configure the uplink before the VLAN; the uplink carries VLAN 100.", {"page": 2}),
+    (3, "code.py", "import os.path to join paths", {}),
+]
+
+
+def test_compound_names_are_terms_with_their_parts():
+    assert tokenize("Call os.path.join on ERR-42") == ["call", "os.path.join", "os", "path", "join", "on",
+                                                      "err-42", "err", "42"]
+
+
+def test_an_exact_identifier_ranks_its_chunk_first_after_a_reopen(tmp_path):
+    path = str(tmp_path / "bm25.sqlite")
+    BM25Index(path).add(CHUNKS, version=3)
+
+    index = BM25Index(path)
+
+    assert index.version == 3
+    score, text, metadata = index.search("what is ERR_042", k=1)[0]
+    assert text.startswith("Error ERR_042") and metadata == {"page": 1} and score > 0
+    assert [text for _, text, _ in index.search("uplink", k=2)][0].startswith("Configure")
+    assert index.search("path", k=1)[0][1] == "import os.path to join paths"
+    assert index.stats()["chunks"] == 4
+
+
+def test_removed_and_rejected_chunks_are_not_returned(tmp_path):
+    index = BM25Index(str(tmp_path / "bm25.sqlite"))
+    index.add(CHUNKS, version=1)
+
+    index.remove([2])
+    assert all(not text.startswith("Configure") for _, text, _ in index.search("uplink VLAN", k=4))
+
+    # accept hides chunks a search's index generation does not show yet
+    results = index.search("error", k=4, accept=lambda ids: np.asarray(ids) != 0)
+    assert [text for _, text, _ in results] == ["Error ERR_043 means the power supply failed."]
+    assert index.stats()["chunks"] == 3
+
+
+def test_fusion_prefers_keys_ranked_well_by_both_lists():
+    vector = ["a", "b", "c", "d"]
+    keyword = ["c", "e", "a"]
+
+    assert reciprocal_rank_fusion([vector, keyword]) == ["a", "c", "b", "e", "d"]
@@ -0,0 +1,95 @@
+"""
+Chunker: chunk bounds, and headers repeated over chunks of table rows
+"""
+
+from langchain_core.documents import Document
+
+from RAG.chunker import Chunker, char_token_counter
+from RAG.structured_loaders import load_csv
+
+
+def write_wide_csv(path, columns=60, rows=3):
+    names = [f"measurement_column_{i:02d}" for i in range(columns)]
+    lines = [",".join(names)]
+    lines += [",".join(f"{row}.{i:02d}" for i in range(columns)) for row in range(rows)]
+    path.write_text("\n".join(lines) + "\n")
+    return names
+
+
+def test_a_wide_csv_keeps_each_row_in_one_chunk(tmp_path):
+    path = tmp_path / "wide.csv"
+    names = write_wide_csv(path)
+    chunker = Chunker(256, 32, char_token_counter(), tokenizer="chars/3")
+    counter = chunker.token_counter
+
+    chunks = list(chunker.split_documents(load_csv(str(path))))
+
+    # The header alone is over the chunk size, so it is cut to half of it
+    assert counter(",".join(names)) > 256
+    assert len(chunks) == 3
+    for number, chunk in enumerate(chunks, 1):
+        header, row = chunk.page_content.rstrip("\n").split("\n")
+        assert names[0] in header and names[-1] not in header
+        assert counter(header) <= 128
+        assert counter(chunk.page_content) <= 256
+        assert row.startswith(f"{number - 1}.00,") and row.endswith(f"{number - 1}.59")
+        assert chunk.metadata["row_start"] == chunk.metadata["row_end"] == number + 1
+
+
+def test_a_header_that_fits_is_repeated_whole(tmp_path):
+    path = tmp_path / "narrow.csv"
+    path.write_text("name,city\n" + "".join(f"person {i},town {i}\n" for i in range(200)))
+    chunker = Chunker(64, 8, char_token_counter(), tokenizer="chars/3")
+
+    chunks = list(chunker.split_documents(load_csv(str(path))))
+
+    assert len(chunks) > 1
+    assert all(chunk.page_content.startswith("name,city\n") for chunk in chunks)
+    assert all(chunker.token_counter(chunk.page_content) <= 64 for chunk in chunks)
+    # Rows are not split or repeated between chunks
+    rows = [row for chunk in chunks for row in chunk.page_content.rstrip("\n").split("\n")[1:]]
+    assert rows == [f"person {i},town {i}" for i in range(200)]
+
+
+def word_counter(text):
+    return len(text.split())
+
+
+def test_prose_chunks_fit_the_size_and_overlap_their_neighbours():
+    text = " ".join(f"sentence {i} mentions router{i} and its uplink." for i in range(200))
+    chunker = Chunker(40, 10, word_counter, tokenizer="whitespace")
+
+    chunks = list(chunker.split_documents([Document(page_content=text, metadata={"source": "notes.txt"})]))
+
+    assert len(chunks) > 5
+    assert all(word_counter(chunk.page_content) <= 40 for chunk in chunks)
+    assert [chunk.metadata["chunk_index"] for chunk in chunks] == list(range(len(chunks)))
+    for chunk in chunks:
+        start = chunk.metadata["start_index"]
+        assert text[start:start + len(chunk.page_content)] == chunk.page_content
+    for previous, chunk in zip(chunks, chunks[1:]):
+        # Each chunk starts inside the one before it, so nothing falls between them
+        assert chunk.metadata["start_index"] < previous.metadata["start_index"] + len(previous.page_content)
+    assert chunks[-1].page_content.endswith("router199 and its uplink.")
+
+
+def test_markdown_is_cut_at_headings_first():
+    sections = [f"# Section {n}\n\n" + " ".join(f"detail {n}.{i}" for i in range(30)) for n in range(3)]
+    chunker = Chunker(70, 5, word_counter, tokenizer="whitespace")
+
+    chunks = list(chunker.split_documents([Document(page_content="\n".join(sections), metadata={})],
+                                          source="guide.md"))
+
+    assert [chunk.page_content.split("\n")[0] for chunk in chunks] == ["# Section 0", "# Section 1", "# Section 2"]
+
+
+def test_without_a_tokenizer_tokens_are_bounded_by_characters():
+    chunker = Chunker(100, 10)
+    text = "ü" * 1000
+
+    chunks = list(chunker.split_documents([Document(page_content=text, metadata={"source": "a.txt"})]))
+
+    assert chunker.tokenizer == "chars/3"
+    # Two UTF-8 bytes per character, three bytes per token
+    assert all(len(chunk.page_content) <= 150 for chunk in chunks)
+    assert sum(len(chunk.page_content) for chunk in chunks) >= len(text)
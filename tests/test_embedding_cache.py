@@ -0,0 +1,69 @@
+"""
+Embedding cache: vectors by content hash, least recently used evicted over one budget per folder
+"""
+
+import numpy as np
+
+from RAG.embedding_cache import CachedEmbeddings, EmbeddingCache, content_key
+
+DIM = 8
+ROW = DIM * 4
+
+
+def vector(n):
+    return np.full(DIM, n, dtype='float32')
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [vector(len(text)).tolist() for text in texts]
+
+    def embed_query(self, text):
+        self.embedded.append(text)
+        return vector(-len(text)).tolist()
+
+
+def test_only_texts_missing_from_the_cache_are_embedded(tmp_path):
+    model = CountingEmbeddings()
+    embeddings = CachedEmbeddings(model, "test-model", EmbeddingCache(str(tmp_path)))
+
+    first = embeddings.embed_documents(["a", "bb", "a"])
+    again = embeddings.embed_documents(["bb", "ccc"])
+    query = embeddings.embed_query("a")
+
+    assert model.embedded == ["a", "bb", "ccc", "a"]
+    assert first == [vector(1).tolist(), vector(2).tolist(), vector(1).tolist()]
+    assert again == [vector(2).tolist(), vector(3).tolist()]
+    assert query == vector(-1).tolist()
+    reopened = CachedEmbeddings(CountingEmbeddings(), "test-model", EmbeddingCache(str(tmp_path)))
+    assert reopened.embed_documents(["ccc"]) == [vector(3).tolist()] and not reopened.embeddings.embedded
+
+
+def test_the_least_recently_used_vectors_are_evicted_over_budget(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), max_bytes=3 * ROW)
+    cache.put_many("m", [(content_key(str(n)), vector(n)) for n in range(3)])
+    cache.get_many("m", [content_key("0")])
+
+    cache.put_many("m", [(content_key("3"), vector(3))])
+
+    assert sorted(cache.get_many("m", [content_key(str(n)) for n in range(4)])) == sorted(
+        content_key(str(n)) for n in (0, 2, 3))
+    stats = cache.stats()
+    assert stats["entries"] == 3 and stats["bytes"] == 3 * ROW and stats["evictions"] == 1
+
+
+def test_caches_on_one_folder_share_its_budget(tmp_path):
+    server = EmbeddingCache(str(tmp_path), max_bytes=4 * ROW)
+    local = EmbeddingCache(str(tmp_path), max_bytes=4 * ROW)
+
+    server.put_many("m", [(content_key(f"s{n}"), vector(n)) for n in range(3)])
+    local.put_many("m", [(content_key(f"l{n}"), vector(n)) for n in range(3)])
+
+    assert server.stats()["bytes"] == local.stats()["bytes"] == 4 * ROW
+    assert server.stats()["entries"] == 4
+    found = local.get_many("m", [content_key(f"l{n}") for n in range(3)])
+    assert [found[content_key(f"l{n}")].tolist() for n in range(3)] == [vector(n).tolist() for n in range(3)]
@@ -0,0 +1,101 @@
+"""
+Background ingestion: uploads indexed by worker threads, files changed on disk picked up by rescans
+"""
+
+import time
+
+import pytest
+from langchain_core.documents import Document
+
+pytest.importorskip("langchain_community")
+
+from RAG.ingest import IngestionQueue
+from RAG.parsing import ParseError
+from RAG.vector_index import VectorIndex
+from tests.stub_ollama import fake_embedding
+
+DIM = 16
+
+
+class FakeEmbeddings:
+    def embed_documents(self, texts):
+        return [fake_embedding(text, DIM) for text in texts]
+
+    def embed_query(self, text):
+        return fake_embedding(text, DIM)
+
+
+def read_text(path):
+    """A parser for plain text; files starting with "broken" cannot be parsed"""
+    with open(path) as f:
+        text = f.read()
+    if text.startswith("broken"):
+        raise ParseError("broken file")
+    return [Document(page_content=text, metadata={"source": path})]
+
+
+@pytest.fixture
+def uploads(tmp_path):
+    folder = tmp_path / "uploads"
+    folder.mkdir()
+    return folder
+
+
+def make_queue(tmp_path, uploads, **options):
+    index = VectorIndex(str(uploads), str(tmp_path / "index"), FakeEmbeddings(), "fake", parser=read_text)
+    return IngestionQueue(index, workers=2).start(**options)
+
+
+def wait_for(queue, rel_path, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.status(rel_path)
+        if job and job["state"] in ("done", "unchanged", "removed", "failed"):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(f"{rel_path} was not ingested")
+
+
+def test_files_are_indexed_in_the_background_and_reported(tmp_path, uploads):
+    queue = make_queue(tmp_path, uploads, scan=False)
+    (uploads / "notes.txt").write_text("the router raised ERR_042")
+    (uploads / "broken.txt").write_text("broken beyond repair")
+
+    assert queue.submit("notes.txt")["state"] == "queued"
+    queue.submit("broken.txt")
+
+    assert wait_for(queue, "notes.txt")["state"] == "done"
+    failed = wait_for(queue, "broken.txt")
+    assert failed["state"] == "failed" and "broken file" in failed["error"]
+    assert queue.vector_index.search("ERR_042", k=1, mode="keyword")[0].page_content == "the router raised ERR_042"
+    assert queue.submit("notes.txt") and wait_for(queue, "notes.txt")["state"] == "unchanged"
+    assert queue.pending() == 0
+
+
+def test_files_changed_on_disk_are_picked_up_by_a_rescan(tmp_path, uploads):
+    (uploads / "offline.txt").write_text("written while the server was down")
+    queue = make_queue(tmp_path, uploads, rescan_interval=0.2)
+    assert wait_for(queue, "offline.txt")["state"] == "done"
+
+    (uploads / "copied.txt").write_text("copied into the folder by hand")
+    (uploads / "offline.txt").unlink()
+
+    assert wait_for(queue, "copied.txt")["state"] == "done"
+    assert wait_for(queue, "offline.txt")["state"] == "removed"
+    assert sorted(queue.vector_index.manifest) == ["copied.txt"]
+
+
+def test_a_file_uploaded_again_before_its_job_starts_is_ingested_once(tmp_path, uploads):
+    index = VectorIndex(str(uploads), str(tmp_path / "index"), FakeEmbeddings(), "fake", parser=read_text)
+    queue = IngestionQueue(index, workers=1)
+    (uploads / "notes.txt").write_text("first version")
+    first = queue.submit("notes.txt")
+    (uploads / "notes.txt").write_text("second version")
+    again = queue.submit("notes.txt")
+
+    queue.start(scan=False)
+
+    assert first["queued_at"] == again["queued_at"]
+    job = wait_for(queue, "notes.txt")
+    assert job["state"] == "done" and job["chunks"] == 1 and job["progress"] == 1.0
+    assert [document.page_content for document in index.search("version", k=5, mode="keyword")] == ["second version"]
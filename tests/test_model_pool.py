@@ -0,0 +1,88 @@
+"""
+Model pool: loads shared between callers, and callers not left waiting on a load that failed
+"""
+
+import threading
+import time
+
+import pytest
+
+from RAG.model_pool import ModelPool
+
+
+class FakeModel:
+    def __init__(self, name):
+        self.name = name
+
+
+def make_pool(tmp_path, load=FakeModel):
+    def path_for(name):
+        return str(tmp_path / f"{name}.gguf")
+
+    return ModelPool(load, path_for, budget_bytes=1024 * 1024 * 1024, idle_ttl=0)
+
+
+def test_concurrent_callers_share_one_load(tmp_path):
+    (tmp_path / "chat.gguf").write_bytes(b"\0" * 1024)
+    loads = []
+
+    def load(name):
+        loads.append(name)
+        time.sleep(0.2)
+        return FakeModel(name)
+
+    pool = make_pool(tmp_path, load)
+    models = []
+    callers = [threading.Thread(target=lambda: models.append(pool._acquire("chat"))) for _ in range(4)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+    assert loads == ["chat"]
+    assert len({id(model) for model in models}) == 1
+
+
+def test_a_model_whose_size_cannot_be_read_fails_every_caller_instead_of_blocking_them(tmp_path):
+    pool = make_pool(tmp_path)
+    with pytest.raises(FileNotFoundError):
+        with pool.use("missing"):
+            pass
+
+    errors = []
+
+    def call():
+        try:
+            with pool.use("missing"):
+                pass
+        except FileNotFoundError as e:
+            errors.append(e)
+
+    callers = [threading.Thread(target=call, daemon=True) for _ in range(3)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join(timeout=5)
+    assert not any(caller.is_alive() for caller in callers)
+    assert len(errors) == 3
+
+    # Once the file appears the model loads normally
+    (tmp_path / "missing.gguf").write_bytes(b"\0" * 1024)
+    with pool.use("missing") as model:
+        assert model.name == "missing"
+
+
+def test_memory_held_with_a_model_counts_towards_its_size(tmp_path):
+    (tmp_path / "chat.gguf").write_bytes(b"\0" * 1024)
+    sizes = []
+
+    def draft_bytes(name, model):
+        # Known from the loaded model once there is one, estimated before
+        return 300 if model is not None else 200
+
+    pool = ModelPool(FakeModel, lambda name: str(tmp_path / f"{name}.gguf"), budget_bytes=1024 * 1024 * 1024,
+                     idle_ttl=0, kv_bytes_per_token=1, n_ctx=10, extra_bytes=50, extra_for=draft_bytes)
+    sizes.append(pool.estimate_bytes("chat"))
+    with pool.use("chat"):
+        sizes.append(pool.stats()["resident"]["chat"]["bytes"])
+
+    assert sizes == [1024 + 10 + 50 + 200, 1024 + 10 + 50 + 300]
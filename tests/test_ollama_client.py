@@ -0,0 +1,91 @@
+"""
+Pooled Ollama client: keep_alive, connection reuse, warm-up and bounded embedding concurrency
+"""
+
+import threading
+import time
+
+import ollama
+import pytest
+
+from tests.stub_ollama import fake_embedding
+from RAG.ollama_client import OllamaBatchEmbeddings, OllamaService
+
+
+def test_embeddings_come_back_in_order_from_batched_requests(make_stub):
+    stub = make_stub()
+    embeddings = OllamaBatchEmbeddings("emb", host=stub.url, batch_size=3, max_concurrency=2)
+    texts = [f"text {i}" for i in range(10)]
+    assert embeddings.embed_documents(texts) == [fake_embedding(text, 8) for text in texts]
+    assert stub.requests == 4
+    assert embeddings.stats()["texts"] == 10
+
+
+def test_embedding_requests_in_flight_stay_bounded_across_callers(make_stub):
+    stub = make_stub(latency=0.05)
+    embeddings = OllamaBatchEmbeddings("emb", host=stub.url, batch_size=1, max_concurrency=3)
+    callers = [threading.Thread(target=embeddings.embed_documents, args=([f"{n}-{i}" for i in range(6)],))
+               for n in range(3)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+    assert stub.requests == 18
+    assert stub.max_in_flight == 3
+
+
+def test_requests_carry_keep_alive_and_share_one_connection(make_stub):
+    stub = make_stub()
+    service = OllamaService(stub.url, keep_alive="30m", model_keep_alive={"pinned": -1})
+    service.generate("chat", "hello")
+    service.generate("pinned", "hello")
+    service.embed("chat", ["hello"])
+    assert stub.keep_alives == [("chat", "30m"), ("pinned", -1), ("chat", "30m")]
+    assert stub.connections == 1
+
+
+def test_warm_up_loads_each_model_once_and_reports_failures(make_stub):
+    stub = make_stub(load_latency=0.2, models={"chat", "emb"})
+    service = OllamaService(stub.url)
+    service.warm_up(["chat", "missing"], ["emb"], background=False)
+    warmup = service.stats()["warmup"]
+    assert warmup["chat"]["status"] == "ready"
+    assert warmup["emb"]["status"] == "ready"
+    assert warmup["missing"]["status"] == "failed"
+    assert stub.loads == 2
+
+    # The first real request finds the model loaded
+    service.generate("chat", "hello")
+    assert stub.loads == 2
+    assert service.stats()["model_loads"] == 2
+
+
+def test_batches_of_one_call_are_sent_at_once(make_stub):
+    stub = make_stub(latency=0.2)
+    embeddings = OllamaBatchEmbeddings("emb", host=stub.url, batch_size=2, max_concurrency=4)
+
+    start = time.perf_counter()
+    vectors = embeddings.embed_documents([f"text {i}" for i in range(8)])
+    elapsed = time.perf_counter() - start
+
+    assert len(vectors) == 8 and stub.requests == 4 and stub.max_in_flight == 4
+    # Four requests of 0.2s each, overlapping instead of taking 0.8s one after another
+    assert elapsed < 0.6
+    assert embeddings.embed_documents([]) == [] and stub.requests == 4
+    assert embeddings.embed_query("question") == fake_embedding("question", 8) and stub.requests == 5
+
+
+def test_a_streamed_answer_counts_the_model_load_and_failures(make_stub):
+    stub = make_stub(load_latency=0.2, answer_tokens=3)
+    service = OllamaService(stub.url, keep_alive="5m")
+
+    chunks = list(service.generate("chat", "hello", stream=True))
+
+    assert "".join(chunk["response"] for chunk in chunks) == "word0 word1 word2 "
+    assert chunks[-1]["done"] and stub.keep_alives == [("chat", "5m")]
+    assert service.stats()["model_loads"] == 1 and service.stats()["requests"] == 1
+
+    stub.fail = True
+    with pytest.raises(ollama.ResponseError):
+        list(service.generate("chat", "hello", stream=True))
+    assert service.stats()["errors"] == 1
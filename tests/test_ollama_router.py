@@ -0,0 +1,94 @@
+"""
+Routing across Ollama hosts: least-in-flight choice, model affinity, failover and health
+"""
+
+import threading
+
+import ollama
+import pytest
+
+from RAG.ollama_client import OllamaService
+from RAG.ollama_router import OllamaRouter
+
+
+def make_router(stubs, **options):
+    return OllamaRouter([OllamaService(stub.url) for stub in stubs], health_interval=0, **options)
+
+
+def test_concurrent_requests_spread_over_the_least_busy_hosts(make_stub):
+    stubs = [make_stub(latency=0.3), make_stub(latency=0.3)]
+    router = make_router(stubs)
+    requests = [threading.Thread(target=router.generate, args=("chat", "hello")) for _ in range(4)]
+    for request in requests:
+        request.start()
+    for request in requests:
+        request.join()
+    assert [stub.requests for stub in stubs] == [2, 2]
+    assert all(host["in_flight"] == 0 for host in router.stats()["hosts"].values())
+
+
+def test_hosts_with_the_model_loaded_are_preferred(make_stub):
+    stubs = [make_stub(), make_stub()]
+    router = make_router(stubs)
+    router.backends[1].service.generate("chat", "")
+    for backend in router.backends:
+        backend.check()
+    for _ in range(3):
+        router.generate("chat", "hello")
+    assert stubs[0].requests == 0
+    assert stubs[1].requests == 4
+
+
+def test_a_failing_host_is_skipped_until_it_is_healthy_again(make_stub):
+    first, second = make_stub(), make_stub()
+    router = make_router([first, second])
+    first.fail = True
+    assert router.generate("chat", "hello")["response"]
+    hosts = router.stats()["hosts"]
+    assert hosts[first.url]["failovers"] == 1
+    assert not hosts[first.url]["healthy"]
+    assert hosts[second.url]["requests"] == 1
+
+    router.generate("chat", "hello")
+    assert router.stats()["hosts"][first.url]["requests"] == 1
+
+    first.fail = False
+    router.backends[0].check()
+    assert router.backends[0].healthy
+
+
+def test_a_model_missing_on_one_host_does_not_mark_it_down(make_stub):
+    first, second = make_stub(models={"other"}), make_stub()
+    router = make_router([first, second])
+    router.generate("chat", "hello")
+    assert router.backends[0].errors == 1
+    assert router.backends[0].healthy
+    assert second.requests == 1
+
+
+def test_streams_fail_over_before_their_first_chunk(make_stub):
+    first, second = make_stub(), make_stub()
+    router = make_router([first, second])
+    first.fail = True
+    text = "".join(chunk["response"] for chunk in router.generate("chat", "hello", stream=True))
+    assert text.split() == [f"word{i}" for i in range(16)]
+    assert second.requests == 1
+
+
+def test_the_error_surfaces_when_every_host_fails(make_stub):
+    stubs = [make_stub(), make_stub()]
+    router = make_router(stubs)
+    for stub in stubs:
+        stub.fail = True
+    with pytest.raises(ollama.ResponseError):
+        router.generate("chat", "hello")
+    assert all(backend.requests == 1 for backend in router.backends)
+
+
+def test_warm_up_spreads_models_over_the_hosts(make_stub):
+    stubs = [make_stub(), make_stub()]
+    router = make_router(stubs)
+    router.warm_up(["first", "second"], background=False)
+    warmup = router.stats()["warmup"]
+    assert warmup["first"]["status"] == warmup["second"]["status"] == "ready"
+    assert {warmup["first"]["host"], warmup["second"]["host"]} == {stub.url for stub in stubs}
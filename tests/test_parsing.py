@@ -0,0 +1,71 @@
+"""
+Parser pool: documents streamed from worker processes started on demand, failures kept to their file
+"""
+
+import os
+import time
+
+import pytest
+from langchain_core.documents import Document
+
+from RAG.parsing import ParseError, ParserPool, ParseTimeout
+
+
+def line_loader(path):
+    """One document per line; a file named hang.txt never finishes and bad.txt fails"""
+    name = os.path.basename(path)
+    if name == "hang.txt":
+        while True:
+            time.sleep(1)
+    if name == "bad.txt":
+        raise ValueError("unreadable")
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            yield Document(page_content=line.rstrip("\n"), metadata={"source": path, "line": number})
+
+
+def write(tmp_path, name, lines=3):
+    path = tmp_path / name
+    path.write_text("".join(f"{name} line {i}\n" for i in range(lines)))
+    return str(path)
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(workers=2, timeout=30.0):
+        pool = ParserPool(workers, timeout, loader=line_loader)
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.close()
+
+
+def test_workers_start_only_when_files_arrive(tmp_path, make_pool):
+    pool = make_pool(workers=2)
+    assert pool.stats()["started"] == 0
+
+    for _ in range(3):
+        documents = list(pool.parse(write(tmp_path, "a.txt", lines=5)))
+    assert [document.page_content for document in documents] == [f"a.txt line {i}" for i in range(5)]
+    assert pool.stats()["started"] == 1
+
+    results = sorted(pool.parse_many([write(tmp_path, f"{n}.txt") for n in range(6)]))
+    assert [len(documents) for _, documents, _ in results] == [3] * 6
+    assert pool.stats()["started"] <= 2 and pool.stats()["files"] == 9
+
+
+def test_a_hanging_or_failing_file_fails_on_its_own(tmp_path, make_pool):
+    pool = make_pool(workers=1, timeout=1.0)
+
+    with pytest.raises(ParseTimeout):
+        list(pool.parse(write(tmp_path, "hang.txt")))
+    with pytest.raises(ParseError, match="ValueError: unreadable"):
+        list(pool.parse(write(tmp_path, "bad.txt")))
+    assert len(list(pool.parse(write(tmp_path, "good.txt")))) == 3
+
+    stats = pool.stats()
+    assert stats["files"] == 3 and stats["failures"] == 2 and stats["timeouts"] == 1
@@ -0,0 +1,62 @@
+"""
+Prompt states on disk: snapshots round-trip, and a changed model or context drops them
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+
+from RAG.prompt_states import PromptStateStore
+
+PARAMS = {"n_ctx": 2048, "llama_cpp": "0.3.0"}
+
+
+def make_state(tokens):
+    return SimpleNamespace(
+        input_ids=np.asarray(tokens, dtype=np.intc),
+        scores=np.random.default_rng(0).random((len(tokens), 4), dtype=np.float32),
+        n_tokens=len(tokens),
+        llama_state=bytes(range(len(tokens) * 8)),
+    )
+
+
+def test_a_snapshot_is_restored_as_it_was_saved(tmp_path):
+    model = tmp_path / "model.gguf"
+    model.write_bytes(b"weights")
+    store = PromptStateStore(str(tmp_path / "states"))
+    fingerprint = store.fingerprint(str(model), PARAMS)
+    saved = make_state([1, 2, 3, 4])
+
+    assert store.save(fingerprint, "model", PARAMS, "system/rag", [1, 2, 3, 4], saved) > 0
+
+    [(name, tokens, state)] = list(PromptStateStore(str(tmp_path / "states")).load(fingerprint, "model",
+                                                                                   SimpleNamespace))
+    assert name == "system/rag" and tokens == [1, 2, 3, 4]
+    assert state.input_ids.tolist() == [1, 2, 3, 4] and state.n_tokens == 4
+    assert np.array_equal(state.scores, saved.scores)
+    assert state.llama_state == saved.llama_state and state.llama_state_size == len(saved.llama_state)
+
+    store.remove(fingerprint, "system/rag")
+    assert list(store.load(fingerprint, "model", SimpleNamespace)) == []
+
+
+def test_snapshots_of_a_changed_model_or_context_are_deleted(tmp_path):
+    model = tmp_path / "model.gguf"
+    model.write_bytes(b"weights")
+    store = PromptStateStore(str(tmp_path / "states"))
+    old = store.fingerprint(str(model), PARAMS)
+    store.save(old, "model", PARAMS, "system", [1, 2], make_state([1, 2]))
+    other_model = tmp_path / "other.gguf"
+    other_model.write_bytes(b"other weights")
+    other = store.fingerprint(str(other_model), PARAMS)
+    store.save(other, "other-model", PARAMS, "system", [1, 2], make_state([1, 2]))
+
+    assert store.fingerprint(str(model), dict(PARAMS, n_ctx=4096)) != old
+    model.write_bytes(b"retrained weights")
+    new = store.fingerprint(str(model), PARAMS)
+    assert new != old
+
+    assert list(store.load(new, "model", SimpleNamespace)) == []
+    assert not (tmp_path / "states" / old).exists()
+    # Another model's snapshots are left alone
+    assert [name for name, _, _ in store.load(other, "other-model", SimpleNamespace)] == ["system"]
@@ -0,0 +1,42 @@
+"""
+Response cache: exact and similar questions hit, other models, new index versions and old entries miss
+"""
+
+import time
+
+from RAG.response_cache import ResponseCache
+
+MODEL = ("gemma3", "hybrid")
+
+
+def test_the_same_or_a_similar_question_is_answered_from_the_cache():
+    cache = ResponseCache(threshold=0.95)
+    cache.put(MODEL, 1, "What does ERR_042 mean?", [1.0, 0.0, 0.1], "The uplink went down.")
+
+    assert cache.get(MODEL, 1, "  what does err_042   MEAN? ") == "The uplink went down."
+    assert cache.get(MODEL, 1, "Meaning of ERR_042?", [0.99, 0.0, 0.12]) == "The uplink went down."
+    assert cache.get(MODEL, 1, "How do I reset the switch?", [0.0, 1.0, 0.0]) is None
+    assert cache.get(("llama2", "hybrid"), 1, "What does ERR_042 mean?") is None
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 2
+
+
+def test_a_new_index_version_drops_every_answer():
+    cache = ResponseCache()
+    cache.put(MODEL, 1, "question", None, "old answer")
+
+    assert cache.get(MODEL, 2, "question") is None
+    assert cache.stats()["invalidations"] == 1 and cache.stats()["entries"] == 0
+
+
+def test_entries_expire_and_the_least_recently_used_are_evicted():
+    cache = ResponseCache(max_entries=2, ttl=0.2)
+    cache.put(MODEL, 1, "first", None, "1")
+    cache.put(MODEL, 1, "second", None, "2")
+    cache.get(MODEL, 1, "first")
+    cache.put(MODEL, 1, "third", None, "3")
+
+    assert [cache.get(MODEL, 1, text) for text in ("first", "second", "third")] == ["1", None, "3"]
+    assert cache.stats()["evictions"] == 1
+
+    time.sleep(0.3)
+    assert cache.get(MODEL, 1, "first") is None and cache.stats()["entries"] == 0
@@ -0,0 +1,111 @@
+"""
+Fair-share scheduler: incremental detokenizing, time slices and a fair share per client
+"""
+
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pytest
+
+pytest.importorskip("llama_cpp")
+
+from RAG.scheduler import FairShareScheduler
+
+EOS = 2
+# "é" is two UTF-8 bytes, each decoded from a token of its own
+TOKEN_BYTES = {1000: b"\xc3", 1001: b"\xa9"}
+
+
+class FakeState:
+    def __init__(self, input_ids, n_tokens):
+        self.input_ids = input_ids
+        self.n_tokens = n_tokens
+        self.scores = np.zeros(0, dtype='float32')
+        self.llama_state_size = 64
+
+
+class FakeLlama:
+    """Answers a prompt "<n>" with n tokens alternating between the two halves of "é" """
+
+    def __init__(self):
+        self.input_ids = np.zeros(4096, dtype='intc')
+        self.n_tokens = 0
+        self.cache = None
+        self.draft_model = None
+        self.detokenized = []
+
+    def tokenize(self, text):
+        return [int(text.decode())]
+
+    def token_eos(self):
+        return EOS
+
+    def n_ctx(self):
+        return len(self.input_ids)
+
+    def detokenize(self, tokens):
+        self.detokenized.append(len(tokens))
+        return b"".join(TOKEN_BYTES[token] for token in tokens)
+
+    def save_state(self):
+        return FakeState(self.input_ids.copy(), self.n_tokens)
+
+    def load_state(self, state):
+        self.input_ids, self.n_tokens = state.input_ids.copy(), state.n_tokens
+
+    def generate(self, tokens):
+        self.input_ids[:len(tokens)] = tokens
+        self.n_tokens = len(tokens)
+        while True:
+            generated = self.n_tokens - 1
+            token = EOS if generated >= self.input_ids[0] else 1000 + generated % 2
+            yield token
+            self.input_ids[self.n_tokens] = token
+            self.n_tokens += 1
+
+
+def make_scheduler(**options):
+    """A scheduler over a FakeLlama that starts decoding only once start is set"""
+    llm = FakeLlama()
+    start = threading.Event()
+
+    @contextmanager
+    def use_model(name):
+        start.wait()
+        yield llm
+
+    return FairShareScheduler(use_model, "fake", **options), llm, start
+
+
+def test_answers_are_detokenized_one_new_token_at_a_time():
+    scheduler, llm, start = make_scheduler()
+    start.set()
+
+    assert scheduler.submit("40").result() == "é" * 20
+    assert set(llm.detokenized) == {1}
+
+
+def test_a_long_answer_does_not_hold_up_a_short_one():
+    scheduler, _, start = make_scheduler(quantum=4, slice_tokens=8)
+    long = scheduler.submit("400")
+    short = scheduler.submit("8")
+    start.set()
+
+    assert short.result() == "é" * 4
+    assert long.result() == "é" * 200
+    assert short.finished_at < long.finished_at
+    assert scheduler.stats()["context_switches"] >= 1
+
+
+def test_a_client_with_many_requests_does_not_starve_the_others():
+    scheduler, _, start = make_scheduler(max_active=1)
+    busy = [scheduler.submit("20", client="busy") for _ in range(3)]
+    other = scheduler.submit("20", client="other")
+    start.set()
+
+    for request in busy + [other]:
+        request.result()
+    order = sorted(busy + [other], key=lambda request: request.finished_at)
+    assert order == [busy[0], other, busy[1], busy[2]]
+    assert scheduler.stats()["completed"] == 4
@@ -0,0 +1,144 @@
+"""
+Scatter-gather over SDRServer shards running as local processes, backed by a stub Ollama
+"""
+
+import io
+import socket
+import time
+
+import httpx
+import pytest
+
+pytest.importorskip("langchain_community")
+
+from benchmarks.bench_sharding import start_server, wait_until_up
+from tests.stub_ollama import start_stub_server
+from RAG.sharding import ShardCoordinator, decode_matches, shard_for
+
+DOCUMENTS = {f"doc{i}.txt": f"shardword{i} appears only in document number {i}" for i in range(8)}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def shard_urls(count):
+    """URLs on free ports, picked again until every shard owns some of DOCUMENTS"""
+    while True:
+        urls = [f"http://127.0.0.1:{free_port()}" for _ in range(count)]
+        if {shard_for(filename, urls) for filename in DOCUMENTS} == set(urls):
+            return urls
+
+
+def wait_for_ingestion(coordinator, filename, timeout=60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = coordinator.ingest_status(filename)
+        if status["state"] == "done":
+            return
+        assert status["state"] != "failed", status
+        time.sleep(0.1)
+    raise TimeoutError(f"{filename} was not indexed")
+
+
+@pytest.fixture(scope="module")
+def shards(tmp_path_factory):
+    """Two shard servers holding DOCUMENTS, and a coordinator over them
+
+    Yields (coordinator, shard URLs, shard processes). Tests may stop
+    shards, so the ones doing so come last in this module.
+    """
+    stub = start_stub_server(latency=0.0, per_item=0.0, dim=16, load_latency=0.0)
+    folder = tmp_path_factory.mktemp("shards")
+    processes, urls = [], shard_urls(2)
+    try:
+        for i, url in enumerate(urls):
+            port = int(url.rsplit(":", 1)[1])
+            processes.append(start_server(port, str(folder / f"shard{i}"), {"OLLAMA_HOST": stub.url}))
+        for url in urls:
+            wait_until_up(url)
+        coordinator = ShardCoordinator(urls, timeout=5.0)
+        for filename, text in DOCUMENTS.items():
+            coordinator.upload(filename, io.BytesIO(text.encode("utf-8")), "text/plain")
+        for filename in DOCUMENTS:
+            wait_for_ingestion(coordinator, filename)
+        yield coordinator, urls, processes
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        stub.shutdown()
+        stub.server_close()
+
+
+def test_each_upload_lands_on_the_shard_that_owns_it(shards):
+    _, urls, _ = shards
+    for filename in DOCUMENTS:
+        owner = shard_for(filename, urls)
+        for url in urls:
+            status = httpx.get(url + "/ingest/status", params={"file": filename}).status_code
+            assert status == (200 if url == owner else 404)
+
+
+def test_keyword_search_finds_documents_on_every_shard(shards):
+    coordinator, _, _ = shards
+    for i, text in enumerate(DOCUMENTS.values()):
+        documents = coordinator.search(f"shardword{i}", k=1, mode="keyword")
+        assert [document.page_content for document in documents] == [text]
+
+
+def test_merged_vector_ranking_matches_one_index_over_all_shards(shards):
+    coordinator, urls, _ = shards
+    query = next(iter(DOCUMENTS.values()))
+    # What a single index holding every shard's chunks would return: the best distances of all shards
+    matches = []
+    for url in urls:
+        reply = httpx.post(url + "/shard/search", json={"query": query, "k": 5, "mode": "vector"}).json()
+        matches.extend(decode_matches(reply["results"])["vector"])
+    expected = [document.page_content for _, document in sorted(matches, key=lambda match: match[0])[:5]]
+
+    documents = coordinator.search(query, k=5, mode="vector")
+    assert [document.page_content for document in documents] == expected
+    assert documents[0].page_content == query
+
+
+def test_versions_come_from_search_replies(shards):
+    coordinator, urls, _ = shards
+    coordinator.search("shardword1", k=1, mode="keyword")
+    requests = {url: stats["requests"] for url, stats in coordinator.stats()["shards"].items()}
+    versions = coordinator.version()
+    assert [shard for shard, _ in versions] == urls
+    assert all(version is not None for _, version in versions)
+    assert {url: stats["requests"] for url, stats in coordinator.stats()["shards"].items()} == requests
+
+
+def test_answers_come_from_the_remaining_shards_when_one_is_down(shards):
+    coordinator, urls, processes = shards
+    processes[1].terminate()
+    processes[1].wait()
+    alive = [text for filename, text in DOCUMENTS.items() if shard_for(filename, urls) == urls[0]]
+    partial = coordinator.partial_searches
+
+    documents = coordinator.search("document number", k=len(DOCUMENTS), mode="keyword")
+    assert sorted(document.page_content for document in documents) == sorted(alive)
+    assert coordinator.partial_searches == partial + 1
+    assert list(coordinator.stats()["last_search"]["missing"]) == [urls[1]]
+
+
+def test_search_fails_only_when_no_shard_answers(shards):
+    coordinator, _, processes = shards
+    processes[0].terminate()
+    processes[0].wait()
+    with pytest.raises(RuntimeError, match="No index shard answered"):
+        coordinator.search("shardword0", k=1, mode="keyword")
+
+
+def test_a_coordinator_refuses_to_list_its_own_server_as_a_shard():
+    with pytest.raises(ValueError):
+        ShardCoordinator(["http://127.0.0.1:9000", "http://localhost:9001/"], self_url="http://localhost:9000")
+    with pytest.raises(ValueError):
+        ShardCoordinator(["http://127.0.0.1:80"], self_url="http://0.0.0.0")
+    coordinator = ShardCoordinator(["http://127.0.0.1:9001", "http://localhost:9002"], self_url="http://localhost:9000")
+    assert coordinator.shards == ["http://127.0.0.1:9001", "http://localhost:9002"]
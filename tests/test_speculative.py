@@ -0,0 +1,75 @@
+"""
+Speculative decoding drafts: prompt lookup, a draft model, and the accepted-token counts per request
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip("llama_cpp")
+
+from RAG.speculative import LlamaDraft, make_draft
+
+
+class FixedDraft:
+    def __init__(self, size):
+        self.size = size
+
+    def __call__(self, input_ids, **kwargs):
+        return np.arange(self.size, dtype=np.intc)
+
+
+class FakeDraftLlama:
+    """Continues any context with 100, 101, 102, ..."""
+
+    def __init__(self):
+        self.contexts = []
+        self.closed = False
+
+    def generate(self, tokens, temp):
+        self.contexts.append(tokens)
+        try:
+            token = 100
+            while True:
+                yield token
+                token += 1
+        finally:
+            self.closed = True
+
+
+def test_prompt_lookup_drafts_what_followed_the_last_ngram():
+    draft = make_draft("prompt_lookup", num_pred_tokens=2)
+
+    assert draft(np.array([5, 6, 7, 8, 5, 6, 7], dtype=np.intc)).tolist() == [8, 5]
+    assert draft(np.array([1, 2, 3], dtype=np.intc)).tolist() == []
+
+
+def test_a_draft_model_proposes_its_greedy_continuation():
+    llm = FakeDraftLlama()
+    draft = make_draft("model", num_pred_tokens=3, draft_llm=llm)
+
+    assert isinstance(draft.draft, LlamaDraft)
+    assert draft(np.array([1, 2], dtype=np.intc)).tolist() == [100, 101, 102]
+    assert llm.contexts == [[1, 2]] and llm.closed
+
+
+def test_accepted_tokens_are_counted_from_the_growth_of_the_context():
+    draft = make_draft("prompt_lookup")
+    draft.draft = FixedDraft(4)
+    request = SimpleNamespace(verify_passes=0, drafted_tokens=0, accepted_tokens=0)
+    draft.begin(request)
+
+    draft(np.zeros(10, dtype=np.intc))
+    # Two of the four drafted tokens were accepted, plus the one the main model sampled
+    draft(np.zeros(13, dtype=np.intc))
+    # All four accepted
+    draft(np.zeros(18, dtype=np.intc))
+
+    assert (request.verify_passes, request.drafted_tokens, request.accepted_tokens) == (3, 8, 6)
+
+    # A new request starts counting afresh
+    other = SimpleNamespace(verify_passes=0, drafted_tokens=0, accepted_tokens=0)
+    draft.begin(other)
+    draft(np.zeros(30, dtype=np.intc))
+    assert (other.verify_passes, other.drafted_tokens, other.accepted_tokens) == (1, 0, 0)
@@ -0,0 +1,72 @@
+"""
+Answers streamed from /query as Server-Sent Events by a server process backed by a stub Ollama
+"""
+
+import json
+import socket
+import time
+
+import httpx
+import pytest
+
+pytest.importorskip("langchain_community")
+
+from benchmarks.bench_sharding import start_server, wait_until_up
+from tests.stub_ollama import start_stub_server
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    stub = start_stub_server(latency=0.0, per_item=0.1, dim=16, load_latency=0.0, answer_tokens=5)
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = start_server(port, str(tmp_path_factory.mktemp("streaming") / "server"), {"OLLAMA_HOST": stub.url})
+    try:
+        url = f"http://127.0.0.1:{port}"
+        wait_until_up(url)
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
+        stub.shutdown()
+        stub.server_close()
+
+
+def stream_events(url, payload):
+    """(event, data, seconds since the request) of each event in the response"""
+    start = time.perf_counter()
+    events = []
+    with httpx.stream("POST", url + "/query", json=dict(payload, stream=True), timeout=30.0) as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        event = None
+        for line in response.iter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                events.append((event, json.loads(line[len("data: "):]), time.perf_counter() - start))
+    return events
+
+
+def test_tokens_arrive_as_they_are_generated(server):
+    events = stream_events(server, {"query": "what is on the uplink?", "model": "llama2"})
+
+    tokens = [event for event in events if event[0] == "token"]
+    assert "".join(data["token"] for _, data, _ in tokens) == "".join(f"word{i} " for i in range(5))
+    assert events[-1][:2] == ("done", {})
+    # The stub spaces its tokens 0.1s apart; the first is not held back until the last
+    assert tokens[-1][2] - tokens[0][2] >= 0.3
+
+
+def test_a_repeated_question_streams_the_cached_answer(server):
+    stream_events(server, {"query": "which VLAN is the uplink on?", "model": "llama2"})
+
+    events = stream_events(server, {"query": "Which VLAN is the uplink on?", "model": "llama2"})
+
+    assert [event for event, _, _ in events] == ["token", "done"]
+    assert events[0][1]["token"] == "".join(f"word{i} " for i in range(5))
+
+
+def test_a_bad_request_fails_before_streaming(server):
+    response = httpx.post(server + "/query", json={"query": "hello", "model": "missing", "stream": True})
+    assert response.status_code == 500 and "not available" in response.json()["error"]
@@ -0,0 +1,91 @@
+"""
+Streaming structured loaders: records, row numbers and bounded memory on the shapes that once broke them
+"""
+
+import os
+import zipfile
+
+from RAG import structured_loaders
+from RAG.chunker import Chunker
+from RAG.structured_loaders import load_csv, load_json, load_xlsx, load_xml, xml_records
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def fixture(name):
+    return os.path.join(FIXTURES, name)
+
+
+def test_csv_rows_are_numbered_by_their_line_in_the_file():
+    (chunk,) = Chunker().split_documents(load_csv(fixture("people.csv")))
+
+    header, *lines = chunk.page_content.rstrip("\n").split("\n")
+    rows = {line: chunk.metadata["row_start"] + i for i, line in enumerate(lines) if line}
+    # Blank lines are left out but still counted; a quoted value spans two lines
+    assert header == "name,city,notes"
+    assert rows == {"Ada,London,first": 2, "Grace,New York,line one line two": 4, "Linus,Helsinki,last": 8}
+    assert chunk.metadata["row_end"] == 8
+
+
+def test_json_records_are_array_elements_then_the_remaining_fields():
+    (document,) = load_json(fixture("inventory.json"))
+    assert document.page_content.split("\n") == [
+        "devices.id: 1; devices.name: router; devices.ports: 1, 2",
+        "devices.id: 2; devices.name: switch; devices.uplink.speed: 10G",
+        "site: lab",
+    ]
+
+
+def test_xml_records_are_the_repeating_elements_then_the_rest():
+    (document,) = load_xml(fixture("catalog.xml"))
+    assert document.page_content.split("\n") == [
+        "@id: b1; name: TCP/IP Illustrated; year: 1994",
+        "@id: b2; name: Computer Networks; year: 1981",
+        "@id: b3; name: Routing TCP/IP",
+        "@owner: library; title: Network books",
+    ]
+
+
+def test_xml_without_repeating_elements_is_yielded_as_it_is_read(tmp_path):
+    path = tmp_path / "settings.xml"
+    count = structured_loaders.RECORD_FIELDS * 3
+    path.write_text("<settings>" + "".join(f"<option{i}>{i}</option{i}>" for i in range(count)) + "</settings>")
+
+    records = list(xml_records(str(path)))
+
+    assert len(records) >= 3
+    assert all(len(record) <= structured_loaders.RECORD_FIELDS for record in records)
+    assert [value for record in records for _, value in record] == [str(i) for i in range(count)]
+
+
+def write_xlsx(path, shared, rows):
+    """A workbook whose cells refer to shared strings by index; rows maps row number to indexes"""
+    main = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("xl/workbook.xml",
+                         f'<workbook xmlns="{main}" '
+                         'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                         '<sheets><sheet name="Hosts" sheetId="1" r:id="rId1"/></sheets></workbook>')
+        archive.writestr("xl/_rels/workbook.xml.rels",
+                         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                         '<Relationship Id="rId1" Target="worksheets/sheet1.xml"/></Relationships>')
+        archive.writestr("xl/sharedStrings.xml",
+                         f'<sst xmlns="{main}">' + "".join(f"<si><t>{text}</t></si>" for text in shared) + "</sst>")
+        archive.writestr("xl/worksheets/sheet1.xml",
+                         f'<worksheet xmlns="{main}"><sheetData>' + "".join(
+                             f'<row r="{number}">' + "".join(
+                                 f'<c r="{chr(65 + column)}{number}" t="s"><v>{index}</v></c>'
+                                 for column, index in enumerate(indexes)) + "</row>"
+                             for number, indexes in rows.items()) + "</sheetData></worksheet>")
+
+
+def test_xlsx_resolves_shared_strings_and_keeps_sheet_row_numbers(tmp_path):
+    path = tmp_path / "hosts.xlsx"
+    write_xlsx(path, ["host", "status", "router1", "up", "router2", "down"],
+               {1: [0, 1], 2: [2, 3], 5: [4, 5], 6: [2, 5]})
+
+    (document,) = load_xlsx(str(path))
+
+    assert document.metadata["header"] == "Sheet: Hosts\nhost\tstatus"
+    assert document.metadata["row_start"] == 2
+    assert document.page_content.split("\n") == ["router1\tup", "", "", "router2\tdown", "router1\tdown"]
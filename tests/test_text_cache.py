@@ -0,0 +1,94 @@
+"""
+Parsed-text cache: entries stored as documents are read, reused and re-parsed when damaged
+"""
+
+import gzip
+import os
+
+import pytest
+from langchain_core.documents import Document
+
+from RAG.text_cache import ParsedTextCache
+
+KEY = "ab" * 32 + "-4"
+
+
+def parse():
+    return (Document(page_content=f"page {i} " * 50, metadata={"source": "/tmp/report.pdf", "page": i})
+            for i in range(20))
+
+
+def store(cache):
+    return list(cache.put(KEY, parse(), "report.pdf"))
+
+
+def test_a_stored_entry_is_read_back_under_the_path_being_indexed(tmp_path):
+    cache = ParsedTextCache(str(tmp_path))
+    assert cache.get(KEY) is None
+    parsed = store(cache)
+
+    cached = list(cache.get(KEY, "renamed.pdf"))
+
+    assert [document.page_content for document in cached] == [document.page_content for document in parsed]
+    assert [document.metadata for document in cached] == [{"source": "renamed.pdf", "page": i} for i in range(20)]
+    stats = cache.stats()
+    assert stats["entries"] == 1 and stats["hits"] == 1 and stats["misses"] == 1
+    assert stats["compression_ratio"] > 1
+
+
+def test_an_unfinished_parse_leaves_no_entry(tmp_path):
+    cache = ParsedTextCache(str(tmp_path))
+    documents = cache.put(KEY, parse(), "report.pdf")
+    next(documents)
+    documents.close()
+
+    assert cache.get(KEY) is None
+    assert cache.stats()["entries"] == 0
+
+
+@pytest.mark.parametrize("damage", ["truncate", "garble"])
+def test_a_damaged_entry_is_deleted_and_parsed_again(tmp_path, damage):
+    cache = ParsedTextCache(str(tmp_path))
+    store(cache)
+    path = cache._path(KEY)
+    if damage == "truncate":
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) // 2)
+    else:
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            f.write('{"text": "page 0", "metadata": {"source": "/tmp/report.pdf", "page": 0}}\nnot json\n')
+
+    documents = list(cache.get(KEY, "report.pdf", parse))
+
+    # Documents read before the damage are not repeated
+    assert [document.metadata["page"] for document in documents] == list(range(20))
+    assert cache.stats()["corrupt"] == 1
+    assert [document.metadata["page"] for document in cache.get(KEY, "report.pdf")] == list(range(20))
+    assert cache.stats()["corrupt"] == 1
+
+
+def test_a_damaged_entry_without_a_parser_raises_and_is_deleted(tmp_path):
+    cache = ParsedTextCache(str(tmp_path))
+    store(cache)
+    with open(cache._path(KEY), "wb") as f:
+        f.write(b"not gzip")
+
+    with pytest.raises(OSError):
+        list(cache.get(KEY))
+    assert cache.get(KEY) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_prune_drops_entries_no_upload_points_at(tmp_path):
+    uploads = tmp_path / "uploads"
+    uploads.mkdir()
+    (uploads / "report.pdf").write_bytes(b"%PDF")
+    cache = ParsedTextCache(str(tmp_path / "cache"))
+    store(cache)
+    list(cache.put("cd" * 32 + "-4", parse(), "deleted.pdf"))
+
+    entries, size = cache.prune(str(uploads))
+
+    assert entries == 1 and size > 0
+    assert cache.get("cd" * 32 + "-4") is None
+    assert cache.get(KEY) is not None
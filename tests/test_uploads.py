@@ -0,0 +1,98 @@
+"""
+Chunked uploads: offsets, resuming after a dropped connection or a restart, limits and finished uploads
+"""
+
+import hashlib
+import io
+import time
+
+import pytest
+
+from RAG.uploads import UploadLimitError, UploadOffsetError, UploadSessions
+
+DATA = bytes(range(256)) * 40
+
+
+class DroppedStream(io.BytesIO):
+    """A request body whose connection drops after limit bytes"""
+
+    def __init__(self, data, limit):
+        super().__init__(data)
+        self.limit = limit
+
+    def read(self, size=-1):
+        if self.tell() >= self.limit:
+            raise ConnectionError("connection reset")
+        return super().read(min(size, self.limit - self.tell()))
+
+
+def make_sessions(tmp_path, **options):
+    return UploadSessions(str(tmp_path), **dict({"block_size": 1000}, **options))
+
+
+def test_an_upload_resumes_where_a_dropped_chunk_stopped(tmp_path):
+    sessions = make_sessions(tmp_path)
+    upload_id = sessions.create("data.bin", len(DATA))["upload_id"]
+
+    with pytest.raises(ConnectionError):
+        sessions.append(upload_id, 0, DroppedStream(DATA, 3500))
+    assert sessions.status(upload_id)["offset"] == 3500
+    with pytest.raises(UploadOffsetError) as error:
+        sessions.append(upload_id, 0, io.BytesIO(DATA))
+    assert error.value.offset == 3500
+
+    status = sessions.append(upload_id, 3500, io.BytesIO(DATA[3500:]))
+    assert status["complete"] and status["sha256"] == hashlib.sha256(DATA).hexdigest()
+    assert sessions.finish(upload_id) == "data.bin"
+    assert (tmp_path / "data.bin").read_bytes() == DATA
+
+
+def test_an_upload_is_picked_up_again_after_a_restart(tmp_path):
+    upload_id = make_sessions(tmp_path).create("data.bin", len(DATA))["upload_id"]
+    sessions = make_sessions(tmp_path)
+    sessions.append(upload_id, 0, io.BytesIO(DATA[:2000]))
+
+    restarted = make_sessions(tmp_path)
+    assert restarted.status(upload_id)["offset"] == 2000
+    status = restarted.append(upload_id, 2000, io.BytesIO(DATA[2000:]))
+    assert status["sha256"] == hashlib.sha256(DATA).hexdigest()
+    assert restarted.stats()["restored"] == 1
+
+
+def test_uploads_in_progress_are_limited(tmp_path):
+    sessions = make_sessions(tmp_path, max_sessions=2)
+    first = sessions.create("a.txt", 3)["upload_id"]
+    sessions.create("b.txt", 3)
+    with pytest.raises(UploadLimitError):
+        sessions.create("c.txt", 3)
+    # The limit holds across restarts too
+    with pytest.raises(UploadLimitError):
+        make_sessions(tmp_path, max_sessions=2).create("c.txt", 3)
+
+    sessions.append(first, 0, io.BytesIO(b"abc"))
+    sessions.finish(first)
+    assert sessions.create("c.txt", 3)["offset"] == 0
+
+
+def test_a_finished_upload_reports_its_outcome_until_it_expires(tmp_path):
+    sessions = make_sessions(tmp_path)
+    stored = sessions.create("a.txt", 3)["upload_id"]
+    sessions.append(stored, 0, io.BytesIO(b"abc"))
+    sessions.finish(stored)
+    resent = sessions.create("a.txt", 3)["upload_id"]
+    sessions.append(resent, 0, io.BytesIO(b"abc"))
+    sessions.discard(resent, unchanged=True)
+    cancelled = sessions.create("b.txt", 3)["upload_id"]
+    sessions.discard(cancelled)
+
+    for upload_id, unchanged in ((stored, False), (resent, True)):
+        status = make_sessions(tmp_path).status(upload_id)
+        assert status["finished"] and status["complete"] and status["unchanged"] is unchanged
+        assert status["offset"] == 3 and status["sha256"] == hashlib.sha256(b"abc").hexdigest()
+    with pytest.raises(KeyError):
+        sessions.status(cancelled)
+
+    time.sleep(0.01)
+    make_sessions(tmp_path, expiry=0).expire()
+    with pytest.raises(KeyError):
+        sessions.status(stored)
@@ -0,0 +1,227 @@
+"""
+Vector index: search index rebuilds over segments of random vectors
+"""
+
+import os
+import time
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+pytest.importorskip("langchain_community")
+
+from RAG.index_types import PQ_MIN_TRAIN, IndexPolicy, factory_key
+from RAG.vector_index import IndexGeneration, Segment, VectorIndex
+from tests.stub_ollama import fake_embedding
+
+DIM = 16
+
+
+def make_index(tmp_path, **policy):
+    policy = IndexPolicy(**dict({"rebuild_delay": 3600}, **policy))
+    return VectorIndex(str(tmp_path / "uploads"), str(tmp_path / "index"), None, "test-model", policy=policy)
+
+
+def write_file(index, rng, name, chunks):
+    """Index a file of chunks with random vectors, returning the vectors"""
+    documents = [Document(page_content=f"{name} chunk {i}", metadata={"source": name, "chunk_index": i})
+                 for i in range(chunks)]
+    vectors = rng.random((chunks, DIM), dtype='float32')
+    index.replace_file(name, {"mtime": time.time(), "size": 0, "sha256": name}, index.stage(documents, vectors))
+    return vectors
+
+
+def test_a_flat_uncompressed_rebuild_reads_no_vectors(tmp_path, monkeypatch):
+    index = make_index(tmp_path, index_type="flat")
+    rng = np.random.default_rng(0)
+    for n in range(3):
+        write_file(index, rng, f"file{n}.txt", 50)
+
+    def fail(self):
+        raise AssertionError("vectors copied for a flat index")
+
+    monkeypatch.setattr(Segment, "live_vectors", fail)
+    monkeypatch.setattr(IndexGeneration, "live_vectors", fail)
+    info = index.rebuild_search_index()
+
+    assert info["type"] == "flat" and info["vectors"] == 150
+    assert index.search_index is None
+
+
+@pytest.mark.parametrize("compression", [None, "sq8"])
+def test_an_approximate_index_is_measured_on_a_sample_of_queries(tmp_path, compression):
+    index = make_index(tmp_path, index_type="hnsw", compression=compression, eval_queries=20, eval_k=5)
+    rng = np.random.default_rng(0)
+    vectors = np.concatenate([write_file(index, rng, f"file{n}.txt", 400) for n in range(3)])
+
+    info = index.rebuild_search_index()
+
+    assert info["type"] == "hnsw" and info["eval_queries"] == 20
+    assert info["recall_at_k"] >= 0.9
+    if compression:
+        assert info["recall_at_k"] >= info["recall_at_k_without_rerank"]
+    # Searches through the new index find a stored vector's own chunk first
+    (distance, document), = index.scored_search("", k=1, mode="vector", vector=vectors[500])["vector"]
+    assert document.page_content == "file1.txt chunk 100" and distance == pytest.approx(0.0, abs=1e-5)
+    assert index.set_search_params(ef_search=16)["ef_search"] == 16
+
+
+def nearest(index, vector):
+    (_, document), = index.scored_search("", k=1, mode="vector", vector=vector)["vector"]
+    return document.page_content
+
+
+def test_rewriting_a_file_tombstones_its_old_chunks(tmp_path):
+    index = make_index(tmp_path)
+    rng = np.random.default_rng(0)
+    old = write_file(index, rng, "a.txt", 10)
+    write_file(index, rng, "b.txt", 10)
+    new = write_file(index, rng, "a.txt", 10)
+
+    # The old records stay in the docstore until a compaction, but are never returned
+    stats = index.stats()
+    assert stats["vectors"] == 20 and stats["storage"]["docstore_lines"] == 30
+    for vector in old:
+        (distance, _), = index.scored_search("", k=1, mode="vector", vector=vector)["vector"]
+        assert distance > 1e-3
+    assert [nearest(index, vector) for vector in new] == [f"a.txt chunk {i}" for i in range(10)]
+    assert index.search("b.txt chunk 3", k=1, mode="keyword")[0].page_content == "b.txt chunk 3"
+
+
+def test_small_segments_are_merged_as_they_pile_up(tmp_path):
+    index = make_index(tmp_path)
+    rng = np.random.default_rng(0)
+    vectors = [write_file(index, rng, f"file{n}.txt", 4) for n in range(64)]
+
+    assert index.stats()["storage"]["segments"] <= 7
+    assert nearest(index, vectors[37][2]) == "file37.txt chunk 2"
+
+
+def test_compaction_keeps_offsets_for_live_chunks_only(tmp_path):
+    index = make_index(tmp_path)
+    rng = np.random.default_rng(0)
+    for _ in range(3):
+        vectors = write_file(index, rng, "big.txt", 600)
+
+    stats = index.stats()["storage"]
+    assert stats["compactions"] == 1 and stats["tombstoned"] == 0 and stats["docstore_lines"] == 600
+    docstore = index.docstore
+    assert docstore.count == 1800
+    assert os.path.getsize(docstore.offsets_path) == 600 * 16
+    assert os.path.getsize(docstore.ids_path) == 600 * 8
+
+    # Ids appended after a compaction are read past the compacted ones
+    small = write_file(index, rng, "small.txt", 5)
+    assert os.path.getsize(index.docstore.offsets_path) == 605 * 16
+    assert nearest(index, vectors[599]) == "big.txt chunk 599"
+    assert nearest(index, small[4]) == "small.txt chunk 4"
+
+
+def test_a_reopened_index_keeps_its_chunks_tombstones_and_compaction(tmp_path):
+    index = make_index(tmp_path)
+    rng = np.random.default_rng(0)
+    for _ in range(3):
+        big = write_file(index, rng, "big.txt", 600)
+    write_file(index, rng, "gone.txt", 5)
+    kept = write_file(index, rng, "kept.txt", 5)
+    index.remove_file("gone.txt")
+    # A write that never committed leaves bytes past the sizes in the metadata
+    with open(index.docstore.path, "ab") as f:
+        f.write(b'{"partial": ')
+
+    reopened = make_index(tmp_path)
+
+    assert len(reopened) == 605
+    assert sorted(reopened.manifest) == ["big.txt", "kept.txt"]
+    assert reopened.stats()["storage"]["tombstoned"] == 5
+    assert nearest(reopened, big[123]) == "big.txt chunk 123"
+    assert nearest(reopened, kept[0]) == "kept.txt chunk 0"
+    assert all(document.metadata["source"] != "gone.txt"
+               for document in reopened.search("gone.txt chunk", k=20, mode="keyword"))
+
+
+class CountingEmbeddings:
+    """Embeds texts by hash, recording every text it was asked for"""
+
+    def __init__(self):
+        self.texts = []
+
+    def embed_documents(self, texts):
+        self.texts.extend(texts)
+        return [fake_embedding(text, DIM) for text in texts]
+
+    def embed_query(self, text):
+        return fake_embedding(text, DIM)
+
+
+def read_text(path):
+    with open(path) as f:
+        return [Document(page_content=f.read(), metadata={"source": path})]
+
+
+def text_index(tmp_path, embeddings):
+    return VectorIndex(str(tmp_path / "uploads"), str(tmp_path / "index"), embeddings, "test-model",
+                       parser=read_text)
+
+
+def test_refresh_embeds_only_files_changed_since_the_index_was_saved(tmp_path):
+    uploads = tmp_path / "uploads"
+    uploads.mkdir()
+    for n in range(3):
+        (uploads / f"doc{n}.txt").write_text(f"document {n} about routers")
+    embeddings = CountingEmbeddings()
+    assert text_index(tmp_path, embeddings).refresh()
+    assert sorted(embeddings.texts) == [f"document {n} about routers" for n in range(3)]
+
+    (uploads / "doc1.txt").write_text("document 1, now about switches")
+    (uploads / "doc2.txt").unlink()
+    reopened = text_index(tmp_path, embeddings)
+
+    assert reopened.refresh()
+    assert embeddings.texts[3:] == ["document 1, now about switches"]
+    assert sorted(reopened.manifest) == ["doc0.txt", "doc1.txt"]
+    assert reopened.search("switches", k=1, mode="keyword")[0].metadata["source"] == "doc1.txt"
+    assert not reopened.refresh()
+
+
+def test_a_mapped_index_answers_like_one_read_into_memory(tmp_path):
+    index = make_index(tmp_path)
+    rng = np.random.default_rng(0)
+    vectors = np.concatenate([write_file(index, rng, f"file{n}.txt", 40) for n in range(4)])
+    queries = rng.random((10, DIM), dtype='float32')
+
+    mapped = make_index(tmp_path)
+    loaded = VectorIndex(str(tmp_path / "uploads"), str(tmp_path / "index"), None, "test-model", mmap=False,
+                         policy=IndexPolicy(rebuild_delay=3600))
+
+    # Mapped segments are read-only views of the files, loaded ones arrays of their own
+    assert not any(segment.ids.flags.writeable for segment in mapped.generation.segments)
+    assert all(segment.ids.flags.writeable for segment in loaded.generation.segments)
+    for query in np.concatenate([queries, vectors[::16]]):
+        results = [[(distance, document.page_content)
+                    for distance, document in side.scored_search("", k=5, mode="vector", vector=query)["vector"]]
+                   for side in (mapped, loaded)]
+        assert results[0] == results[1]
+
+
+def test_product_quantized_codes_are_smaller_and_reranked_to_exact_results(tmp_path):
+    index = make_index(tmp_path, index_type="flat", compression="pq", eval_queries=50, eval_k=5)
+    rng = np.random.default_rng(0)
+    vectors = np.concatenate([write_file(index, rng, f"file{n}.txt", 2500) for n in range(4)])
+
+    info = index.rebuild_search_index()
+
+    assert info["compression"] == "pq" and info["factory"] == "PQ4"
+    # Four one-byte codes instead of sixteen float32 values
+    assert info["bytes_per_vector"] < info["exact_bytes_per_vector"] / 4
+    assert info["recall_at_k"] >= 0.9 and info["recall_at_k"] > info["recall_at_k_without_rerank"]
+    (distance, document), = index.scored_search("", k=1, mode="vector", vector=vectors[7777])["vector"]
+    assert document.page_content == "file3.txt chunk 277" and distance == pytest.approx(0.0, abs=1e-5)
+
+
+def test_too_few_vectors_for_pq_codebooks_fall_back_to_scalar_codes():
+    policy = IndexPolicy(compression="pq")
+    assert factory_key("hnsw", PQ_MIN_TRAIN - 1, 64, policy) == ("HNSW32,SQ8", "sq8")
+    assert factory_key("ivf", 100000, 64, policy) == ("IVF1264,PQ16", "pq")
+    assert factory_key("flat", 100000, 64, IndexPolicy(compression="opq")) == ("OPQ16,PQ16", "opq")
@@ -24,15 +24,19 @@ def ensure_upload_folder(folder_path):
     """Ensure upload folder exists"""
     os.makedirs(folder_path, exist_ok=True)
 
+def safe_filename(filename):
+    """The name an upload is stored under: its last path component, so it cannot escape the folder"""
+    return os.path.basename(filename)
+
 def safe_save_file(file, folder_path, filename):
     """Safely save uploaded file with path traversal protection"""
     # Prevent path traversal
-    safe_filename = os.path.basename(filename)
-    file_path = os.path.join(folder_path, safe_filename)
+    stored_name = safe_filename(filename)
+    file_path = os.path.join(folder_path, stored_name)
 
     # Verify path is safe
     if not os.path.commonprefix([os.path.realpath(file_path), os.path.realpath(folder_path)]) == os.path.realpath(folder_path):
         raise ValueError("Invalid file path")
 
     file.save(file_path)
-    return safe_filename
\ No newline at end of file
+    return stored_name
\ No newline at end of file